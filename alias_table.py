@@ -0,0 +1,47 @@
+import random  # For the picks
+
+
+class AliasTable:
+    """
+    picks an index at random, with the probability of its weight, in O(1) with Vose's alias method:
+    every index gets a column of height 1, made of its own share and of the overflow of one other index.
+    a pick draws a column and a height, building the table is O(n).
+    """
+
+    __slots__ = ('shares', 'aliases')
+
+    def __init__(self, weights):
+        """
+        :param weights: weight of every index, not negative and not all 0.
+        """
+        amount = len(weights)
+        total = sum(weights)
+        if amount == 0 or total <= 0:
+            raise ValueError('an alias table needs a positive weight.')
+        scaled = [weight * amount / total for weight in weights]
+        self.shares = [1.0] * amount  # part of the column of an index that picks the index itself
+        self.aliases = list(range(amount))  # index picked by the rest of the column
+        small = [index for index, share in enumerate(scaled) if share < 1]
+        large = [index for index, share in enumerate(scaled) if share >= 1]
+        while small and large:
+            index, alias = small.pop(), large[-1]
+            self.shares[index] = scaled[index]
+            self.aliases[index] = alias
+            scaled[alias] -= 1 - scaled[index]
+            if scaled[alias] < 1:
+                small.append(large.pop())
+        # what is left is 1 up to rounding errors, these columns keep picking their own index
+
+    def __len__(self):
+        return len(self.shares)
+
+    def pick(self, rand=random.random):
+        """
+        :param rand: function returning a float in [0, 1).
+        :return: an index, with the probability of its weight.
+        """
+        column = rand() * len(self.shares)
+        index = int(column)
+        if column - index < self.shares[index]:
+            return index
+        return self.aliases[index]
@@ -0,0 +1,161 @@
+import gzip  # For compressing full segments
+import json  # For the events, one JSON array per line
+import os
+import shutil  # For compressing a segment without reading it whole
+import threading  # For writing the log off the server loop
+import time
+import question_bank  # question keys
+
+FLUSH_INTERVAL = 1  # seconds between two writes of the queued events
+SEGMENT_SIZE = 64 * 2 ** 20  # bytes written to a segment before the writer starts the next one
+SEGMENT_SUFFIX = '.jsonl'
+COMPRESSED_SUFFIX = '.jsonl.gz'  # full segments are compressed by the writer
+KEY_CACHE_SIZE = 100000  # keys of bank file questions kept by the writer, the cache starts over when it is full
+# every answer is a JSON array on its own line, with these fields in this order. the question is
+# question_bank.question_key of its text, the same in every bank. the choice is the answer number as asked.
+EVENT_FIELDS = ('time', 'user', 'question', 'choice', 'correct', 'milliseconds')
+log_directory = None  # directory of the segments, None while the log is closed
+pending_events = list()  # (time, username, bank, question index, choice, correct, seconds) waiting for the writer
+pending_lock = threading.Lock()
+stop_writer = threading.Event()
+writer_thread = None
+log_stats = {'answer_events': 0, 'answer_events_dropped': 0, 'answer_segments': 0}  # counters of this process
+
+
+def open_answer_log(directory, segment_size=SEGMENT_SIZE):
+    """
+    starts the background writer of the answer log. every process writes its own segments, named after the time
+    it started them and its pid, so worker processes never share a file.
+    :param directory: directory of the segments, created if needed.
+    :param segment_size: bytes written to a segment before the next one is started.
+    :return: None.
+    """
+    global log_directory
+    global writer_thread
+    os.makedirs(directory, exist_ok=True)
+    log_directory = directory
+    stop_writer.clear()
+    writer_thread = threading.Thread(target=writer_loop, args=(directory, segment_size), name='answer-log-writer',
+                                     daemon=True)
+    writer_thread.start()
+
+
+def close_answer_log():
+    """
+    writes every queued event and closes the current segment.
+    :return: None.
+    """
+    global log_directory
+    global writer_thread
+    if writer_thread is not None:
+        stop_writer.set()
+        writer_thread.join()
+        writer_thread = None
+    log_directory = None
+
+
+def log_answer(username, bank, question_index, choice, correct, seconds):
+    """
+    queues an answer event for the writer, never waits for the disk. the question key is computed by the writer.
+    :param username: the user who answered.
+    :param bank: QuestionBank the question is from.
+    :param question_index: index of the question in the bank.
+    :param choice: the answer number the user chose.
+    :param correct: True if the answer is correct.
+    :param seconds: time the user took to answer.
+    :return: None.
+    """
+    if log_directory is None:
+        return
+    with pending_lock:
+        pending_events.append((time.time(), username, bank, question_index, choice, correct, seconds))
+
+
+def get_stats():
+    """
+    :return: dict of the answer log counters, for the metrics.
+    """
+    stats = dict(log_stats)
+    stats['answer_events_pending'] = len(pending_events)
+    return stats
+
+
+def new_segment_path(directory):
+    """
+    :param directory: directory of the segments.
+    :return: path of a new segment of this process.
+    """
+    log_stats['answer_segments'] += 1
+    return os.path.join(directory, f'answers-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                                   f'{log_stats["answer_segments"]}{SEGMENT_SUFFIX}')
+
+
+def compress_segment(path):
+    """
+    compresses a full segment next to it and removes it. a segment that can't be compressed is kept as it is.
+    :param path: path of the segment.
+    :return: None.
+    """
+    try:
+        with open(path, 'rb') as segment, gzip.open(path[:-len(SEGMENT_SUFFIX)] + COMPRESSED_SUFFIX, 'wb') as output:
+            shutil.copyfileobj(segment, output)
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def encode_events(events, keys):
+    """
+    :param events: queued events.
+    :param keys: cache of (bank generation, question index) -> question key, of the questions of bank files.
+    questions added after the file may differ between banks of the same generation, their keys are not cached.
+    :return: the lines of the events, encoded.
+    """
+    lines = list()
+    for answered_at, username, bank, question_index, choice, correct, seconds in events:
+        key = keys.get((bank.generation, question_index))
+        if key is None:
+            key = question_bank.question_key(bank.get_question(question_index)[0])
+            if question_index < bank.size:
+                if len(keys) >= KEY_CACHE_SIZE:
+                    keys.clear()
+                keys[(bank.generation, question_index)] = key
+        lines.append(json.dumps([round(answered_at, 3), username, key, choice, int(correct), round(seconds * 1000)],
+                                separators=(',', ':')))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def writer_loop(directory, segment_size):
+    """
+    background writer body, appends the queued events to the current segment every FLUSH_INTERVAL seconds,
+    and starts a new segment once the current one is full.
+    :param directory: directory of the segments.
+    :param segment_size: bytes written to a segment before the next one is started.
+    :return: None.
+    """
+    global pending_events
+    keys = dict()
+    segment_path = segment = None
+    stopping = False
+    while not stopping:
+        stopping = stop_writer.wait(FLUSH_INTERVAL)
+        with pending_lock:
+            events, pending_events = pending_events, list()
+        if not events:
+            continue
+        try:
+            if segment is None:
+                segment_path = new_segment_path(directory)
+                segment = open(segment_path, 'ab')
+            segment.write(encode_events(events, keys))
+            segment.flush()
+        except OSError:  # e.g. the disk is full, the events are lost but the server goes on
+            log_stats['answer_events_dropped'] += len(events)
+            continue
+        log_stats['answer_events'] += len(events)
+        if segment.tell() >= segment_size:
+            segment.close()
+            compress_segment(segment_path)
+            segment = None
+    if segment is not None:
+        segment.close()
@@ -0,0 +1,158 @@
+import argparse  # For the command line tool
+import gzip  # For the compressed segments of the answer log
+import json  # For the events and the stats file
+import os
+import answer_log  # segment names and event fields
+import question_bank  # difficulty names
+
+MIN_ANSWERS = 20  # answers a question needs before its difficulty is rated
+PRIOR_ANSWERS = 10  # answers at the overall accuracy added to every question, so a few answers don't decide its rating
+# least accuracy of every difficulty, easiest first: questions most users answer correctly are easy
+DIFFICULTY_ACCURACY = (('easy', 0.7), ('medium', 0.4), ('hard', 0.0))
+QUESTION_STATS_FILE = 'question_stats.json'
+
+
+def iter_segment_paths(paths):
+    """
+    :param paths: answer log directories and segment files.
+    :return: iterator of the segment files, the segments of a directory in name order (oldest first per process).
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for name in sorted(os.listdir(path)):
+            if name.endswith(answer_log.SEGMENT_SUFFIX) or name.endswith(answer_log.COMPRESSED_SUFFIX):
+                yield os.path.join(path, name)
+
+
+def iter_segment_lines(path):
+    """
+    reads a segment line by line, never whole. a compressed segment cut short by a crash ends where it was cut.
+    :param path: path of the segment, compressed or not.
+    :return: iterator of the lines.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    try:
+        with opener(path, 'rt', encoding='utf-8') as segment:
+            yield from segment
+    except (EOFError, OSError):
+        return
+
+
+def iter_events(paths):
+    """
+    :param paths: answer log directories and segment files.
+    :return: iterator of the answer events, lists in answer_log.EVENT_FIELDS order. lines cut short are skipped.
+    """
+    fields_amount = len(answer_log.EVENT_FIELDS)
+    for path in iter_segment_paths(paths):
+        for line in iter_segment_lines(path):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(event, list) and len(event) == fields_amount:
+                yield event
+
+
+def collect_stats(events, per_user=True):
+    """
+    sums the events up in one pass. memory grows with the questions and users in the log, not with its length.
+    :param events: iterator of answer events.
+    :param per_user: False to skip the per user counts, for logs of more users than fit in memory.
+    :return: dict with events, correct, questions (key -> [answers, correct, total milliseconds, {choice: answers}])
+    and users (username -> [answers, correct]).
+    """
+    questions = dict()
+    users = dict()
+    events_amount = correct_amount = 0
+    for answered_at, username, key, choice, correct, milliseconds in events:
+        events_amount += 1
+        correct_amount += correct
+        question = questions.get(key)
+        if question is None:
+            question = questions[key] = [0, 0, 0, dict()]
+        question[0] += 1
+        question[1] += correct
+        question[2] += milliseconds
+        choices = question[3]
+        choices[choice] = choices.get(choice, 0) + 1
+        if per_user:
+            user = users.get(username)
+            if user is None:
+                user = users[username] = [0, 0]
+            user[0] += 1
+            user[1] += correct
+    return {'events': events_amount, 'correct': correct_amount, 'questions': questions, 'users': users}
+
+
+def rate_difficulty(answers, correct, prior_accuracy, min_answers=MIN_ANSWERS):
+    """
+    :param answers: answers of the question.
+    :param correct: correct answers of the question.
+    :param prior_accuracy: accuracy of all the answers, PRIOR_ANSWERS at it are added to the question.
+    :param min_answers: answers the question needs to be rated.
+    :return: difficulty name, or None if the question has too few answers.
+    """
+    if answers < min_answers:
+        return None
+    accuracy = (correct + PRIOR_ANSWERS * prior_accuracy) / (answers + PRIOR_ANSWERS)
+    for difficulty, least_accuracy in DIFFICULTY_ACCURACY:
+        if accuracy >= least_accuracy:
+            return difficulty
+    return DIFFICULTY_ACCURACY[-1][0]
+
+
+def build_report(stats, min_answers=MIN_ANSWERS):
+    """
+    :param stats: collect_stats result.
+    :param min_answers: answers a question needs to get a difficulty.
+    :return: the stats file content: events, accuracy, and per question answers, correct, accuracy, difficulty,
+    mean milliseconds and answers per choice, and per user answers, correct and accuracy.
+    """
+    prior_accuracy = stats['correct'] / stats['events'] if stats['events'] else 0.5
+    questions = {key: {'answers': answers, 'correct': correct, 'accuracy': round(correct / answers, 4),
+                       'difficulty': rate_difficulty(answers, correct, prior_accuracy, min_answers),
+                       'milliseconds': round(milliseconds / answers), 'choices': choices}
+                 for key, (answers, correct, milliseconds, choices) in stats['questions'].items()}
+    users = {username: {'answers': answers, 'correct': correct, 'accuracy': round(correct / answers, 4)}
+             for username, (answers, correct) in stats['users'].items()}
+    return {'events': stats['events'], 'accuracy': round(prior_accuracy, 4), 'questions': questions, 'users': users}
+
+
+def write_report(report, path):
+    """
+    writes the stats file, next to the path and renamed over it so a server that reloads meanwhile reads
+    the old file or the new one.
+    :param report: build_report result.
+    :param path: path of the stats file.
+    :return: None.
+    """
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as stats_file:
+        json.dump(report, stats_file, separators=(',', ':'))
+    os.replace(temporary_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Computes question and user stats from the answer log.')
+    parser.add_argument('paths', nargs='+', help='answer log directories or segment files')
+    parser.add_argument('--output', default=QUESTION_STATS_FILE, help='stats file to write')
+    parser.add_argument('--min-answers', type=int, default=MIN_ANSWERS,
+                        help='answers a question needs before its difficulty is rated')
+    parser.add_argument('--no-users', action='store_true', help='skip the per user stats')
+    args = parser.parse_args()
+    report = build_report(collect_stats(iter_events(args.paths), not args.no_users), args.min_answers)
+    write_report(report, args.output)
+    rated = dict.fromkeys(question_bank.DIFFICULTIES, 0)
+    for question in report['questions'].values():
+        if question['difficulty'] is not None:
+            rated[question['difficulty']] += 1
+    print(f'{report["events"]} answers of {len(report["questions"])} questions by {len(report["users"])} users, '
+          f'accuracy {report["accuracy"]:.1%}. rated {", ".join(f"{n} {name}" for name, n in rated.items())}. '
+          f'written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
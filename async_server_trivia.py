@@ -0,0 +1,195 @@
+import argparse  # For the logging and metrics options
+import asyncio  # For serving every client connection as its own task
+import signal  # For reloading the question bank
+import time  # For the session activity timestamps
+import chatlib  # protocol functions
+import metrics  # counters and latency histograms of the server
+import server_side_trivia  # game state and the handle_*_message functions
+import answer_log  # every answer, for answer_stats.py
+import user_store  # users, scores and answers on disk
+
+SERVER_IP = server_side_trivia.SERVER_IP
+SERVER_PORT = server_side_trivia.SERVER_PORT
+LISTEN_BACKLOG = 4096  # pending connections the kernel may queue for us
+
+
+class StreamConnection:
+    """
+    socket-like wrapper around an asyncio StreamWriter, so the handle_*_message functions
+    of the select server can be reused without changes.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.peername = writer.get_extra_info('peername')
+        self.socket_fileno = writer.get_extra_info('socket').fileno()
+
+    def send(self, data):
+        # like a non-blocking socket, refuse data while the transport buffer is full.
+        if self.writer.transport.get_write_buffer_size() >= server_side_trivia.SEND_QUEUE_HIGH_WATER:
+            raise BlockingIOError('transport write buffer is full')
+        self.writer.write(data)
+        metrics.add_bytes_out(len(data))
+        return len(data)
+
+    def getpeername(self):
+        return self.peername
+
+    def fileno(self):
+        return self.socket_fileno
+
+    def close(self):
+        self.writer.close()
+
+    def recv(self, size):
+        # handlers must never block the event loop waiting for more input.
+        raise BlockingIOError('asyncio connections can not be read synchronously')
+
+
+async def handle_connection(reader, writer):
+    """
+    serves a single client until it disconnects or sends something we can't handle.
+    :param reader: asyncio StreamReader of the client.
+    :param writer: asyncio StreamWriter of the client.
+    :return: None.
+    """
+    conn = StreamConnection(writer)
+    writer.transport.set_write_buffer_limits(high=server_side_trivia.SEND_QUEUE_HIGH_WATER)
+    session = server_side_trivia.open_session(conn, conn.peername)
+    session.send_waiter = asyncio.Event()
+    writer_task = asyncio.create_task(write_send_queue(conn, session))
+    ssl_object = writer.get_extra_info('ssl_object')
+    if ssl_object is not None:  # asyncio finished the TLS handshake before calling us
+        server_side_trivia.tls_stats['tls_handshakes'] += 1
+        server_side_trivia.tls_stats['tls_resumed_handshakes'] += ssl_object.session_reused
+    server_side_trivia.logger.debug('New client has joined the server: %s', conn.peername)
+    try:
+        while True:
+            received = await reader.read(chatlib.MAX_MSG_LENGTH)
+            if not received:
+                break
+            metrics.add_bytes_in(len(received))
+            session.last_active = time.monotonic()
+            session.recv_buffer += received
+            # handle every message that arrived in this read before waiting on the socket again.
+            # the responses are written here, the writer task only wakes for data queued by others.
+            messages = list(chatlib.iter_frames(session.recv_buffer))
+            send_waiter, session.send_waiter = session.send_waiter, None
+            server_side_trivia.handle_client_messages(conn, messages)
+            session.send_waiter = send_waiter
+            if messages and messages[-1][0] is None:  # sent something we can't parse
+                break
+            if conn in server_side_trivia.slow_clients:
+                server_side_trivia.send_queue_stats['slow_clients_disconnected'] += 1
+                break
+            if not server_side_trivia.flush_send_queue(conn):
+                send_waiter.set()  # the transport buffer is full, the writer task waits for it to drain
+            if writer_task.done():  # a slow client, or the connection failed while writing
+                break
+    except ConnectionError:
+        pass
+    except Exception:
+        server_side_trivia.logger.exception('Failed handling client %s', conn.peername)
+    finally:
+        writer_task.cancel()
+        server_side_trivia.close_session(session)
+        writer.close()
+        server_side_trivia.logger.debug('Client socket closed: %s', conn.peername)
+
+
+async def write_send_queue(conn, session):
+    """
+    writes the send queue of a client whenever data is queued for it, also data queued by other clients,
+    timers and executor callbacks, so nothing waits for the client to send something first.
+    :param conn: StreamConnection of the client.
+    :param session: Session of the client.
+    :return: None, once the client is disconnected as a slow client or the connection failed.
+    """
+    writer = conn.writer
+    send_waiter = session.send_waiter
+    try:
+        while True:
+            await send_waiter.wait()
+            send_waiter.clear()
+            if conn in server_side_trivia.slow_clients:
+                server_side_trivia.send_queue_stats['slow_clients_disconnected'] += 1
+                break
+            while not server_side_trivia.flush_send_queue(conn):
+                await writer.drain()
+    except ConnectionError:
+        pass
+    writer.close()  # the read of handle_connection ends and it closes the session
+
+
+async def serve(host=SERVER_IP, port=SERVER_PORT):
+    """
+    starts the asyncio server and serves clients forever.
+    :param host: ip to listen on.
+    :param port: port to listen on.
+    :return: None.
+    """
+    tls_context = server_side_trivia.TLS_CONTEXT  # asyncio runs the handshakes, the login timeout bounds them too
+    handshake_timeout = (server_side_trivia.LOGIN_TIMEOUT or None) if tls_context is not None else None
+    server = await asyncio.start_server(handle_connection, host, port, reuse_address=True, backlog=LISTEN_BACKLOG,
+                                        ssl=tls_context, ssl_handshake_timeout=handshake_timeout)
+    server_side_trivia.logger.info('Listening for new clients...')
+    server_side_trivia.start_executor()
+    jobs = server_side_trivia.jobs
+    loop = asyncio.get_running_loop()
+    if jobs is not None:  # executor callbacks run on the event loop, like the handlers
+        loop.add_reader(jobs.fileno(), jobs.run_completions)
+    loop.add_signal_handler(signal.SIGHUP, server_side_trivia.reload_questions)
+    timers_task = asyncio.create_task(advance_timers_periodically())
+    async with server:
+        await server.serve_forever()
+    timers_task.cancel()
+
+
+async def advance_timers_periodically():
+    """
+    fires the expired session timeouts, every TIMER_TICK seconds.
+    :return: None.
+    """
+    while True:
+        server_side_trivia.timers.advance()
+        await asyncio.sleep(server_side_trivia.TIMER_TICK)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trivia server on asyncio.')
+    parser.add_argument('--log-level', default='info', choices=server_side_trivia.LOG_LEVELS.keys())
+    parser.add_argument('--log-async', action='store_true', help='write the log from a background thread')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port')
+    server_side_trivia.add_data_arguments(parser)
+    server_side_trivia.add_timeout_arguments(parser)
+    server_side_trivia.add_executor_arguments(parser)
+    server_side_trivia.add_login_arguments(parser)
+    server_side_trivia.add_tls_arguments(parser)
+    args = parser.parse_args()
+    server_side_trivia.setup_logging(args.log_level, args.log_async)
+    server_side_trivia.set_data_files(args)
+    server_side_trivia.set_timeouts(args)
+    server_side_trivia.set_tls(args.tls_cert, args.tls_key)
+    server_side_trivia.set_login_limits(args.login_rate_ip, args.login_rate_user, args.login_token_ttl)
+    server_side_trivia.set_admin_users(args.admins)
+    server_side_trivia.EXECUTOR_THREADS = args.executor_threads
+    server_side_trivia.EXECUTOR_QUEUE_SIZE = args.executor_queue
+    server_side_trivia.METRICS_PORT = args.metrics_port
+    server_side_trivia.users_information_dict = server_side_trivia.load_user_database()
+    server_side_trivia.load_leaderboard()
+    server_side_trivia.questions = server_side_trivia.load_questions()
+    server_side_trivia.start_executor()
+    server_side_trivia.start_question_refill()
+    server_side_trivia.start_metrics_endpoint()
+    server_side_trivia.start_answer_log()
+    server_side_trivia.logger.info('Welcome to Trivia Server! (asyncio)')
+    try:
+        asyncio.run(serve())
+    finally:
+        user_store.close_user_store()
+        answer_log.close_answer_log()
+        server_side_trivia.stop_logging()
+
+
+if __name__ == '__main__':
+    main()
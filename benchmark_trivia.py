@@ -0,0 +1,1147 @@
+import argparse  # For the benchmark options
+import asyncio  # For driving many client connections at once
+import contextlib  # For silencing the servers debug prints
+import io
+import json  # For the synthetic answer log
+import os
+import random
+import shutil  # For finding the openssl command line tool
+import multiprocessing  # For running the server under test in its own process
+import socket
+import sqlite3  # For the synchronous commit baseline of the user store benchmark
+import subprocess  # For generating the certificate of the TLS benchmark
+import tempfile  # For the user databases of the servers under test
+import threading  # For the callers of the client pool
+import time
+import timeit  # For the micro-benchmarks
+import tracemalloc  # For the peak memory of the answer stats
+import chatlib  # protocol functions
+import client_pool
+import client_side_trivia
+import server_side_trivia
+import async_server_trivia
+import leaderboard
+import user_store
+import question_order
+import question_bank
+import alias_table
+import answer_log
+import answer_stats
+import timer_wheel
+import tls
+
+BENCHMARK_IP = '127.0.0.1'
+BENCHMARK_QUESTIONS = {
+    1: {'question': 'What is 2 + 2?', 'answers': ['3', '4', '5', '22'], 'correct': 2},
+    2: {'question': 'Which planet is known as the red planet?', 'answers': ['Venus', 'Earth', 'Mars', 'Jupiter'],
+        'correct': 3},
+}
+BENCHMARK_COMMANDS = ['MY_SCORE', 'HIGHSCORE']
+WRITE_MIX_QUESTIONS = 100000  # questions of the worker servers, the write-heavy mix never runs out of them
+CONNECT_CONCURRENCY = 100  # connections opened at the same time, keeps us below the listen backlog
+BENCHMARK_DATABASE_FILE = os.path.join(tempfile.gettempdir(), f'trivia_benchmark_{os.getpid()}.db')
+STORM_CLIENTS = 10000  # clients that reconnect at once in the login benchmark
+PASSWORD_LOGINS = 200  # password logins of the login benchmark, every one costs a password hash
+login_tokens = dict()  # server port -> login token of the benchmark user on that server
+POOL_REQUESTS = 5000  # requests of every client in the pool benchmark
+PER_CALL_REQUESTS = 50  # requests of the client that connects and logs in for every request
+POOL_CALLERS = 8  # threads sharing the sync pool
+LOG_EVENTS = (1000000, 3000000)  # answer events of the synthetic answer logs
+TLS_CONNECTS = 1000  # connects of every kind in the TLS benchmark
+TLS_REQUESTS = 20000  # requests of every kind in the TLS benchmark
+TLS_PIPELINE = 100  # requests sent in one write in the TLS benchmark
+
+
+def prepare_server_state():
+    """
+    fills the server game state without going to the network for questions.
+    :return: None.
+    """
+    server_side_trivia.USER_DATABASE_FILE = BENCHMARK_DATABASE_FILE
+    server_side_trivia.set_login_limits(0, 0)  # every benchmark client comes from the same ip
+    server_side_trivia.users_information_dict = server_side_trivia.load_user_database()
+    server_side_trivia.load_leaderboard()
+    server_side_trivia.QUESTIONS_CACHE_FILE = None
+    server_side_trivia.load_questions()
+    server_side_trivia.add_questions(BENCHMARK_QUESTIONS.values())
+
+
+def run_select_server(port, cert_file=None, key_file=None):
+    """
+    process target, runs the select() server quietly on the given port.
+    :param port: port to listen on.
+    :param cert_file: PEM certificate to serve TLS with, None for plain TCP.
+    :param key_file: PEM private key of the certificate.
+    :return: None.
+    """
+    prepare_server_state()
+    server_side_trivia.SERVER_PORT = port
+    server_side_trivia.set_tls(cert_file, key_file)
+    with contextlib.redirect_stdout(io.StringIO()):
+        server_side_trivia.serve_select(server_side_trivia.setup_socket())
+
+
+def run_worker_servers(port, workers_amount):
+    """
+    process target, runs the select() server in workers_amount SO_REUSEPORT worker processes.
+    :param port: port to listen on.
+    :param workers_amount: amount of worker processes.
+    :return: None.
+    """
+    prepare_server_state()
+    server_side_trivia.add_questions([{'question': f'Worker question {index}?', 'answers': ['A', 'B', 'C', 'D'],
+                                       'correct': 1} for index in range(WRITE_MIX_QUESTIONS)])
+    server_side_trivia.SERVER_PORT = port
+    with contextlib.redirect_stdout(io.StringIO()):
+        server_side_trivia.run_workers(workers_amount)
+
+
+def run_async_server(port):
+    """
+    process target, runs the asyncio server quietly on the given port.
+    :param port: port to listen on.
+    :return: None.
+    """
+    prepare_server_state()
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(async_server_trivia.serve(BENCHMARK_IP, port))
+
+
+def wait_for_port(port, timeout=10):
+    """
+    blocks until something accepts connections on the port.
+    :param port: port to check.
+    :param timeout: seconds to wait before giving up.
+    :return: True if the port is open.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((BENCHMARK_IP, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+async def request(reader, writer, cmd, data):
+    """
+    sends one protocol message and reads the full response message.
+    :return: response command and data.
+    """
+    writer.write(chatlib.build_message(cmd, data).encode())
+    cmd_field = await reader.readuntil(b'|')  # UNACCEPTABLE_ANSWER is longer than the cmd field
+    length_field = await reader.readuntil(b'|')
+    body = await reader.readexactly(int(length_field[:-1]))
+    return chatlib.parse_message((cmd_field + length_field + body).decode())
+
+
+async def log_in(reader, writer, port):
+    """
+    logs the benchmark user in, with the login token of an earlier player on the same server if there is one.
+    :return: response command and data.
+    """
+    token = login_tokens.get(port)
+    if token is not None:
+        cmd, data = await request(reader, writer, 'RESUME', f'test#{token}#{chatlib.PROTOCOL_TEXT}')
+        if cmd == 'LOGIN_OK':
+            return cmd, data
+    cmd, data = await request(reader, writer, 'LOGIN', f'test#test#{chatlib.PROTOCOL_TEXT}')
+    fields = chatlib.decode_fields(cmd, data) if cmd == 'LOGIN_OK' else None
+    if fields and len(fields) > 1:
+        login_tokens[port] = fields[1]
+    return cmd, data
+
+
+async def open_player(port, semaphore):
+    """
+    connects and logs in one benchmark player.
+    :return: (reader, writer) or None if the server did not accept the player.
+    """
+    async with semaphore:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(BENCHMARK_IP, port), 10)
+            cmd, data = await asyncio.wait_for(log_in(reader, writer, port), 10)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+        if cmd != 'LOGIN_OK':
+            writer.close()
+            return None
+        return reader, writer
+
+
+async def open_players(port, clients):
+    """
+    connects and logs in the benchmark players. the first one logs in with the password
+    and the others with its login token, so they don't all wait for a password hash.
+    :return: list of (reader, writer) of the players the server accepted.
+    """
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    players = [await open_player(port, semaphore)]
+    players += await asyncio.gather(*[open_player(port, semaphore) for _ in range(clients - 1)])
+    return [player for player in players if player is not None]
+
+
+async def play(reader, writer, requests_amount, mix='read'):
+    """
+    sends requests_amount requests one after the other.
+    :param mix: 'read' for BENCHMARK_COMMANDS, 'write' for GET_QUESTION and SEND_ANSWER of the question,
+    every one of them writes the user question order or score.
+    :return: amount of requests answered.
+    """
+    answered = 0
+    try:
+        for i in range(requests_amount):
+            if mix == 'write' and i % 2:
+                cmd, data = await asyncio.wait_for(request(reader, writer, 'SEND_ANSWER', f'{question_id}#1'), 10)
+            elif mix == 'write':
+                cmd, data = await asyncio.wait_for(request(reader, writer, 'GET_QUESTION', ''), 10)
+                question_id = data.split('#')[0] if cmd == 'YOUR_QUESTION' else 0
+            else:
+                await asyncio.wait_for(request(reader, writer, BENCHMARK_COMMANDS[i % len(BENCHMARK_COMMANDS)], ''),
+                                       10)
+            answered += 1
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        pass
+    return answered
+
+
+async def load_server(port, clients, requests_amount, mix='read'):
+    """
+    opens all client connections, keeps them open together and then runs the request load.
+    :return: dict of results.
+    """
+    players = await open_players(port, clients)
+    start = time.perf_counter()
+    answered = await asyncio.gather(*[play(reader, writer, requests_amount, mix) for reader, writer in players])
+    elapsed = time.perf_counter() - start
+    for reader, writer in players:
+        writer.close()
+    return {'connections_held': len(players), 'requests': sum(answered),
+            'requests_per_sec': sum(answered) / elapsed if elapsed else 0.0}
+
+
+def benchmark_server(target, port, clients, requests_amount, target_args=(), mix='read'):
+    """
+    starts the server process, runs the load against it and stops it.
+    :return: dict of results.
+    """
+    server_process = multiprocessing.Process(target=target, args=(port,) + target_args, daemon=True)
+    server_process.start()
+    try:
+        if not wait_for_port(port):
+            return {'connections_held': 0, 'requests': 0, 'requests_per_sec': 0.0}
+        return asyncio.run(load_server(port, clients, requests_amount, mix))
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+
+def benchmark_engines(args):
+    """
+    compares the select() loop with the asyncio server.
+    """
+    print(f'{"engine":<10}{"clients":>10}{"held":>10}{"requests":>12}{"req/sec":>12}')
+    for name, target, port in (('select', run_select_server, args.port), ('asyncio', run_async_server, args.port + 1)):
+        result = benchmark_server(target, port, args.clients, args.requests)
+        print(f'{name:<10}{args.clients:>10}{result["connections_held"]:>10}{result["requests"]:>12}'
+              f'{result["requests_per_sec"]:>12.0f}')
+
+
+def benchmark_workers(args):
+    """
+    measures how the select() server scales with SO_REUSEPORT worker processes, with read requests and with
+    the write-heavy mix of GET_QUESTION and SEND_ANSWER.
+    """
+    print(f'{"mix":<8}{"workers":<10}{"clients":>10}{"held":>10}{"requests":>12}{"req/sec":>12}')
+    for mix in ('read', 'write'):
+        workers_amount = 1
+        while workers_amount <= args.workers:
+            result = benchmark_server(run_worker_servers, args.port + 2 * workers_amount + (mix == 'write'),
+                                      args.clients, args.requests, (workers_amount,), mix)
+            print(f'{mix:<8}{workers_amount:<10}{args.clients:>10}{result["connections_held"]:>10}'
+                  f'{result["requests"]:>12}{result["requests_per_sec"]:>12.0f}')
+            workers_amount *= 2
+
+
+def legacy_create_random_question(questions):
+    """
+    the question message as it was built for every GET_QUESTION before payloads were cached.
+    :return: encoded YOUR_QUESTION message.
+    """
+    answers_string = str()
+    random_question_tuple = random.choice(list(questions.items()))
+    for i in random_question_tuple[1]['answers']:
+        answers_string = answers_string + "#" + i
+    final_string = str(random_question_tuple[0]) + "#" + random_question_tuple[1]['question'] + answers_string
+    for encoded, decoded in {'&#039;': "'", '&quot;': '"', '&amp;': '&'}.items():
+        print(decoded)
+        final_string = final_string.replace(encoded, decoded)
+    return chatlib.build_message('YOUR_QUESTION', final_string).encode()
+
+
+def serve_cached_question():
+    """
+    gets the next unseen question of the benchmark user, and starts over once the user was asked all of them.
+    :return: encoded YOUR_QUESTION message.
+    """
+    payload = server_side_trivia.create_random_question('test')
+    if payload is None:
+        server_side_trivia.set_question_order('test', question_order.EMPTY_QUESTION_ORDER)
+        payload = server_side_trivia.create_random_question('test')
+    return payload
+
+
+def benchmark_questions(args):
+    """
+    micro-benchmark of serving a question, building the message per request vs the cached payloads.
+    """
+    print(f'{"questions":<12}{"per request (us)":>18}{"cached (us)":>14}')
+    for bank_size in (100, 1000, 10000):
+        server_side_trivia.QUESTIONS_CACHE_FILE = None
+        server_side_trivia.USER_DATABASE_FILE = BENCHMARK_DATABASE_FILE
+        server_side_trivia.users_information_dict = server_side_trivia.load_user_database()
+        question_list = [{'question': f'Question &quot;{i}&quot; isn&#039;t hard?',
+                          'answers': ['A &amp; B', 'C', 'D', 'E'], 'correct': 1} for i in range(bank_size)]
+        server_side_trivia.load_questions()
+        server_side_trivia.add_questions(question_list)
+        legacy_questions = dict(enumerate(question_list, 1))
+        with contextlib.redirect_stdout(io.StringIO()):
+            legacy = timeit.timeit(lambda: legacy_create_random_question(legacy_questions),
+                                   number=args.requests * 10) / (args.requests * 10)
+        cached = timeit.timeit(serve_cached_question, number=args.requests * 10) / (args.requests * 10)
+        print(f'{bank_size:<12}{legacy * 1e6:>18.2f}{cached * 1e6:>14.2f}')
+
+
+def legacy_highscore(users):
+    """
+    the HIGHSCORE table as it was built for every request before the leaderboard, a full sort of all users.
+    :return: list of the 3 top users.
+    """
+    user_list = [{'name': name, 'score': data['score']} for name, data in users.items()]
+    return sorted(user_list, key=lambda k: k['score'], reverse=True)[:3]
+
+
+def benchmark_leaderboard(args):
+    """
+    HIGHSCORE, rank and score update costs of the leaderboard vs sorting every user per request.
+    """
+    print(f'{"users":<10}{"full sort (us)":>16}{"top 10 (us)":>14}{"rank (us)":>12}{"update (us)":>14}')
+    for users_amount in (10 ** 4, 10 ** 5, 10 ** 6):
+        users = {f'user{i}': {'score': random.randrange(0, 10000, 5)} for i in range(users_amount)}
+        board = leaderboard.Leaderboard({name: data['score'] for name, data in users.items()})
+        names = random.choices(list(users), k=args.requests * 10)
+        sort_runs = max(1, 10 ** 6 // users_amount)
+        full_sort = timeit.timeit(lambda: legacy_highscore(users), number=sort_runs) / sort_runs
+        top = timeit.timeit(lambda: board.top(10), number=len(names)) / len(names)
+        rank = timeit.timeit(lambda: [board.rank(name) for name in names], number=1) / len(names)
+        update = timeit.timeit(lambda: [board.add_score(name, 5) for name in names], number=1) / len(names)
+        print(f'{users_amount:<10}{full_sort * 1e6:>16.1f}{top * 1e6:>14.2f}{rank * 1e6:>12.2f}{update * 1e6:>14.2f}')
+
+
+def benchmark_store(args):
+    """
+    cost of a score update on the server loop, a synchronous commit per update vs the write-behind user store.
+    """
+    updates = args.requests * 20
+    db = sqlite3.connect(BENCHMARK_DATABASE_FILE, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS scores (username TEXT PRIMARY KEY, score INTEGER NOT NULL)')
+    db.execute("INSERT OR REPLACE INTO scores VALUES ('test', 0)")
+    synchronous = timeit.timeit(lambda: db.execute("UPDATE scores SET score = score + 5 WHERE username = 'test'"),
+                                number=updates) / updates
+    db.close()
+    server_side_trivia.USER_DATABASE_FILE = BENCHMARK_DATABASE_FILE
+    server_side_trivia.users_information_dict = server_side_trivia.load_user_database()
+    server_side_trivia.load_leaderboard()
+    write_behind = timeit.timeit(lambda: server_side_trivia.add_user_score('test', 5), number=updates) / updates
+    start = time.perf_counter()
+    user_store.close_user_store()
+    final_flush = time.perf_counter() - start
+    print(f'{"commit per update (us)":<28}{synchronous * 1e6:>10.1f}')
+    print(f'{"write-behind update (us)":<28}{write_behind * 1e6:>10.1f}')
+    print(f'{"final group commit (ms)":<28}{final_flush * 1e3:>10.1f}')
+
+
+def benchmark_protocol(args):
+    """
+    bytes on the wire and parse time of typical messages, text protocol vs binary protocol version 2.
+    """
+    messages = [('LOGIN', 'test#test'), ('MY_SCORE', ''), ('YOUR_SCORE', '125'), ('SEND_ANSWER', '17#3'),
+                ('CORRECT_ANSWER', ''), ('YOUR_QUESTION', chatlib.join_data([2, BENCHMARK_QUESTIONS[2]['question']] +
+                                                                               BENCHMARK_QUESTIONS[2]['answers'])),
+                ('ALL_SCORE', '\n'.join(f'user{i} : {i * 5}' for i in range(10)))]
+    print(f'{"message":<16}{"text (bytes)":>14}{"binary (bytes)":>16}{"text (us)":>12}{"binary (us)":>13}')
+    batch = args.requests * 200  # messages received in one stream, parsed like the servers do
+    for cmd, data in messages:
+        text = chatlib.build_frame(cmd, data, chatlib.PROTOCOL_TEXT)
+        binary = chatlib.build_frame(cmd, data, chatlib.PROTOCOL_BINARY)
+        text_parse = timeit.timeit(lambda: list(chatlib.iter_frames(bytearray(text * batch))), number=1) / batch
+        binary_parse = timeit.timeit(lambda: list(chatlib.iter_frames(bytearray(binary * batch))), number=1) / batch
+        print(f'{cmd:<16}{len(text):>14}{len(binary):>16}{text_parse * 1e6:>12.2f}{binary_parse * 1e6:>13.2f}')
+
+
+def legacy_build_message(cmd, data):
+    """
+    build_message as it was before the precomputed headers, a list search and padding per message.
+    """
+    if cmd not in chatlib.ACCEPTABLE_COMMANDS:
+        return None
+    data_length = len(data.encode())
+    cmd_temp = cmd + ' ' * (16 - len(cmd))
+    return f'{cmd_temp}|{(4 - len(str(data_length))) * "0"}{data_length}|{data}'
+
+
+def legacy_split_data(msg, expected_fields):
+    """
+    split_data as it was before, counting the delimiters with a python loop.
+    """
+    found_fields = 0
+    for letter in msg:
+        if letter == '#':
+            found_fields += 1
+    return msg.split('#') if expected_fields == found_fields else None
+
+
+def legacy_join_data(msg_fields):
+    """
+    join_data as it was before, concatenating field by field.
+    """
+    string_to_return = ''
+    for i in msg_fields:
+        string_to_return = string_to_return + '#' + str(i)
+    return string_to_return[1:]
+
+
+def benchmark_codec(args):
+    """
+    micro-benchmark of every chatlib function, before and after the fast paths, at realistic data sizes.
+    """
+    number = args.requests * 200
+    print(f'{"function":<32}{"data (bytes)":>14}{"before (us)":>13}{"after (us)":>12}')
+    for data_length in (16, 256, 4096):
+        fields = ['x' * 7] * (data_length // 8)
+        data = chatlib.join_data(fields)
+        encoded_data = data.encode()
+        frame = chatlib.build_frame('ALL_SCORE', data)
+        buffer = bytearray()
+
+        def encode_into():
+            buffer.clear()
+            chatlib.encode_message_into(buffer, 'ALL_SCORE', encoded_data)
+
+        runs = [('build_message', lambda: legacy_build_message('ALL_SCORE', data),
+                 lambda: chatlib.build_message('ALL_SCORE', data)),
+                ('build_message / encode_into', lambda: legacy_build_message('ALL_SCORE', data).encode(),
+                 encode_into),
+                ('parse_message / parse_frame', lambda: chatlib.parse_message(frame.decode()),
+                 lambda: chatlib.parse_frame(frame)),
+                ('split_data', lambda: legacy_split_data(data, len(fields) - 1),
+                 lambda: chatlib.split_data(data, len(fields) - 1)),
+                ('join_data', lambda: legacy_join_data(fields), lambda: chatlib.join_data(fields))]
+        for name, before, after in runs:
+            before_time = timeit.timeit(before, number=number) / number
+            after_time = timeit.timeit(after, number=number) / number
+            print(f'{name:<32}{data_length:>14}{before_time * 1e6:>13.2f}{after_time * 1e6:>12.2f}')
+
+
+def legacy_reap_idle(last_active, now, idle_timeout):
+    """
+    the scan a server loop without timers would do every tick, looking at every session for idleness.
+    """
+    return [fileno for fileno, active in last_active.items() if now - active >= idle_timeout]
+
+
+def benchmark_timers(args):
+    """
+    cost of a timeout tick, scanning every session vs the timer wheel, with the idle timers spread over
+    IDLE_TIMEOUT and every fired timer set again (as for clients that stay active).
+    """
+    idle_timeout = server_side_trivia.IDLE_TIMEOUT
+    tick = server_side_trivia.TIMER_TICK
+    ticks = int(idle_timeout / tick)
+    print(f'{"sessions":<10}{"scan/tick (us)":>16}{"wheel/tick (us)":>17}{"schedule+cancel (us)":>22}')
+    for sessions_amount in (10 ** 3, 10 ** 4, 10 ** 5):
+        last_active = {fileno: random.uniform(0, idle_timeout) for fileno in range(sessions_amount)}
+        scan_runs = max(10, 10 ** 6 // sessions_amount)
+        scan = timeit.timeit(lambda: legacy_reap_idle(last_active, idle_timeout, idle_timeout),
+                             number=scan_runs) / scan_runs
+        wheel = timer_wheel.TimerWheel(tick)
+
+        def still_active():
+            wheel.schedule(idle_timeout, still_active)
+        for _ in range(sessions_amount):
+            wheel.schedule(random.uniform(0, idle_timeout), still_active)
+        started = time.perf_counter()
+        for current_tick in range(1, ticks + 1):
+            wheel.advance(wheel.start + current_tick * tick)
+        per_tick = (time.perf_counter() - started) / ticks
+        schedule_cancel = timeit.timeit(lambda: wheel.cancel(wheel.schedule(idle_timeout, still_active)),
+                                        number=10 ** 5) / 10 ** 5
+        print(f'{sessions_amount:<10}{scan * 1e6:>16.1f}{per_tick * 1e6:>17.2f}{schedule_cancel * 1e6:>22.2f}')
+
+
+async def answer_slowly(port, delay):
+    """
+    a player that sends an unacceptable answer and takes delay seconds to send a good one,
+    like a user retyping. the server used to wait for the retyped answer with a blocking read.
+    :return: the verdict of the second answer.
+    """
+    reader, writer = await asyncio.open_connection(BENCHMARK_IP, port)
+    await request(reader, writer, 'LOGIN', 'test#test')
+    cmd, data = await request(reader, writer, 'GET_QUESTION', '')
+    question_id = data.split('#', 1)[0]
+    await request(reader, writer, 'SEND_ANSWER', f'{question_id}#9')
+    await asyncio.sleep(delay)
+    cmd, data = await request(reader, writer, 'SEND_ANSWER', f'{question_id}#1')
+    writer.close()
+    return cmd
+
+
+async def measure_while_answering_slowly(port, clients, delay):
+    """
+    runs requests of the other players while one player answers slowly.
+    :return: (requests answered, latencies of the requests in seconds).
+    """
+    players = await open_players(port, clients)
+    latencies = list()
+
+    async def play_until(reader, writer, deadline):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await asyncio.wait_for(request(reader, writer, 'MY_SCORE', ''), delay * 2 + 10)
+            latencies.append(time.perf_counter() - started)
+
+    slow_player = asyncio.create_task(answer_slowly(port, delay))
+    await asyncio.sleep(0.1)  # let it send the unacceptable answer first
+    deadline = time.perf_counter() + delay
+    await asyncio.gather(*[play_until(reader, writer, deadline) for reader, writer in players])
+    await slow_player
+    for reader, writer in players:
+        writer.close()
+    return len(latencies), sorted(latencies)
+
+
+def benchmark_answers(args):
+    """
+    head-of-line blocking check: latency of the other players while one player takes seconds to retype an answer.
+    with a blocking read for the retyped answer no other request would be served until it arrives.
+    """
+    delay = 2
+    port = args.port
+    server_process = multiprocessing.Process(target=run_select_server, args=(port,), daemon=True)
+    server_process.start()
+    try:
+        if not wait_for_port(port):
+            return
+        answered, latencies = asyncio.run(measure_while_answering_slowly(port, min(args.clients, 100), delay))
+    finally:
+        server_process.terminate()
+        server_process.join()
+    print(f'{"slow answer (s)":<17}{"requests":>10}{"p50 (ms)":>10}{"p99 (ms)":>10}{"max (ms)":>10}')
+    print(f'{delay:<17}{answered:>10}{latencies[len(latencies) // 2] * 1e3:>10.2f}'
+          f'{latencies[int(len(latencies) * 0.99)] * 1e3:>10.2f}{latencies[-1] * 1e3:>10.2f}')
+
+
+def run_slow_store_server(port, executor_threads, load_seconds):
+    """
+    process target, runs the select() server with a user database that takes load_seconds for every read,
+    like a cold disk or a database on the network.
+    :param port: port to listen on.
+    :param executor_threads: EXECUTOR_THREADS of the server, 0 reads the database on the server loop.
+    :param load_seconds: time every user database read takes.
+    :return: None.
+    """
+    prepare_server_state()
+    load_user = user_store.load_user
+
+    def slow_load_user(username):
+        time.sleep(load_seconds)
+        return load_user(username)
+
+    user_store.load_user = slow_load_user
+    server_side_trivia.SERVER_PORT = port
+    server_side_trivia.EXECUTOR_THREADS = executor_threads
+    with contextlib.redirect_stdout(io.StringIO()):
+        server_side_trivia.serve_select(server_side_trivia.setup_socket())
+
+
+async def measure_during_logins(port, clients, duration, login_clients):
+    """
+    runs requests of logged in players while other clients keep logging in users that are not cached.
+    :return: (logins answered, latencies of the player requests in seconds).
+    """
+    players = await open_players(port, clients)
+    latencies = list()
+    logins = list()
+    deadline = time.perf_counter() + duration
+
+    async def play_until(reader, writer):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await asyncio.wait_for(request(reader, writer, 'MY_SCORE', ''), 30)
+            latencies.append(time.perf_counter() - started)
+
+    async def log_in_until(number):
+        reader, writer = await asyncio.open_connection(BENCHMARK_IP, port)
+        while time.perf_counter() < deadline:
+            await asyncio.wait_for(request(reader, writer, 'LOGIN', f'cold{number}_{len(logins)}#x'), 30)
+            logins.append(number)
+        writer.close()
+
+    await asyncio.gather(*[play_until(reader, writer) for reader, writer in players],
+                         *[log_in_until(number) for number in range(login_clients)])
+    for reader, writer in players:
+        writer.close()
+    return len(logins), sorted(latencies)
+
+
+def benchmark_jobs(args):
+    """
+    head-of-line blocking check: latency of logged in players while 8 clients log in users
+    whose database reads take 20ms, reading on the server loop vs on the executor threads.
+    """
+    load_seconds = 0.02
+    duration = 3
+    print(f'{"user reads":<14}{"logins":>8}{"requests":>10}{"p50 (ms)":>10}{"p99 (ms)":>10}{"max (ms)":>10}')
+    for name, executor_threads, port in (('server loop', 0, args.port), ('executor', 4, args.port + 1)):
+        server_process = multiprocessing.Process(target=run_slow_store_server,
+                                                 args=(port, executor_threads, load_seconds), daemon=True)
+        server_process.start()
+        try:
+            if not wait_for_port(port):
+                return
+            logins, latencies = asyncio.run(measure_during_logins(port, min(args.clients, 100), duration, 8))
+        finally:
+            server_process.terminate()
+            server_process.join()
+        print(f'{name:<14}{logins:>8}{len(latencies):>10}{latencies[len(latencies) // 2] * 1e3:>10.2f}'
+              f'{latencies[int(len(latencies) * 0.99)] * 1e3:>10.2f}{latencies[-1] * 1e3:>10.2f}')
+
+
+async def reconnect_storm(port, clients, cmd, data):
+    """
+    every client connects, logs in and disconnects, CONNECT_CONCURRENCY of them at a time.
+    :return: (logins accepted, seconds it took, sorted latencies of the logins in seconds).
+    """
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    latencies = list()
+
+    async def reconnect():
+        async with semaphore:
+            started = time.perf_counter()
+            reader, writer = await asyncio.open_connection(BENCHMARK_IP, port)
+            response_cmd, response_data = await asyncio.wait_for(request(reader, writer, cmd, data), 60)
+            writer.close()
+            if response_cmd == 'LOGIN_OK':
+                latencies.append(time.perf_counter() - started)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[reconnect() for _ in range(clients)])
+    return len(latencies), time.perf_counter() - start, sorted(latencies)
+
+
+async def login_storms(port):
+    """
+    a storm of password logins, then a storm of logins with the login token of the first one.
+    :return: list of (login with, clients, accepted, seconds, sorted latencies).
+    """
+    players = await open_players(port, 1)  # logs in with the password and keeps the token
+    rows = [('password', PASSWORD_LOGINS) + await reconnect_storm(
+                port, PASSWORD_LOGINS, 'LOGIN', f'test#test#{chatlib.PROTOCOL_TEXT}'),
+            ('login token', STORM_CLIENTS) + await reconnect_storm(
+                port, STORM_CLIENTS, 'RESUME', f'test#{login_tokens[port]}#{chatlib.PROTOCOL_TEXT}')]
+    for reader, writer in players:
+        writer.close()
+    return rows
+
+
+def benchmark_logins(args):
+    """
+    reconnect storm: STORM_CLIENTS clients reconnect at once. logging in with the password costs a password hash
+    on the executor per client, logging in with the login token of an earlier login is a dict lookup.
+    """
+    port = args.port
+    server_process = multiprocessing.Process(target=run_select_server, args=(port,), daemon=True)
+    server_process.start()
+    try:
+        if not wait_for_port(port):
+            return
+        rows = asyncio.run(login_storms(port))
+    finally:
+        server_process.terminate()
+        server_process.join()
+    print(f'{"login with":<13}{"clients":>9}{"accepted":>10}{"logins/s":>10}{"p50 (ms)":>10}{"p99 (ms)":>10}')
+    for name, clients, accepted, seconds, latencies in rows:
+        print(f'{name:<13}{clients:>9}{accepted:>10}{accepted / seconds:>10.0f}'
+              f'{latencies[len(latencies) // 2] * 1e3:>10.2f}{latencies[int(len(latencies) * 0.99)] * 1e3:>10.2f}')
+
+
+class NullConnection:
+    """
+    socket stand-in for the fan-out benchmark, takes everything sent to it at once.
+    """
+
+    def __init__(self, fileno):
+        self.fd = fileno
+
+    def fileno(self):
+        return self.fd
+
+    def send(self, data):
+        return len(data)
+
+
+def call_with_new_connection(port, cmd):
+    """
+    what a script using client_side_trivia pays for one request: connect, log in with the password, ask, close.
+    :return: the server response, (cmd, data).
+    """
+    conn = socket.create_connection((BENCHMARK_IP, port))
+    try:
+        client_side_trivia.login_user(conn, 'test', 'test')
+        return client_side_trivia.send_recv_command(conn, cmd)
+    finally:
+        conn.close()
+        for connection_dict in (client_side_trivia.recv_buffers, client_side_trivia.protocol_versions,
+                                client_side_trivia.login_tokens):
+            connection_dict.pop(conn, None)
+
+
+def call_on_one_connection(port, requests_amount):
+    """
+    one client_side_trivia connection, every request waits for the response of the one before it.
+    :return: None.
+    """
+    conn = socket.create_connection((BENCHMARK_IP, port))
+    client_side_trivia.login_user(conn, 'test', 'test')
+    for _ in range(requests_amount):
+        client_side_trivia.send_recv_command(conn, 'MY_SCORE')
+    conn.close()
+
+
+def call_from_threads(pool, requests_amount):
+    """
+    POOL_CALLERS threads share the pool, every thread waits for the response of its request before the next one.
+    :return: None.
+    """
+    def call():
+        for _ in range(requests_amount // POOL_CALLERS):
+            pool.request('MY_SCORE')
+
+    callers = [threading.Thread(target=call) for _ in range(POOL_CALLERS)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+
+
+async def call_async_pool(port, requests_amount):
+    """
+    every request is made at once from the asyncio pool, they are on the way together on its connections.
+    :return: None.
+    """
+    async with client_pool.AsyncClientPool('test', 'test', address=(BENCHMARK_IP, port)) as pool:
+        await asyncio.gather(*[pool.request('MY_SCORE') for _ in range(requests_amount)])
+
+
+def benchmark_pool(args):
+    """
+    requests/sec of a client that connects for every request, of one connection that waits for every response,
+    and of the client pool: shared by threads, pipelined, and the asyncio pool.
+    """
+    port = args.port
+    server_process = multiprocessing.Process(target=run_select_server, args=(port,), daemon=True)
+    server_process.start()
+    try:
+        if not wait_for_port(port):
+            return
+        rows = list()
+
+        def measure(name, requests_amount, function, *function_args):
+            start = time.perf_counter()
+            function(*function_args)
+            rows.append((name, requests_amount, time.perf_counter() - start))
+
+        measure('connection per call', PER_CALL_REQUESTS,
+                lambda: [call_with_new_connection(port, 'MY_SCORE') for _ in range(PER_CALL_REQUESTS)])
+        measure('one connection', POOL_REQUESTS, call_on_one_connection, port, POOL_REQUESTS)
+        with client_pool.ClientPool('test', 'test', address=(BENCHMARK_IP, port)) as pool:
+            pool.request('MY_SCORE')  # waits for the connections
+            measure(f'pool, {POOL_CALLERS} threads', POOL_REQUESTS, call_from_threads, pool, POOL_REQUESTS)
+            measure('pool, pipelined', POOL_REQUESTS,
+                    lambda: [future.result() for future in [pool.submit('MY_SCORE') for _ in range(POOL_REQUESTS)]])
+        measure('asyncio pool', POOL_REQUESTS, asyncio.run, call_async_pool(port, POOL_REQUESTS))
+    finally:
+        server_process.terminate()
+        server_process.join()
+    print(f'{"client":<22}{"requests":>10}{"requests/s":>12}{"ms/request":>12}')
+    for name, requests_amount, seconds in rows:
+        print(f'{name:<22}{requests_amount:>10}{requests_amount / seconds:>12.0f}'
+              f'{seconds / requests_amount * 1e3:>12.3f}')
+
+
+def benchmark_reload(args):
+    """
+    cost of a question bank reload at 10k/100k/1M questions: building the bank from the questions
+    (what a JSON/CSV file costs on top of parsing it) vs mapping a bank file.
+    """
+    bank_path = os.path.join(tempfile.gettempdir(), f'trivia_benchmark_{os.getpid()}{question_bank.BANK_FILE_SUFFIX}')
+    print(f'{"questions":<12}{"build (ms)":>12}{"map file (ms)":>15}{"file (MB)":>11}')
+    try:
+        for bank_size in (10000, 100000, 1000000):
+            question_list = [{'question': f'Question {i} isn&#039;t hard?', 'answers': ['A &amp; B', 'C', 'D', 'E'],
+                              'correct': i % 4 + 1} for i in range(bank_size)]
+            start = time.perf_counter()
+            built = question_bank.build_bank(question_list)
+            build_seconds = time.perf_counter() - start
+            question_bank.write_bank_file(bank_path, question_list)
+            start = time.perf_counter()
+            mapped = question_bank.open_bank_file(bank_path)
+            mapped.get_payload(bank_size - 1)
+            map_seconds = time.perf_counter() - start
+            assert bytes(mapped.get_payload(7)) == bytes(built.get_payload(7))
+            print(f'{bank_size:<12}{build_seconds * 1e3:>12.1f}{map_seconds * 1e3:>15.3f}'
+                  f'{os.path.getsize(bank_path) / 2 ** 20:>11.1f}')
+    finally:
+        if os.path.exists(bank_path):
+            os.remove(bank_path)
+
+
+def synthetic_questions(bank_size, categories_amount):
+    """
+    :param bank_size: amount of questions.
+    :param categories_amount: amount of categories, the first ones have more questions.
+    :return: list of question dicts with categories and difficulties, half of them easy.
+    """
+    weights = [1 / (category + 1) for category in range(categories_amount)]
+    categories = random.choices(range(categories_amount), weights, k=bank_size)
+    difficulties = random.choices(question_bank.DIFFICULTIES, (5, 3, 2), k=bank_size)
+    return [{'question': f'Question {i}?', 'answers': ['A', 'B', 'C', 'D'], 'correct': i % 4 + 1,
+             'category': f'Category {category}', 'difficulty': difficulty}
+            for i, category, difficulty in zip(range(bank_size), categories, difficulties)]
+
+
+def legacy_select_question(question_list, category, difficulty):
+    """
+    a filtered question without an index, scanning the bank for the questions that match.
+    :return: the question dict.
+    """
+    return random.choice([question for question in question_list if (category is None or
+                          question['category'] == category) and (difficulty is None or
+                          question['difficulty'] == difficulty)])
+
+
+def serve_selected_question(category, difficulty):
+    """
+    gets the next unseen question of the selection for the benchmark user, starting over once it was all asked.
+    :return: bank index of the question.
+    """
+    question_index = server_side_trivia.next_question_index('test', category, difficulty)
+    if question_index is None:
+        server_side_trivia.get_user('test')['question_orders'].clear()
+        question_index = server_side_trivia.next_question_index('test', category, difficulty)
+    return question_index
+
+
+def benchmark_selection(args):
+    """
+    cost of GET_QUESTION with a category and/or difficulty filter on a synthetic bank of 100k/1M questions in
+    24 categories, scanning the questions per request vs the bank index, and of picking a difficulty by weight.
+    """
+    bank_path = os.path.join(tempfile.gettempdir(), f'trivia_benchmark_{os.getpid()}{question_bank.BANK_FILE_SUFFIX}')
+    server_side_trivia.QUESTIONS_CACHE_FILE = None
+    server_side_trivia.USER_DATABASE_FILE = BENCHMARK_DATABASE_FILE
+    server_side_trivia.users_information_dict = server_side_trivia.load_user_database()
+    print(f'{"questions":<12}{"filter":<24}{"matching":>10}{"scan (us)":>14}{"index (us)":>12}')
+    try:
+        for bank_size in (100000, 1000000):
+            question_list = synthetic_questions(bank_size, 24)
+            question_bank.write_bank_file(bank_path, question_list)
+            server_side_trivia.questions = bank = question_bank.open_bank_file(bank_path)
+            common, rare = bank.category_ids['Category 0'], bank.category_ids['Category 23']
+            filters = [('none', None, None, None, None), ('category', 'Category 0', None, common, None),
+                       ('category#difficulty', 'Category 23', 'hard', rare, 2), ('adaptive', None, None, None, None)]
+            scans = [timeit.timeit(lambda: legacy_select_question(question_list, category, difficulty),
+                                   number=5) / 5 for name, category, difficulty, category_id, difficulty_id in filters]
+            question_list = None  # the server keeps the questions in the bank file, not in a million dicts
+            for (name, category, difficulty, category_id, difficulty_id), scan in zip(filters, scans):
+                server_side_trivia.ADAPTIVE_DIFFICULTY = name == 'adaptive'
+                index = timeit.timeit(lambda: serve_selected_question(category_id, difficulty_id),
+                                      number=args.requests * 1000) / (args.requests * 1000)
+                print(f'{bank_size:<12}{name:<24}{bank.count(category_id, difficulty_id):>10}{scan * 1e6:>14.0f}'
+                      f'{index * 1e6:>12.2f}')
+        weights = server_side_trivia.get_difficulty_weights(200)
+        table = alias_table.AliasTable(weights)
+        choices = timeit.timeit(lambda: random.choices(range(len(weights)), weights), number=100000) / 100000
+        alias = timeit.timeit(table.pick, number=100000) / 100000
+        print(f'difficulty pick: random.choices {choices * 1e6:.2f}us, alias table {alias * 1e6:.2f}us')
+    finally:
+        server_side_trivia.ADAPTIVE_DIFFICULTY = True
+        if os.path.exists(bank_path):
+            os.remove(bank_path)
+
+
+def legacy_log_answer(log_file, username, question, choice, correct, seconds):
+    """
+    an answer written to the log on the server loop, encoded and flushed before the loop goes on.
+    """
+    log_file.write(json.dumps([round(time.time(), 3), username, question_bank.question_key(question), choice,
+                               int(correct), round(seconds * 1000)], separators=(',', ':')).encode() + b'\n')
+    log_file.flush()
+
+
+def write_synthetic_log(directory, first_event, events_amount, questions_amount, users_amount):
+    """
+    adds random answers first_event...events_amount to an answer log, in segments of a million events.
+    """
+    keys = [question_bank.question_key(f'Question {index}?') for index in range(questions_amount)]
+    for segment_number in range(first_event, events_amount, 1000000):
+        with open(os.path.join(directory, f'answers-benchmark-{segment_number:09}{answer_log.SEGMENT_SUFFIX}'),
+                  'w') as segment:
+            for event_number in range(segment_number, min(events_amount, segment_number + 1000000)):
+                choice = random.randint(1, 4)
+                segment.write(f'[{1.7e9 + event_number:.3f},"user{random.randrange(users_amount)}",'
+                              f'"{random.choice(keys)}","{choice}",{int(choice == 2)},{random.randrange(15000)}]\n')
+
+
+def measure_stats(function):
+    """
+    :return: seconds and peak traced memory of a run of function.
+    """
+    started = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    try:
+        function()
+        return seconds, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_answerlog(args):
+    """
+    cost of logging an answer on the server loop, written and flushed there vs queued for the answer log writer,
+    and events/sec and peak memory of the answer stats over synthetic logs of 1M/3M events, loading the log whole
+    before summing it up vs streaming it.
+    """
+    directory = tempfile.mkdtemp(prefix='trivia_benchmark_')
+    bank = question_bank.build_bank(list(BENCHMARK_QUESTIONS.values()))
+    question = BENCHMARK_QUESTIONS[1]['question']
+    runs = args.requests * 1000
+    try:
+        with open(os.path.join(directory, 'legacy.jsonl'), 'wb') as log_file:
+            legacy = timeit.timeit(lambda: legacy_log_answer(log_file, 'test', question, '2', True, 1.5),
+                                   number=runs) / runs
+        answer_log.open_answer_log(directory)
+        try:
+            queued = timeit.timeit(lambda: answer_log.log_answer('test', bank, 0, '2', True, 1.5), number=runs) / runs
+        finally:
+            answer_log.close_answer_log()
+        print(f'answer logged on the loop: written {legacy * 1e6:.2f}us, queued {queued * 1e6:.2f}us '
+              f'({answer_log.get_stats()["answer_events"]} events written by the writer)')
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        print(f'{"events":<10}{"loaded (ev/s)":>15}{"peak (MB)":>11}{"streamed (ev/s)":>17}{"peak (MB)":>11}')
+        written = 0
+        for events_amount in LOG_EVENTS:
+            write_synthetic_log(directory, written, events_amount, 10000, 100000)
+            written = events_amount
+            loaded = measure_stats(lambda: answer_stats.collect_stats(list(answer_stats.iter_events([directory]))))
+            streamed = measure_stats(lambda: answer_stats.collect_stats(answer_stats.iter_events([directory])))
+            print(f'{events_amount:<10}{events_amount / loaded[0]:>15.0f}{loaded[1] / 2 ** 20:>11.0f}'
+                  f'{events_amount / streamed[0]:>17.0f}{streamed[1] / 2 ** 20:>11.0f}')
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+def generate_certificate(directory, name, key_options):
+    """
+    generates a self-signed certificate for BENCHMARK_IP with the openssl command line tool.
+    :param name: name of the certificate files.
+    :param key_options: openssl req options of the key, e.g. ['-newkey', 'rsa:2048'].
+    :return: (certificate file, key file).
+    """
+    cert_file, key_file = os.path.join(directory, f'{name}.pem'), os.path.join(directory, f'{name}.key')
+    subprocess.run(['openssl', 'req', '-x509'] + key_options + ['-nodes', '-keyout', key_file, '-out', cert_file,
+                    '-days', '1', '-subj', '/CN=trivia benchmark', '-addext', f'subjectAltName=IP:{BENCHMARK_IP}'],
+                   check=True, capture_output=True)
+    return cert_file, key_file
+
+
+def connect_benchmark_client(port, context=None, resume=False):
+    """
+    :param context: client ssl.SSLContext, None for plain TCP.
+    :param resume: resume the TLS session of the last connection, else make a full handshake.
+    :return: connected socket, the TLS handshake is done.
+    """
+    conn = socket.create_connection((BENCHMARK_IP, port))
+    if context is None:
+        return conn
+    if resume:
+        return tls.wrap_client_socket(context, conn, BENCHMARK_IP)
+    return context.wrap_socket(conn, server_hostname=BENCHMARK_IP)
+
+
+def call_with_handshake(port, context=None, resume=False):
+    """
+    what a reconnect costs before the login: connect, the TLS handshake, one request that needs no login, close.
+    :return: None.
+    """
+    conn = connect_benchmark_client(port, context, resume)
+    try:
+        conn.sendall(chatlib.build_frame('LOGGED', ''))
+        buffer = bytearray()
+        while chatlib.pop_frame(buffer) is None:
+            buffer += conn.recv(chatlib.MAX_MSG_LENGTH)
+        if resume:
+            tls.save_session(conn)
+    finally:
+        conn.close()
+
+
+def measure_transport(port, context=None):
+    """
+    :param context: client ssl.SSLContext, None for plain TCP.
+    :return: dict of measurement name -> seconds.
+    """
+    times = dict()
+    kinds = [('connect', False)] if context is None else [('full handshake', False), ('resumed handshake', True)]
+    for name, resume in kinds:
+        call_with_handshake(port, context, resume)  # a session to resume
+        start = time.perf_counter()
+        for _ in range(TLS_CONNECTS):
+            call_with_handshake(port, context, resume)
+        times[name] = time.perf_counter() - start
+    conn = connect_benchmark_client(port, context)
+    try:
+        client_side_trivia.login_user(conn, 'test', 'test')
+        start = time.perf_counter()
+        for _ in range(TLS_REQUESTS):
+            client_side_trivia.send_recv_command(conn, 'MY_SCORE')
+        times['one at a time'] = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(TLS_REQUESTS // TLS_PIPELINE):
+            client_side_trivia.build_send_recv_parse_pipelined(conn, [('MY_SCORE', '')] * TLS_PIPELINE)
+        times['pipelined'] = time.perf_counter() - start
+    finally:
+        conn.close()
+        for connection_dict in (client_side_trivia.recv_buffers, client_side_trivia.protocol_versions,
+                                client_side_trivia.login_tokens):
+            connection_dict.pop(conn, None)
+    return times
+
+
+def benchmark_tls(args):
+    """
+    cost of TLS on the select() server with self-signed P-256 and RSA 2048 certificates: connects/sec with
+    plain TCP, a full TLS handshake and a resumed one (session ticket, no certificate and no signature),
+    and requests/sec on one logged in connection, one request at a time and TLS_PIPELINE requests per write.
+    """
+    if shutil.which('openssl') is None:
+        print('the TLS benchmark needs the openssl command line tool.')
+        return
+    directory = tempfile.mkdtemp(prefix='trivia_benchmark_')
+    try:
+        servers = [('plain TCP', (), None)]
+        for name, key_options in (('TLS P-256', ['-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1']),
+                                  ('TLS RSA 2048', ['-newkey', 'rsa:2048'])):
+            certificate = generate_certificate(directory, name.split()[-1], key_options)
+            servers.append((name, certificate, tls.create_client_context(certificate[0])))
+        rows = dict()
+        for name, server_args, context in servers:
+            server_process = multiprocessing.Process(target=run_select_server, args=(args.port,) + server_args,
+                                                     daemon=True)
+            server_process.start()
+            try:
+                if not wait_for_port(args.port):
+                    return
+                rows[name] = measure_transport(args.port, context)
+            finally:
+                server_process.terminate()
+                server_process.join()
+    finally:
+        shutil.rmtree(directory)
+    print(f'{"server":<14}{"connect":<19}{"connects/s":>12}{"ms/connect":>12}')
+    for server, times in rows.items():
+        for name in ('connect', 'full handshake', 'resumed handshake'):
+            if name in times:
+                print(f'{server:<14}{name:<19}{TLS_CONNECTS / times[name]:>12.0f}'
+                      f'{times[name] / TLS_CONNECTS * 1e3:>12.3f}')
+    print(f'{"server":<14}{"one at a time (req/s)":>23}{"pipelined (req/s)":>19}')
+    for server, times in rows.items():
+        print(f'{server:<14}{TLS_REQUESTS / times["one at a time"]:>23.0f}{TLS_REQUESTS / times["pipelined"]:>19.0f}')
+
+
+def legacy_broadcast(members, cmd, data):
+    """
+    the fan-out without broadcast(), building and encoding the message for every member.
+    """
+    for session in list(members):
+        server_side_trivia.build_and_send_message(session.conn, cmd, data)
+        server_side_trivia.flush_send_queue(session.conn)
+
+
+def benchmark_rooms(args):
+    """
+    cost of sending a room question to every member, encoding it per member vs once for the whole room.
+    """
+    prepare_server_state()
+    question = BENCHMARK_QUESTIONS[1]
+    data = chatlib.join_data([1, 15, 1, question['question']] + question['answers'])
+    print(f'{"members":<10}{"per member (ms)":>17}{"encoded once (ms)":>19}')
+    for members_amount in (100, 1000, 10000):
+        members = [server_side_trivia.open_session(NullConnection(10 ** 6 + i), ('benchmark', i))
+                   for i in range(members_amount)]
+        runs = max(3, 10 ** 5 // members_amount)
+        per_member = timeit.timeit(lambda: legacy_broadcast(members, 'ROOM_QUESTION', data), number=runs) / runs
+        once = timeit.timeit(lambda: server_side_trivia.broadcast(members, 'ROOM_QUESTION', data),
+                             number=runs) / runs
+        print(f'{members_amount:<10}{per_member * 1e3:>17.3f}{once * 1e3:>19.3f}')
+        for session in members:
+            server_side_trivia.close_session(session)
+
+
+BENCHMARKS = {
+    'engines': benchmark_engines,
+    'workers': benchmark_workers,
+    'questions': benchmark_questions,
+    'leaderboard': benchmark_leaderboard,
+    'store': benchmark_store,
+    'protocol': benchmark_protocol,
+    'codec': benchmark_codec,
+    'timers': benchmark_timers,
+    'answers': benchmark_answers,
+    'rooms': benchmark_rooms,
+    'jobs': benchmark_jobs,
+    'logins': benchmark_logins,
+    'pool': benchmark_pool,
+    'reload': benchmark_reload,
+    'selection': benchmark_selection,
+    'answerlog': benchmark_answerlog,
+    'tls': benchmark_tls,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trivia server benchmarks.')
+    parser.add_argument('benchmark', nargs='?', default='engines', choices=BENCHMARKS.keys())
+    parser.add_argument('--clients', type=int, default=200, help='concurrent client connections')
+    parser.add_argument('--requests', type=int, default=50, help='requests sent by each client')
+    parser.add_argument('--port', type=int, default=5700, help='first port used by the servers under test')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='max worker processes')
+    args = parser.parse_args()
+    try:
+        BENCHMARKS[args.benchmark](args)
+    finally:
+        user_store.close_user_store()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(BENCHMARK_DATABASE_FILE + suffix):
+                os.remove(BENCHMARK_DATABASE_FILE + suffix)
+
+
+if __name__ == '__main__':
+    main()
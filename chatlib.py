@@ -1,30 +1,118 @@
 # Protocol Constants
 CMD_FIELD_LENGTH = 16  # Exact length of cmd field (in bytes)
 LENGTH_FIELD_LENGTH = 4  # Exact length of length field (in bytes)
-MAX_DATA_LENGTH = 10 ** LENGTH_FIELD_LENGTH - 1  # Max size of data field according to protocol
+MAX_DATA_LENGTH = 10 ** LENGTH_FIELD_LENGTH - 1  # Max size of data field according to protocol (in characters)
 MSG_HEADER_LENGTH = CMD_FIELD_LENGTH + 1 + LENGTH_FIELD_LENGTH + 1  # Exact size of header (CMD+LENGTH fields)
 MAX_MSG_LENGTH = MSG_HEADER_LENGTH + MAX_DATA_LENGTH  # Max size of total message
 DELIMITER = "|"  # Delimiter character in protocol
 DATA_DELIMITER = "#"  # Delimiter in the data part of the message
-ACCEPTABLE_COMMANDS = ['LOGIN', 'LOGOUT', 'LOGGED', 'GET_QUESTION', 'SEND_ANSWER', 'MY_SCORE', 'HIGHSCORE', 'LOGIN_OK',
-                       'LOGGED_ANSWER', 'YOUR_QUESTION', 'CORRECT_ANSWER', 'WRONG_ANSWER', 'UNACCEPTABLE_ANSWER',
-                       'YOUR_SCORE', 'ALL_SCORE', 'ERROR', 'NO_QUESTIONS']
+CLIENT = 'client'  # sender of a command
+SERVER = 'server'
+TEXT = None  # fields of a command whose data is free text, that may hold the delimiters
+
+
+class Command:
+    """
+    a command of the protocol: who sends it, whether the user has to be logged in, and the schema of its data,
+    the converter (str, int, float) of every data field in order.
+    """
+
+    __slots__ = ('name', 'sender', 'key', 'fields', 'required_fields', 'repeat_last', 'login_required')
+
+    def __init__(self, name, sender, key, fields=(), required_fields=None, repeat_last=False, login_required=False):
+        """
+        :param name: the command, as sent on the wire.
+        :param sender: CLIENT or SERVER.
+        :param key: name of the command in PROTOCOL_CLIENT / PROTOCOL_SERVER.
+        :param fields: converters of the data fields, or TEXT.
+        :param required_fields: fields that must be sent, the ones after them are optional. all of them by default.
+        :param repeat_last: the last field may be sent any amount of times, e.g. the answers of a question.
+        :param login_required: the server refuses the command until the client logs in.
+        """
+        self.name = name
+        self.sender = sender
+        self.key = key
+        self.fields = fields
+        self.required_fields = len(fields or ()) if required_fields is None else required_fields
+        self.repeat_last = repeat_last
+        self.login_required = login_required
+
+
+# Command registry, in opcode order. Only ever append commands, their place is their binary opcode.
+COMMAND_REGISTRY = (
+    Command('LOGIN', CLIENT, 'login_msg', (str, str, int), required_fields=2),  # username#password[#version]
+    Command('LOGOUT', CLIENT, 'logout_msg'),
+    Command('LOGGED', CLIENT, 'logged_answer_msg'),
+    Command('GET_QUESTION', CLIENT, 'get_question_msg', (str, str), required_fields=0,
+            login_required=True),  # [category[#difficulty]], empty for any
+    Command('SEND_ANSWER', CLIENT, 'send_answer_msg', (int, str), login_required=True),  # question_id#choice
+    Command('MY_SCORE', CLIENT, 'my_score_msg', login_required=True),
+    Command('HIGHSCORE', CLIENT, 'highscore_msg', (int,), required_fields=0),  # [amount]
+    Command('LOGIN_OK', SERVER, 'login_ok_msg', (int, str), required_fields=0),  # [version#login token]
+    Command('LOGGED_ANSWER', SERVER, 'logged_answer_msg', TEXT),
+    Command('YOUR_QUESTION', SERVER, 'your_question_msg', (int, str, str), required_fields=4, repeat_last=True),
+    Command('CORRECT_ANSWER', SERVER, 'correct_answer_msg', (int,), required_fields=0),  # [points]
+    Command('WRONG_ANSWER', SERVER, 'wrong_answer_msg'),
+    Command('UNACCEPTABLE_ANSWER', SERVER, 'unacceptable_answer_msg'),
+    Command('YOUR_SCORE', SERVER, 'your_score_msg', (int,)),
+    Command('ALL_SCORE', SERVER, 'all_score_msg', TEXT),
+    Command('ERROR', SERVER, 'error_msg', TEXT),
+    Command('NO_QUESTIONS', SERVER, 'no_questions_msg'),
+    Command('MY_RANK', CLIENT, 'my_rank_msg', login_required=True),
+    Command('YOUR_RANK', SERVER, 'your_rank_msg', (int, int)),  # rank#ranked players
+    Command('REGISTER', CLIENT, 'register_msg', (str, str)),  # username#password
+    Command('REGISTER_OK', SERVER, 'register_ok_msg'),
+    Command('STATS', CLIENT, 'stats_msg', (str,), required_fields=0),  # [metric name prefix]
+    Command('STATS_ANSWER', SERVER, 'stats_answer_msg', TEXT),
+    Command('JOIN_ROOM', CLIENT, 'join_room_msg', (str,), login_required=True),  # room name
+    Command('ROOM_JOINED', SERVER, 'room_joined_msg', (str, int)),  # room name#players
+    Command('LEAVE_ROOM', CLIENT, 'leave_room_msg', login_required=True),
+    Command('ROOM_LEFT', SERVER, 'room_left_msg'),
+    Command('START_ROUND', CLIENT, 'start_round_msg', login_required=True),
+    Command('ROUND_STARTED', SERVER, 'round_started_msg', (int,)),  # round number
+    # sent to every room member, not an answer to a request: round#seconds#question_id#question#answers...
+    Command('ROOM_QUESTION', SERVER, 'room_question_msg', (int, float, int, str, str), required_fields=6,
+            repeat_last=True),
+    Command('ROOM_ANSWER', CLIENT, 'room_answer_msg', (int, str), login_required=True),  # round#choice
+    Command('ROOM_ANSWER_OK', SERVER, 'room_answer_ok_msg'),
+    # sent to every room member, not an answer to a request: round#correct choice#answers#correct answers#name:points...
+    Command('ROUND_RESULT', SERVER, 'round_result_msg', (int, int, int, int, str), required_fields=4,
+            repeat_last=True),
+    Command('RESUME', CLIENT, 'resume_msg', (str, str, int), required_fields=2),  # username#login token[#version]
+    Command('RELOAD_QUESTIONS', CLIENT, 'reload_questions_msg', login_required=True),  # admins only
+    Command('QUESTIONS_RELOADED', SERVER, 'questions_reloaded_msg', (int, int)),  # bank generation#questions
+    Command('GET_CATEGORIES', CLIENT, 'get_categories_msg', login_required=True),
+    Command('CATEGORIES', SERVER, 'categories_msg', (str,), required_fields=0, repeat_last=True),  # category names
+)
+COMMANDS = {command.name: command for command in COMMAND_REGISTRY}
+ACCEPTABLE_COMMANDS = [command.name for command in COMMAND_REGISTRY]
+MAX_CMD_LENGTH = max(CMD_FIELD_LENGTH, *map(len, ACCEPTABLE_COMMANDS))  # Longest cmd field that can be received
+
+# Binary protocol (version 2): 1 byte opcode, varint data length, UTF-8 data.
+# Opcodes are below ord('A') and a text message starts with a command name, so both formats can share a stream.
+PROTOCOL_TEXT = 1
+PROTOCOL_BINARY = 2
+OPCODES = {cmd: opcode for opcode, cmd in enumerate(ACCEPTABLE_COMMANDS, 1)}  # Only ever append commands
+COMMANDS_BY_OPCODE = {opcode: cmd for cmd, opcode in OPCODES.items()}
+MAX_OPCODE = ord('A') - 1
+MAX_VARINT_LENGTH = 3  # Bytes of the length field, 7 bits each
+MAX_BINARY_DATA_LENGTH = 2 ** (7 * MAX_VARINT_LENGTH) - 1
+
+# Precomputed encodings, so messages are built and parsed with dict lookups instead of padding and searching
+CMD_FIELDS = {cmd: cmd.ljust(CMD_FIELD_LENGTH) + DELIMITER for cmd in ACCEPTABLE_COMMANDS}  # cmd -> padded cmd field
+ENCODED_CMD_FIELDS = {cmd: field.encode() for cmd, field in CMD_FIELDS.items()}
+COMMANDS_BY_FIELD = {field[:-1].encode(): cmd for cmd, field in CMD_FIELDS.items()}  # padded cmd field -> cmd
+COMMANDS_BY_FIELD.update((cmd.encode(), cmd) for cmd in ACCEPTABLE_COMMANDS)  # fields padded by other senders
+LENGTH_FIELD_FORMAT = f'%0{LENGTH_FIELD_LENGTH}d{DELIMITER}'
+MESSAGE_FORMAT = '%s' + LENGTH_FIELD_FORMAT + '%s'  # cmd field, data length, data
+ENCODED_LENGTH_FIELD_FORMAT = LENGTH_FIELD_FORMAT.encode()
+CONTINUATION_BYTES = bytes(range(0x80, 0xc0))  # UTF-8 bytes that don't start a character
 
 # Protocol Messages
 
-PROTOCOL_CLIENT = {
-    'login_msg': 'LOGIN',
-    'logout_msg': 'LOGOUT',
-    'my_score_msg': 'MY_SCORE',
-    'highscore_msg': 'HIGHSCORE',
-    'get_question_msg': 'GET_QUESTION',
-    'logged_answer_msg': 'LOGGED',
-    'send_answer_msg': 'SEND_ANSWER'
-}
-PROTOCOL_SERVER = {
-    'login_ok_msg': 'LOGIN_OK',
-    'login_failed_msg': 'ERROR'
-}
+PROTOCOL_CLIENT = {command.key: command.name for command in COMMAND_REGISTRY if command.sender == CLIENT}
+PROTOCOL_SERVER = {command.key: command.name for command in COMMAND_REGISTRY if command.sender == SERVER}
+PROTOCOL_SERVER['login_failed_msg'] = 'ERROR'
 
 # Other constants
 ERROR_RETURN = None  # What is returned in case of an error
@@ -39,12 +127,11 @@ def build_message(cmd, data):
     :param data: data of the command.
     :return: protocol message.
     """
-    if cmd not in ACCEPTABLE_COMMANDS:
+    data_length = len(data)
+    cmd_field = CMD_FIELDS.get(cmd)
+    if cmd_field is None or data_length > MAX_DATA_LENGTH:
         return ERROR_RETURN
-    else:
-        cmd_temp = cmd + ' '*(16 - len(cmd))  #checking cmd length to assemble cmd with rest spaces up to length of 16 bits.
-        message = f'{cmd_temp}|{(4-len(str(len(data)))) * "0"}{len(data)}|{data}'#calculate data length to insert to the middle part of the message.
-        return message
+    return MESSAGE_FORMAT % (cmd_field, data_length, data)
 
 
 def parse_message(data):
@@ -55,10 +142,10 @@ def parse_message(data):
     :return: command and data.
     """
     try:
-        cmd, msg_len, msg = data.split("|")
+        cmd, msg_len, msg = data.split("|", 2)  # the data itself may contain the delimiter
         stripped_cmd = cmd.strip()
         stripped_msg_len = msg_len.strip()
-        if int(stripped_msg_len) == len(msg) and stripped_cmd in ACCEPTABLE_COMMANDS:
+        if int(stripped_msg_len) == len(msg) and stripped_cmd in CMD_FIELDS:
             return stripped_cmd, msg
         else:
             return ERROR_RETURN, ERROR_RETURN
@@ -75,15 +162,9 @@ def split_data(msg, expected_fields):
     :param expected_fields: amount of | or # in the message to be expected.
     :return:
     """
-    found_fields = int()
-    for letter in msg:
-        if letter == "#":
-            found_fields += 1
-    if expected_fields == found_fields:
-        fields_to_return = msg.split('#')
-        return fields_to_return
-    else:
-        return ERROR_RETURN
+    if msg.count(DATA_DELIMITER) == expected_fields:
+        return msg.split(DATA_DELIMITER)
+    return ERROR_RETURN
 
 
 def join_data(msg_fields):
@@ -93,8 +174,281 @@ def join_data(msg_fields):
     :param msg_fields: list of strings to be joined.
     :return: one string with data delimiters between list values.
     """
-    string_to_return = str()
-    for i in msg_fields:
-        string_to_return = string_to_return + "#" + str(i)
-    string_to_return = (string_to_return[1:])
-    return string_to_return
+    return DATA_DELIMITER.join(map(str, msg_fields))
+
+
+def decode_fields(cmd, data):
+    """
+    Splits the data of a message into its fields and converts them, according to the command schema.
+    Returns: list of field values, the data itself for a free text command. None if the data does not match.
+    :param cmd: command name.
+    :param data: data of the message.
+    :return: list of fields.
+    """
+    command = COMMANDS.get(cmd)
+    if command is None:
+        return ERROR_RETURN
+    fields = command.fields
+    if fields is TEXT:
+        return [data]
+    if not data:
+        return [] if command.required_fields == 0 else ERROR_RETURN
+    values = data.split(DATA_DELIMITER)
+    if len(values) < command.required_fields or (len(values) > len(fields) and not command.repeat_last):
+        return ERROR_RETURN
+    last = len(fields) - 1
+    try:
+        for i, value in enumerate(values):
+            convert = fields[i if i < last else last]
+            if convert is not str:
+                values[i] = convert(value)
+    except ValueError:
+        return ERROR_RETURN
+    return values
+
+
+def encode_fields(cmd, fields):
+    """
+    Checks field values against the command schema and joins them into the data of a message.
+    Returns: the data string, or None if the fields do not match the schema.
+    :param cmd: command name.
+    :param fields: list of field values, or a list holding the data of a free text command.
+    :return: data of the message.
+    """
+    command = COMMANDS.get(cmd)
+    if command is None:
+        return ERROR_RETURN
+    if command.fields is TEXT:
+        return str(fields[0]) if len(fields) == 1 else ERROR_RETURN
+    schema = command.fields
+    if len(fields) < command.required_fields or (len(fields) > len(schema) and not command.repeat_last):
+        return ERROR_RETURN
+    last = len(schema) - 1
+    for i, value in enumerate(fields):
+        convert = schema[i if i < last else last]
+        if convert is str:
+            if not isinstance(value, str) or DATA_DELIMITER in value:
+                return ERROR_RETURN
+        elif isinstance(value, bool) or not isinstance(value, (int, float) if convert is float else int):
+            return ERROR_RETURN
+    return join_data(fields)
+
+
+def count_characters(data):
+    """
+    Counts the characters of UTF-8 encoded data. The length field of the text protocol counts characters,
+    only the binary protocol counts bytes.
+    :param data: bytes or bytearray.
+    :return: amount of characters.
+    """
+    if data.isascii():
+        return len(data)
+    return len(data.translate(None, CONTINUATION_BYTES))
+
+
+def get_text_data_end(buffer, start, characters):
+    """
+    Finds where the data of a text message ends in the buffer, given its length field.
+    Returns: the position right after the data, or 0 if the data did not fully arrive yet.
+    :param buffer: bytes/bytearray of received data.
+    :param start: where the data starts in the buffer.
+    :param characters: the length field of the message.
+    :return: end of the data.
+    """
+    position = start
+    while characters:
+        end = position + characters
+        if end > len(buffer):
+            return 0
+        characters -= count_characters(buffer[position:end])
+        position = end
+    if position == start or buffer[position - 1] < 0x80:
+        return position  # ends with an ASCII character, the common case
+    while position < len(buffer) and 0x80 <= buffer[position] < 0xc0:
+        position += 1  # the rest of the last character
+    lead = position - 1
+    while lead > start and 0x80 <= buffer[lead] < 0xc0:
+        lead -= 1
+    width = 2 if buffer[lead] < 0xe0 else 3 if buffer[lead] < 0xf0 else 4
+    if position == len(buffer) and lead + width > position:
+        return 0
+    return position
+
+
+def encode_message_into(buffer, cmd, data, version=PROTOCOL_TEXT):
+    """
+    Appends a message to a caller supplied buffer, without building any intermediate string.
+    Returns: the amount of bytes appended, or None if error occured (nothing is appended then).
+    :param buffer: bytearray to append the message to, e.g. a send buffer.
+    :param cmd: command name.
+    :param data: data of the command, already encoded (bytes, bytearray or memoryview).
+    :param version: PROTOCOL_TEXT or PROTOCOL_BINARY.
+    :return: message length.
+    """
+    data_length = len(data)
+    start = len(buffer)
+    if version == PROTOCOL_BINARY:
+        opcode = OPCODES.get(cmd)
+        if opcode is None or data_length > MAX_BINARY_DATA_LENGTH:
+            return ERROR_RETURN
+        buffer.append(opcode)
+        while data_length > 0x7f:
+            buffer.append(data_length & 0x7f | 0x80)
+            data_length >>= 7
+        buffer.append(data_length)
+    else:
+        if not isinstance(data, (bytes, bytearray)):
+            data = bytes(data)
+        data_length = count_characters(data)
+        cmd_field = ENCODED_CMD_FIELDS.get(cmd)
+        if cmd_field is None or data_length > MAX_DATA_LENGTH:
+            return ERROR_RETURN
+        buffer += cmd_field
+        buffer += ENCODED_LENGTH_FIELD_FORMAT % data_length
+    buffer += data
+    return len(buffer) - start
+
+
+def build_binary_message(cmd, data):
+    """
+    Gets command name (str) and data field (str) and creates a protocol version 2 message
+    Returns: bytes, or None if error occured.
+    :param cmd: command name.
+    :param data: data of the command.
+    :return: protocol message.
+    """
+    return build_frame(cmd, data, PROTOCOL_BINARY)
+
+
+def get_binary_header_length(buffer, offset=0):
+    """
+    Reads the varint length field of the version 2 message that starts at offset in the buffer.
+    Returns: (header length, data length), (0, 0) if the header did not fully arrive yet,
+    or (None, None) if the length field is too long.
+    :param buffer: bytes/bytearray of received data.
+    :param offset: where the message starts in the buffer.
+    :return: header length and data length.
+    """
+    if len(buffer) > offset + 1 and buffer[offset + 1] < 0x80:
+        return 2, buffer[offset + 1]  # most messages are shorter than 128 bytes
+    data_length = 0
+    for position in range(offset + 1, offset + 1 + MAX_VARINT_LENGTH):
+        if position >= len(buffer):
+            return 0, 0
+        byte = buffer[position]
+        data_length |= (byte & 0x7f) << 7 * (position - offset - 1)
+        if byte < 0x80:
+            return position + 1 - offset, data_length
+    return ERROR_RETURN, ERROR_RETURN
+
+
+def parse_frame(frame):
+    """
+    Parses one complete message of either protocol version, without decoding its data.
+    Returns: cmd (str), data (UTF-8 bytes). If some error occured, returns None, None
+    :param frame: bytes or bytearray of exactly one message.
+    :return: command and data.
+    """
+    try:
+        if frame[0] <= MAX_OPCODE:
+            cmd = COMMANDS_BY_OPCODE.get(frame[0])
+            header_length, data_length = get_binary_header_length(frame)
+            if cmd and header_length and header_length + data_length == len(frame):
+                return cmd, bytes(frame[header_length:])
+            return ERROR_RETURN, ERROR_RETURN
+        cmd_field, length_field, data = bytes(frame).split(b'|', 2)
+        cmd = COMMANDS_BY_FIELD.get(cmd_field) or COMMANDS_BY_FIELD.get(cmd_field.rstrip())
+        if cmd and len(length_field) == LENGTH_FIELD_LENGTH and length_field.isdigit() and \
+                int(length_field) == count_characters(data):
+            return cmd, data
+        return ERROR_RETURN, ERROR_RETURN
+    except (IndexError, ValueError):
+        return ERROR_RETURN, ERROR_RETURN
+
+
+def build_frame(cmd, data, version=PROTOCOL_TEXT):
+    """
+    Creates an encoded message in the protocol version negotiated with the other side.
+    Returns: bytes, or None if error occured.
+    :param cmd: command name.
+    :param data: data of the command.
+    :param version: PROTOCOL_TEXT or PROTOCOL_BINARY.
+    :return: protocol message.
+    """
+    buffer = bytearray()
+    if encode_message_into(buffer, cmd, data.encode(), version) is ERROR_RETURN:
+        return ERROR_RETURN
+    return bytes(buffer)
+
+
+def get_frame_length(buffer, offset=0):
+    """
+    Checks the header of the message that starts at offset in the buffer, in either protocol version.
+    The cmd field is found by its delimiter, since UNACCEPTABLE_ANSWER is longer than CMD_FIELD_LENGTH.
+    Returns: the full length of that message (header + data), 0 if the message did not fully arrive yet,
+    or None if the header is not a valid protocol header.
+    :param buffer: bytes/bytearray of received data.
+    :param offset: where the message starts in the buffer.
+    :return: message length.
+    """
+    if len(buffer) <= offset:
+        return 0
+    if buffer[offset] <= MAX_OPCODE:
+        header_length, data_length = get_binary_header_length(buffer, offset)
+        return header_length and header_length + data_length
+    cmd_end = buffer.find(b'|', offset, offset + MAX_CMD_LENGTH + 1)
+    if cmd_end == -1:
+        return 0 if len(buffer) - offset <= MAX_CMD_LENGTH else ERROR_RETURN
+    length_end = cmd_end + 1 + LENGTH_FIELD_LENGTH
+    if len(buffer) <= length_end:
+        return 0
+    length_field = buffer[cmd_end + 1:length_end]
+    if not length_field.isdigit() or buffer[length_end] != ord(DELIMITER):
+        return ERROR_RETURN
+    data_end = get_text_data_end(buffer, length_end + 1, int(length_field))
+    return data_end and data_end - offset
+
+
+def iter_frames(buffer):
+    """
+    Generator. Yields every complete message (of either protocol version) at the start of a per-connection
+    receive buffer as (cmd, data), and removes the consumed bytes from the buffer once done.
+    A partial message stays in the buffer until the rest of it is received.
+    A malformed header yields None, None and drops the buffer, since the stream can't be resynced.
+    :param buffer: bytearray the connection's received data is appended to.
+    :return: generator of (cmd, data).
+    """
+    offset = 0
+    try:
+        while True:
+            frame_length = get_frame_length(buffer, offset)
+            if frame_length is ERROR_RETURN:
+                offset = len(buffer)
+                yield ERROR_RETURN, ERROR_RETURN
+                return
+            if frame_length == 0 or len(buffer) - offset < frame_length:
+                return
+            cmd, data = parse_frame(buffer[offset:offset + frame_length])
+            offset += frame_length
+            if cmd is not ERROR_RETURN:
+                try:
+                    data = data.decode()
+                except UnicodeDecodeError:
+                    cmd, data = ERROR_RETURN, ERROR_RETURN
+            yield cmd, data
+    finally:
+        del buffer[:offset]
+
+
+def pop_frame(buffer):
+    """
+    Removes the first complete message from the buffer.
+    Returns: (cmd, data), or None if no complete message is in the buffer yet.
+    :param buffer: bytearray the connection's received data is appended to.
+    :return: the first message.
+    """
+    frames = iter_frames(buffer)
+    try:
+        return next(frames, None)
+    finally:
+        frames.close()
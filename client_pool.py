@@ -0,0 +1,632 @@
+import asyncio  # For the asyncio pool
+import random  # For the jitter of the reconnect delays
+import socket
+import threading  # For the reader threads of the sync pool
+from collections import deque  # For matching every response to the request it answers
+from concurrent.futures import Future  # For the responses the sync pool hands over to the calling threads
+import chatlib
+import client_side_trivia  # server address and protocol version of the interactive client
+import tls  # TLS session resumption
+
+POOL_SIZE = 4  # connections of a pool
+CONNECT_TIMEOUT = 10  # seconds to connect and log in
+REQUEST_TIMEOUT = 30  # seconds to wait for a connection and for the response
+RECONNECT_DELAY = 0.1  # seconds before the first reconnect, doubled after every failed one
+MAX_RECONNECT_DELAY = 10
+READ_SIZE = 64 * 1024
+PUSHED_COMMANDS = frozenset(('ROOM_QUESTION', 'ROUND_RESULT'))  # sent to room players without a request
+# answers that are the same when asked again, sent again on another connection if the connection broke
+RETRY_COMMANDS = frozenset(('MY_SCORE', 'MY_RANK', 'HIGHSCORE', 'LOGGED', 'STATS'))
+POOL_LOGIN_COMMANDS = frozenset(('LOGIN', 'RESUME', 'LOGOUT'))  # the pool logs its connections in and out itself
+
+
+def login_message(username, password, token):
+    """
+    :param username: the user name.
+    :param password: the user password.
+    :param token: login token of an earlier login, None to log in with the password.
+    :return: (cmd, data) of a RESUME message if there is a token, else of a LOGIN message.
+    """
+    if token is not None:
+        return 'RESUME', chatlib.encode_fields('RESUME', [username, token, client_side_trivia.PROTOCOL_VERSION])
+    return 'LOGIN', chatlib.encode_fields('LOGIN', [username, password, client_side_trivia.PROTOCOL_VERSION])
+
+
+class PipelinedConnection:
+    """
+    protocol state of one pooled connection, without the socket: frames the requests in the protocol version
+    agreed at login and matches the responses to the requests. the server answers the requests of a connection
+    in the order it got them, so the responses are matched first in, first out, and any amount of requests
+    may be on the way at once. messages the server sends without a request (room questions and results,
+    timeouts) go to on_push. the sync and the asyncio pool share it, they only differ in how they do the IO.
+    """
+
+    __slots__ = ('protocol_version', 'recv_buffer', 'pending', 'on_push')
+
+    def __init__(self, on_push=None):
+        """
+        :param on_push: function(cmd, data) called with the messages that answer no request, None to drop them.
+        """
+        self.protocol_version = chatlib.PROTOCOL_TEXT  # until the login agrees on another one
+        self.recv_buffer = bytearray()
+        self.pending = deque()  # futures of the requests sent and not answered yet, in the order they were sent
+        self.on_push = on_push
+
+    def __len__(self):
+        return len(self.pending)
+
+    def encode(self, requests):
+        """
+        :param requests: list of (cmd, data) tuples.
+        :return: the messages, to be sent in one write.
+        """
+        buffer = bytearray()
+        for cmd, data in requests:
+            chatlib.encode_message_into(buffer, cmd, data.encode(), self.protocol_version)
+        return buffer
+
+    def expect(self, future):
+        """
+        registers the future of a request that was just sent, it gets the next response.
+        :param future: concurrent.futures.Future or asyncio.Future, its result is set to (cmd, data).
+        :return: None.
+        """
+        self.pending.append(future)
+
+    def feed(self, received):
+        """
+        sets the futures of the responses in the received bytes.
+        :param received: bytes received from the server.
+        :return: False if a malformed message broke the stream, the connection can't be used anymore.
+        """
+        self.recv_buffer += received
+        for cmd, data in chatlib.iter_frames(self.recv_buffer):
+            if cmd is None:
+                return False
+            if cmd in PUSHED_COMMANDS or not self.pending:
+                if self.on_push is not None:
+                    self.on_push(cmd, data)
+                continue
+            future = self.pending.popleft()
+            if not future.done():  # the caller may have given up on it
+                future.set_result((cmd, data))
+        return True
+
+    def logged_in(self, data):
+        """
+        switches to the protocol version of a LOGIN_OK message.
+        :param data: LOGIN_OK message data, version#token.
+        :return: the login token, or None if the server sent none.
+        """
+        fields = chatlib.decode_fields('LOGIN_OK', data) or []
+        self.protocol_version = fields[0] if fields else chatlib.PROTOCOL_TEXT
+        return fields[1] if len(fields) > 1 and fields[1] else None
+
+    def fail(self, error):
+        """
+        the connection broke, fails the requests that were not answered. whether the server handled them
+        is unknown, only RETRY_COMMANDS are safe to send again.
+        :param error: the exception the futures get.
+        :return: None.
+        """
+        while self.pending:
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+
+def shutdown(sock):
+    """
+    shuts a pooled socket down, its reader wakes up and fails the requests that were not answered.
+    :param sock: the socket.
+    :return: None.
+    """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def check_requests(requests):
+    """
+    encodes the fields of the requests.
+    :param requests: list of (cmd, fields) tuples.
+    :return: (list of (cmd, data) of the requests to send, list of (index, response) of the refused ones).
+    """
+    messages, refused = list(), list()
+    for index, (cmd, fields) in enumerate(requests):
+        data = None if cmd in POOL_LOGIN_COMMANDS else chatlib.encode_fields(cmd, fields)
+        if data is None:
+            refused.append((index, ('ERROR', f'Bad {cmd} message.')))
+        else:
+            messages.append((cmd, data))
+    return messages, refused
+
+
+class ClientPool:
+    """
+    a few persistent connections logged in as one user, shared by any amount of threads. a request goes to
+    the connection with the fewest requests on the way, and does not wait for the requests before it to be
+    answered. a connection that breaks is connected and logged in again in the background, with a growing
+    delay while the server can't be reached. the first login uses the password, the other connections and
+    the reconnects use its login token, so they don't pay for the password hash on the server.
+    the protocol ties a connection to one user, a front-end that calls for many users keeps a pool per user.
+    """
+
+    __slots__ = ('address', 'username', 'password', 'token', 'on_push', 'ssl_context', 'connections', 'ready',
+                 'closing', 'last_error')
+
+    def __init__(self, username, password, size=POOL_SIZE, address=None, on_push=None, ssl_context=None):
+        """
+        starts connecting, requests wait until a connection is logged in.
+        :param username: the user name.
+        :param password: the user password.
+        :param size: amount of connections.
+        :param address: (ip, port) of the server, the client_side_trivia server by default.
+        :param on_push: function(cmd, data) for the messages that answer no request, called from a reader thread.
+        :param ssl_context: client ssl.SSLContext (tls.create_client_context) to connect over TLS, None for plain TCP.
+        the connections after the first one and the reconnects resume its TLS session.
+        """
+        if login_message(username, password, None)[1] is None:
+            raise ValueError('username and password can not hold the delimiter.')
+        self.address = address or (client_side_trivia.SERVER_IP, client_side_trivia.SERVER_PORT)
+        self.ssl_context = ssl_context
+        self.username = username
+        self.password = password
+        self.token = None  # login token of the last password login
+        self.on_push = on_push
+        self.ready = threading.Condition()  # notified when a connection is logged in
+        self.closing = threading.Event()
+        self.last_error = None  # why the last connect or login failed
+        self.connections = [PooledSocket(self) for _ in range(size)]
+        for connection in self.connections:
+            connection.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def pick_connection(self, timeout):
+        """
+        :param timeout: seconds to wait for a logged in connection.
+        :return: the logged in PooledSocket with the fewest requests on the way.
+        """
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.closing.is_set() or any(
+                    connection.sock is not None for connection in self.connections), timeout):
+                raise ConnectionError(f'no connection to the server: {self.last_error}')
+            if self.closing.is_set():
+                raise ConnectionError('the pool is closed.')
+            return min((connection for connection in self.connections if connection.sock is not None),
+                       key=lambda connection: len(connection.state))
+
+    def send(self, requests, timeout=REQUEST_TIMEOUT):
+        """
+        sends the requests in one write on one connection, so all of them cost a single round trip.
+        :param requests: list of (cmd, fields) tuples, e.g. [('MY_SCORE', ()), ('HIGHSCORE', (5,))].
+        :param timeout: seconds to wait for a logged in connection.
+        :return: list of concurrent.futures.Future, one for every request, their result is (cmd, data).
+        """
+        futures = [Future() for _ in requests]
+        messages, refused = check_requests(requests)
+        for index, response in refused:
+            futures[index].set_result(response)
+        waiting = [future for future in futures if not future.done()]
+        while messages:
+            connection = self.pick_connection(timeout)
+            with connection.send_lock:
+                if connection.sock is None:
+                    continue  # it broke after it was picked
+                for future in waiting:
+                    connection.state.expect(future)
+                try:
+                    connection.sock.sendall(connection.state.encode(messages))
+                except OSError:
+                    shutdown(connection.sock)  # the reader fails the futures
+            break
+        return futures
+
+    def submit(self, cmd, *fields):
+        """
+        sends a request without waiting for the response.
+        :param cmd: the command, e.g. 'MY_SCORE'.
+        :param fields: the fields of the message.
+        :return: concurrent.futures.Future of the response, (cmd, data).
+        """
+        return self.send([(cmd, fields)])[0]
+
+    def request(self, cmd, *fields, timeout=REQUEST_TIMEOUT):
+        """
+        sends a request and waits for the response. RETRY_COMMANDS are sent once more if the connection broke.
+        :param cmd: the command, e.g. 'MY_SCORE'.
+        :param fields: the fields of the message.
+        :param timeout: seconds to wait for a connection and for the response.
+        :return: the server response, (cmd, data).
+        """
+        try:
+            return self.send([(cmd, fields)], timeout)[0].result(timeout)
+        except ConnectionError:
+            if cmd not in RETRY_COMMANDS:
+                raise
+        return self.send([(cmd, fields)], timeout)[0].result(timeout)
+
+    def pipeline(self, requests, timeout=REQUEST_TIMEOUT):
+        """
+        sends the requests in one write and waits for all the responses.
+        :param requests: list of (cmd, fields) tuples.
+        :param timeout: seconds to wait for a connection and for every response.
+        :return: list of the server responses, (cmd, data).
+        """
+        return [future.result(timeout) for future in self.send(requests, timeout)]
+
+    def close(self):
+        """
+        logs the connections out and closes them, requests that were not answered get ConnectionError.
+        :return: None.
+        """
+        self.closing.set()
+        for connection in self.connections:
+            with connection.send_lock:
+                if connection.sock is not None:
+                    try:
+                        connection.sock.sendall(connection.state.encode([('LOGOUT', '')]))
+                    except OSError:
+                        pass
+                    shutdown(connection.sock)
+        with self.ready:
+            self.ready.notify_all()
+        for connection in self.connections:
+            connection.thread.join()
+
+
+class PooledSocket:
+    """
+    a connection of a ClientPool and the thread that reads its responses and connects it again when it breaks.
+    sock is None while the connection is not logged in.
+    """
+
+    __slots__ = ('pool', 'sock', 'state', 'send_lock', 'thread')
+
+    def __init__(self, pool):
+        """
+        :param pool: the ClientPool.
+        """
+        self.pool = pool
+        self.sock = None
+        self.state = PipelinedConnection(pool.on_push)
+        self.send_lock = threading.Lock()  # keeps the messages of a write together, and in the order of pending
+        self.thread = threading.Thread(target=self.run, name='client-pool', daemon=True)
+
+    def run(self):
+        """
+        reader thread body, connects, reads until the connection breaks and connects again, until the pool closes.
+        :return: None.
+        """
+        pool = self.pool
+        if self is not pool.connections[0]:
+            with pool.ready:  # the first connection logs in with the password, the others with its token
+                pool.ready.wait_for(lambda: pool.token is not None or pool.closing.is_set(), CONNECT_TIMEOUT)
+        delay = RECONNECT_DELAY
+        while not pool.closing.is_set():
+            try:
+                sock, state = self.connect()
+            except OSError as error:
+                pool.last_error = error
+                pool.closing.wait(delay * random.uniform(0.5, 1))
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+            self.read(sock, state)
+
+    def connect(self):
+        """
+        connects and logs in, with the login token of the pool if it has one.
+        :return: (socket, PipelinedConnection) of the logged in connection.
+        """
+        pool = self.pool
+        sock = socket.create_connection(pool.address, CONNECT_TIMEOUT)
+        try:
+            if pool.ssl_context is not None:
+                sock = tls.wrap_client_socket(pool.ssl_context, sock, pool.address[0])
+            state = PipelinedConnection(pool.on_push)
+            token = pool.token
+            cmd, data = self.exchange(sock, state, login_message(pool.username, pool.password, token))
+            if cmd != 'LOGIN_OK' and token is not None:  # the token expired
+                cmd, data = self.exchange(sock, state, login_message(pool.username, pool.password, None))
+            if cmd != 'LOGIN_OK':
+                raise ConnectionError(f'login failed: {data}')
+            pool.token = state.logged_in(data)
+            if pool.ssl_context is not None:
+                tls.save_session(sock)
+            sock.settimeout(None)
+        except OSError:
+            sock.close()
+            raise
+        return sock, state
+
+    @staticmethod
+    def exchange(sock, state, message):
+        """
+        sends a message and blocks until its response, for the login before the connection is used.
+        :param sock: the socket.
+        :param state: PipelinedConnection of the socket.
+        :param message: (cmd, data).
+        :return: the server response, (cmd, data).
+        """
+        future = Future()
+        state.expect(future)
+        sock.sendall(state.encode([message]))
+        while not future.done():
+            received = sock.recv(READ_SIZE)
+            if not received or not state.feed(received):
+                raise ConnectionError('the server closed the connection.')
+        return future.result()
+
+    def read(self, sock, state):
+        """
+        hands the connection to the pool and sets the futures of its responses until it breaks.
+        :param sock: the logged in socket.
+        :param state: PipelinedConnection of the socket.
+        :return: None.
+        """
+        with self.pool.ready, self.send_lock:
+            self.sock, self.state = sock, state
+            self.pool.ready.notify_all()
+        if self.pool.closing.is_set():
+            shutdown(sock)  # logged in while the pool closed, close() did not see it
+        try:
+            while True:
+                received = sock.recv(READ_SIZE)
+                if not received or not state.feed(received):
+                    break
+        except OSError:
+            pass
+        with self.send_lock:
+            self.sock = None
+        sock.close()
+        state.fail(ConnectionError('the connection to the server broke.'))
+
+
+class AsyncClientPool:
+    """
+    ClientPool for asyncio: the same connections, pipelining and reconnects, with a reader task per connection
+    instead of a thread. concurrent requests, e.g. asyncio.gather() of many request() calls, are on the way
+    at the same time on the few connections of the pool.
+    """
+
+    __slots__ = ('address', 'username', 'password', 'token', 'on_push', 'ssl_context', 'connections', 'ready',
+                 'closing', 'last_error')
+
+    def __init__(self, username, password, size=POOL_SIZE, address=None, on_push=None, ssl_context=None):
+        """
+        :param username: the user name.
+        :param password: the user password.
+        :param size: amount of connections.
+        :param address: (ip, port) of the server, the client_side_trivia server by default.
+        :param on_push: function(cmd, data) for the messages that answer no request.
+        :param ssl_context: client ssl.SSLContext to connect over TLS, None for plain TCP. asyncio can't resume
+        a TLS session, every connect is a full handshake.
+        """
+        if login_message(username, password, None)[1] is None:
+            raise ValueError('username and password can not hold the delimiter.')
+        self.address = address or (client_side_trivia.SERVER_IP, client_side_trivia.SERVER_PORT)
+        self.ssl_context = ssl_context
+        self.username = username
+        self.password = password
+        self.token = None
+        self.on_push = on_push
+        self.ready = None  # asyncio.Condition, created by start() in the running loop
+        self.closing = None  # asyncio.Event
+        self.last_error = None
+        self.connections = [AsyncPooledConnection(self) for _ in range(size)]
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self, timeout=CONNECT_TIMEOUT):
+        """
+        starts the reader tasks and waits until a connection is logged in.
+        :param timeout: seconds to wait for the first connection.
+        :return: None.
+        """
+        self.ready = asyncio.Condition()
+        self.closing = asyncio.Event()
+        first, *others = self.connections
+        first.task = asyncio.create_task(first.run())
+        try:
+            await self.pick_connection(timeout)  # the first connection logs in with the password
+        finally:
+            for connection in others:  # and the others with its token
+                connection.task = asyncio.create_task(connection.run())
+
+    async def pick_connection(self, timeout):
+        """
+        :param timeout: seconds to wait for a logged in connection.
+        :return: the logged in AsyncPooledConnection with the fewest requests on the way.
+        """
+        logged_in = [connection for connection in self.connections if connection.writer is not None]
+        if not logged_in and not self.closing.is_set():
+            async with self.ready:
+                try:
+                    await asyncio.wait_for(self.ready.wait_for(lambda: self.closing.is_set() or any(
+                        connection.writer is not None for connection in self.connections)), timeout)
+                except asyncio.TimeoutError:
+                    raise ConnectionError(f'no connection to the server: {self.last_error}') from None
+            logged_in = [connection for connection in self.connections if connection.writer is not None]
+        if self.closing.is_set():
+            raise ConnectionError('the pool is closed.')
+        return min(logged_in, key=lambda connection: len(connection.state))
+
+    async def send(self, requests, timeout=REQUEST_TIMEOUT):
+        """
+        sends the requests in one write on one connection, so all of them cost a single round trip.
+        :param requests: list of (cmd, fields) tuples.
+        :param timeout: seconds to wait for a logged in connection.
+        :return: list of asyncio.Future, one for every request, their result is (cmd, data).
+        """
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in requests]
+        messages, refused = check_requests(requests)
+        for index, response in refused:
+            futures[index].set_result(response)
+        if messages:
+            connection = await self.pick_connection(timeout)
+            for future in futures:
+                if not future.done():
+                    connection.state.expect(future)
+            connection.writer.write(connection.state.encode(messages))
+            await connection.writer.drain()
+        return futures
+
+    async def request(self, cmd, *fields, timeout=REQUEST_TIMEOUT):
+        """
+        sends a request and waits for the response. RETRY_COMMANDS are sent once more if the connection broke.
+        :param cmd: the command, e.g. 'MY_SCORE'.
+        :param fields: the fields of the message.
+        :param timeout: seconds to wait for a connection and for the response.
+        :return: the server response, (cmd, data).
+        """
+        try:
+            return await asyncio.wait_for((await self.send([(cmd, fields)], timeout))[0], timeout)
+        except ConnectionError:
+            if cmd not in RETRY_COMMANDS:
+                raise
+        return await asyncio.wait_for((await self.send([(cmd, fields)], timeout))[0], timeout)
+
+    async def pipeline(self, requests, timeout=REQUEST_TIMEOUT):
+        """
+        sends the requests in one write and waits for all the responses.
+        :param requests: list of (cmd, fields) tuples.
+        :param timeout: seconds to wait for a connection and for the responses.
+        :return: list of the server responses, (cmd, data).
+        """
+        return await asyncio.wait_for(asyncio.gather(*await self.send(requests, timeout)), timeout)
+
+    async def close(self):
+        """
+        logs the connections out and closes them, requests that were not answered get ConnectionError.
+        :return: None.
+        """
+        self.closing.set()
+        for connection in self.connections:
+            if connection.writer is not None:
+                connection.writer.write(connection.state.encode([('LOGOUT', '')]))
+                connection.writer.close()
+        async with self.ready:
+            self.ready.notify_all()
+        tasks = [connection.task for connection in self.connections if connection.task is not None]
+        for task in tasks:
+            task.cancel()  # also the ones waiting to connect again
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class AsyncPooledConnection:
+    """
+    a connection of an AsyncClientPool and the task that reads its responses and connects it again when it breaks.
+    writer is None while the connection is not logged in.
+    """
+
+    __slots__ = ('pool', 'writer', 'state', 'task')
+
+    def __init__(self, pool):
+        """
+        :param pool: the AsyncClientPool.
+        """
+        self.pool = pool
+        self.writer = None
+        self.state = PipelinedConnection(pool.on_push)
+        self.task = None
+
+    async def run(self):
+        """
+        reader task, connects, reads until the connection breaks and connects again, until the pool closes.
+        :return: None.
+        """
+        delay = RECONNECT_DELAY
+        while not self.pool.closing.is_set():
+            try:
+                reader, writer, state = await asyncio.wait_for(self.connect(), CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as error:
+                self.pool.last_error = error
+                try:
+                    await asyncio.wait_for(self.pool.closing.wait(), delay * random.uniform(0.5, 1))
+                except asyncio.TimeoutError:
+                    pass
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+            await self.read(reader, writer, state)
+
+    async def connect(self):
+        """
+        connects and logs in, with the login token of the pool if it has one.
+        :return: (reader, writer, PipelinedConnection) of the logged in connection.
+        """
+        pool = self.pool
+        reader, writer = await asyncio.open_connection(*pool.address, ssl=pool.ssl_context)
+        try:
+            state = PipelinedConnection(pool.on_push)
+            token = pool.token
+            cmd, data = await self.exchange(reader, writer, state, login_message(pool.username, pool.password, token))
+            if cmd != 'LOGIN_OK' and token is not None:  # the token expired
+                cmd, data = await self.exchange(reader, writer, state,
+                                                login_message(pool.username, pool.password, None))
+            if cmd != 'LOGIN_OK':
+                raise ConnectionError(f'login failed: {data}')
+            pool.token = state.logged_in(data)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer, state
+
+    @staticmethod
+    async def exchange(reader, writer, state, message):
+        """
+        sends a message and waits for its response, for the login before the connection is used.
+        :param reader: asyncio stream reader of the connection.
+        :param writer: asyncio stream writer of the connection.
+        :param state: PipelinedConnection of the connection.
+        :param message: (cmd, data).
+        :return: the server response, (cmd, data).
+        """
+        future = asyncio.get_running_loop().create_future()
+        state.expect(future)
+        writer.write(state.encode([message]))
+        while not future.done():
+            received = await reader.read(READ_SIZE)
+            if not received or not state.feed(received):
+                raise ConnectionError('the server closed the connection.')
+        return future.result()
+
+    async def read(self, reader, writer, state):
+        """
+        hands the connection to the pool and sets the futures of its responses until it breaks.
+        :param reader: asyncio stream reader of the logged in connection.
+        :param writer: asyncio stream writer of the logged in connection.
+        :param state: PipelinedConnection of the connection.
+        :return: None.
+        """
+        async with self.pool.ready:
+            self.writer, self.state = writer, state
+            self.pool.ready.notify_all()
+        if self.pool.closing.is_set():
+            # logged in while the pool closed, close() did not see it. wait_for() may even have swallowed
+            # the cancel of close() when the login finished at the same time.
+            writer.close()
+        try:
+            while True:
+                received = await reader.read(READ_SIZE)
+                if not received or not state.feed(received):
+                    break
+        except OSError:
+            pass
+        finally:
+            self.writer = None
+            writer.close()
+            state.fail(ConnectionError('the connection to the server broke.'))
@@ -1,8 +1,16 @@
+import argparse  # For the TLS options
 import socket
+import ssl  # For the TLS sockets
 import chatlib
+import tls  # TLS contexts and session resumption
 
 SERVER_IP = '127.0.0.1'
 SERVER_PORT = 5631
+PROTOCOL_VERSION = chatlib.PROTOCOL_BINARY  # asked for at login, servers that don't support it keep the text protocol
+recv_buffers = dict()  # server socket -> received bytes that are not a complete message yet
+protocol_versions = dict()  # server socket -> protocol version agreed at login
+login_tokens = dict()  # server socket -> (username, login token), for logging in again without the password
+TLS_CONTEXT = None  # client ssl.SSLContext, None connects with plain TCP
 
 # HELPER SOCKET METHODS
 
@@ -16,8 +24,8 @@ def build_and_send_message(conn, cmd, data):
     :param data: data message to send.
     :return: None.
     """
-    data_to_send = chatlib.build_message(cmd, data).encode()
-    conn.send(data_to_send)
+    data_to_send = chatlib.build_frame(cmd, data, protocol_versions.get(conn, chatlib.PROTOCOL_TEXT))
+    conn.sendall(data_to_send)
 
 
 def recv_message_and_parse(conn):
@@ -29,8 +37,15 @@ def recv_message_and_parse(conn):
     :return: None.
     """
     try:
-        received_msg = conn.recv(1024).decode()
-        cmd, data = chatlib.parse_message(received_msg)
+        buffer = recv_buffers.setdefault(conn, bytearray())
+        frame = chatlib.pop_frame(buffer)
+        while frame is None:
+            received = conn.recv(chatlib.MAX_MSG_LENGTH)
+            if not received:
+                return chatlib.ERROR_RETURN, chatlib.ERROR_RETURN
+            buffer += received
+            frame = chatlib.pop_frame(buffer)
+        cmd, data = frame
         return cmd, data
     except:
         return chatlib.ERROR_RETURN, chatlib.ERROR_RETURN
@@ -38,11 +53,13 @@ def recv_message_and_parse(conn):
 
 def connect():
     """
-    creates and returns a socket object that is connected to the trivia server.
+    creates and returns a socket object that is connected to the trivia server, over TLS if TLS_CONTEXT is set.
     :return: client socket.
     """
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client_socket.connect((SERVER_IP, SERVER_PORT))
+    if TLS_CONTEXT is not None:
+        client_socket = tls.wrap_client_socket(TLS_CONTEXT, client_socket, SERVER_IP)
     print('Connection established to server.\n')
     return client_socket
 
@@ -57,6 +74,50 @@ def error_and_exit(error_msg):
     exit()
 
 
+def login_user(conn, username, password):
+    """
+    sends one login message, and switches to the protocol version the server agreed to if it succeeds.
+    :param conn: server socket object.
+    :param username: the user name.
+    :param password: the user password.
+    :return: the server response, (cmd, data).
+    """
+    cmd, data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['login_msg'], username, password, PROTOCOL_VERSION)
+    if cmd == 'LOGIN_OK':
+        set_login(conn, username, data)
+    return cmd, data
+
+
+def resume_user(conn, username, token):
+    """
+    logs in again with the login token of an earlier login, the server does not check the password again.
+    :param conn: server socket object, usually a new connection.
+    :param username: the user name.
+    :param token: login token of the earlier login.
+    :return: the server response, (cmd, data). ERROR once the token expired, log in with the password then.
+    """
+    cmd, data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['resume_msg'], username, token, PROTOCOL_VERSION)
+    if cmd == 'LOGIN_OK':
+        set_login(conn, username, data)
+    return cmd, data
+
+
+def set_login(conn, username, data):
+    """
+    keeps the protocol version and the login token of a LOGIN_OK message.
+    :param conn: server socket object.
+    :param username: the user name.
+    :param data: LOGIN_OK message data, version#token, empty from servers without them.
+    :return: None.
+    """
+    fields = chatlib.decode_fields('LOGIN_OK', data) or []
+    protocol_versions[conn] = fields[0] if fields else chatlib.PROTOCOL_TEXT
+    if len(fields) > 1 and fields[1]:
+        login_tokens[conn] = (username, fields[1])
+    if isinstance(conn, ssl.SSLSocket):  # the session tickets came before the response, the next connect resumes
+        tls.save_session(conn)
+
+
 def login(conn):
     """
     prompts the user to enter username and password, and sends the message to the server.
@@ -68,12 +129,39 @@ def login(conn):
     while cmd != 'LOGIN_OK':
         username = input('Please enter username: \n')
         password = input('Please enter the password \n')
-        build_and_send_message(conn, chatlib.PROTOCOL_CLIENT['login_msg'], f'{username}#{password}')
-        cmd, data = recv_message_and_parse(conn)
-        print(f'{data}')
+        cmd, data = login_user(conn, username, password)
+        if cmd != 'LOGIN_OK':
+            print(f'{data}')
     print('Logged in.\n')
 
 
+def register_user(conn, username, password):
+    """
+    sends one register message.
+    :param conn: server socket object.
+    :param username: the user name.
+    :param password: the user password.
+    :return: the server response, (cmd, data).
+    """
+    return send_recv_command(conn, chatlib.PROTOCOL_CLIENT['register_msg'], username, password)
+
+
+def register(conn):
+    """
+    prompts the user to choose a username and password, and creates the user on the server.
+    while cmd is not register ok, keeps asking for it.
+    :param conn: server socket object.
+    :return: None.
+    """
+    cmd = ''
+    while cmd != 'REGISTER_OK':
+        username = input('Please choose a username: \n')
+        password = input('Please choose a password \n')
+        cmd, data = register_user(conn, username, password)
+        print(f'{data}')
+    print('Registered, you can log in now.\n')
+
+
 def logout(conn):
     """
     send the server logout message.
@@ -98,119 +186,324 @@ def build_send_recv_parse(conn, cmd, data):
     return msg_code, srv_data
 
 
+def send_recv_command(conn, cmd, *fields):
+    """
+    checks the fields against the command schema, sends the command and receives the server response.
+    fields the server would refuse (wrong amount, wrong type, a delimiter inside a field) are never sent,
+    they get an ERROR response right away.
+    :param conn: server socket object.
+    :param cmd: command message to be sent to server.
+    :param fields: the fields of the message, e.g. username, password.
+    :return: the server response, (cmd, data).
+    """
+    data = chatlib.encode_fields(cmd, fields)
+    if data is None:
+        return 'ERROR', f'Bad {cmd} message.'
+    return build_send_recv_parse(conn, cmd, data)
+
+
+def build_send_recv_parse_pipelined(conn, requests):
+    """
+    sends several requests in one write and only then reads their responses, so all of them
+    cost a single round trip. the server answers in the order the requests were sent.
+    :param conn: server socket object.
+    :param requests: list of (cmd, data) tuples to send.
+    :return: list of (msg_code, srv_data) tuples, one for every request.
+    """
+    version = protocol_versions.get(conn, chatlib.PROTOCOL_TEXT)
+    data_to_send = bytearray()
+    for cmd, data in requests:
+        chatlib.encode_message_into(data_to_send, cmd, data.encode(), version)
+    conn.sendall(data_to_send)
+    return [recv_message_and_parse(conn) for _ in requests]
+
+
 def get_score(conn):
     """
     receives server socket, sends a get_score message, receives server response and prints it out.
     for any error received, prints it out.
     :param conn: server socket object.
-    :return: None.
+    :return: the score.
     """
     try:
-        cmd, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT['my_score_msg'], '')
+        cmd, data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['my_score_msg'])
         print(f'Your score is: {data}\n')
+        return data
     except:
         error_and_exit(chatlib.ERROR_RETURN)
 
 
-def get_highscore(conn):
+def get_highscore(conn, amount=None):
     """
     receives a server socket socket, prints out the highscore table as received from the server.
     :param conn: server socket object.
-    :return: None.
+    :param amount: amount of users in the table, None for the server default.
+    :return: the highscore table.
     """
     try:
-        cmd, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT['highscore_msg'], '')
+        cmd, data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['highscore_msg'],
+                                      *(() if amount is None else (amount,)))
         print(f'The highscore table is:\n{data}\n')
+        return data
     except:
         error_and_exit(chatlib.ERROR_RETURN)
 
 
-def play_question(conn):
+def get_rank(conn):
+    """
+    receives a server socket, prints out the user place in the highscore table.
+    :param conn: server socket object.
+    :return: (rank, amount of ranked players).
+    """
+    try:
+        cmd, data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['my_rank_msg'])
+        rank, ranked_amount = chatlib.decode_fields(cmd, data)
+        print(f'You are number {rank} of {ranked_amount} players.\n')
+        return rank, ranked_amount
+    except:
+        error_and_exit(chatlib.ERROR_RETURN)
+
+
+def parse_question(data):
+    """
+    splits a YOUR_QUESTION message data, questions have 2 or more answers.
+    :param data: the message data.
+    :return: list of question id (int), question and answers, or None if the data is not a question.
+    """
+    return chatlib.decode_fields('YOUR_QUESTION', data)
+
+
+def ask_answer(question_list, retry=False):
+    """
+    prints the question and lets the user choose an answer.
+    :param question_list: question id, question and answers.
+    :param retry: True if the last answer was not acceptable.
+    :return: the answer number the user entered.
+    """
+    if retry:
+        return input('Please enter a valid answer (numbers) as options available.\n')
+    answers = ''.join(f'{number}. {answer}\n' for number, answer in enumerate(question_list[2:], 1))
+    return input(f'{question_list[1]}:\n{answers}')
+
+
+def play_question(conn, choose_answer=ask_answer, category='', difficulty=''):
+    """
+    receives a server socket as arg. requests a question from the server and sends the chosen answer,
+    until the server accepts it.
+    :param conn: server socket object.
+    :param choose_answer: function(question_list, retry) that returns the answer, asks the user by default.
+    :param category: category of the question, any if empty.
+    :param difficulty: difficulty of the question (easy, medium or hard), the server picks one if empty.
+    :return: the server verdict, CORRECT_ANSWER / WRONG_ANSWER / ERROR, or NO_QUESTIONS.
+    """
+    filters = (category, difficulty) if difficulty else (category,) if category else ()
+    cmd, data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['get_question_msg'], *filters)
+    if cmd == 'ERROR':
+        print(data)  # e.g. no such category
+        return cmd
+    question_list = parse_question(data) if cmd == 'YOUR_QUESTION' else None
+    if question_list is None:
+        print('There are no more questions to ask. game over.')
+        return 'NO_QUESTIONS'
+    answer_cmd, answer_data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['send_answer_msg'], question_list[0],
+                                                choose_answer(question_list, False))
+    while answer_cmd == 'UNACCEPTABLE_ANSWER':
+        answer_cmd, answer_data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['send_answer_msg'],
+                                                    question_list[0], choose_answer(question_list, True))
+    if answer_cmd == 'CORRECT_ANSWER':
+        print(f'The answer you provided is correct! +{answer_data or 5} points.')
+    elif answer_cmd == 'WRONG_ANSWER':
+        print(f'the answer you provided is wrong.')
+    elif answer_cmd == 'ERROR':
+        print(answer_data)  # e.g. the answer came after the answer time was over
+    else:
+        error_and_exit(answer_data)
+    return answer_cmd
+
+
+def get_categories(conn):
+    """
+    receives a server socket, prints out the categories of the questions the server has.
+    :param conn: server socket object.
+    :return: list of category names.
+    """
+    cmd, data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['get_categories_msg'])
+    categories = chatlib.decode_fields(cmd, data) if cmd == 'CATEGORIES' else None
+    if categories is None:
+        error_and_exit(data)
+    print(''.join(f'{number}. {category}\n' for number, category in enumerate(categories, 1)))
+    return categories
+
+
+def play_category(conn):
+    """
+    lets the user pick a category and a difficulty, then plays a question of them.
+    :param conn: server socket object.
+    :return: the server verdict, see play_question.
+    """
+    categories = get_categories(conn)
+    number = input('Category number, Enter for any:\n')
+    category = categories[int(number) - 1] if number.isdigit() and 0 < int(number) <= len(categories) else ''
+    difficulty = input('Difficulty (easy, medium, hard), Enter for any:\n')
+    return play_question(conn, category=category, difficulty=difficulty)
+
+
+def join_room(conn, room_name):
+    """
+    joins a multiplayer room, it is created if nobody plays in it.
+    :param conn: server socket object.
+    :param room_name: name of the room.
+    :return: amount of players in the room, or None if the server refused.
+    """
+    cmd, data = send_recv_command(conn, chatlib.PROTOCOL_CLIENT['join_room_msg'], room_name)
+    if cmd != 'ROOM_JOINED':
+        print(data)
+        return None
+    players_amount = chatlib.decode_fields(cmd, data)[1]
+    print(f'You joined room {room_name}, {players_amount} players are in it.')
+    return players_amount
+
+
+def leave_room(conn):
     """
-    receives a server socket as arg. requests a question from the server. splits received response to 2/4 answers.
-    for any error received, prints out error message and returns to server a None response.
+    leaves the room. room messages that were already on their way are skipped.
     :param conn: server socket object.
     :return: None.
     """
+    build_and_send_message(conn, chatlib.PROTOCOL_CLIENT['leave_room_msg'], '')
+    cmd, data = recv_message_and_parse(conn)
+    while cmd in ('ROOM_QUESTION', 'ROUND_RESULT'):
+        cmd, data = recv_message_and_parse(conn)
 
-    cmd, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT['get_question_msg'], '')
-    try:
-        if cmd == 'NO_QUESTIONS':
-            print('There are no more questions to ask. game over.')
-            return
-        else:
-            question_list = chatlib.split_data(data, 5)
-            user_answer = input(f'{question_list[1]}:\n1. {question_list[2]}\n2. {question_list[3]}\n3. {question_list[4]}\n4. {question_list[5]}\n')
-            answer_cmd, answer_data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT['send_answer_msg'],
-                                                            f'{question_list[0]}#{user_answer}')
-            try:
-                while answer_cmd == 'UNACCEPTABLE_ANSWER':
-                    new_answer = input('Please enter a valid answer (numbers) as options available.\n')
-                    answer_cmd, answer_data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT['send_answer_msg'],
-                                           f'{question_list[0]}#{new_answer}')
-                if answer_cmd == 'CORRECT_ANSWER':
-                    print('The answer you provided is correct!')
-                elif answer_cmd == 'WRONG_ANSWER':
-                    print(f'the answer you provided is wrong.')
-            except:
-                error_and_exit(chatlib.ERROR_RETURN)
-    except TypeError:
-        question_list = chatlib.split_data(data, 3)
-        user_answer = input(f'{question_list[1]}:\n1. {question_list[2]}\n2. {question_list[3]}\n')
-        answer_cmd, answer_data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT['send_answer_msg'],
-                                                        f'{question_list[0]}#{user_answer}')
-        try:
-            if answer_cmd == 'CORRECT_ANSWER':
-                print('The answer you provided is correct!')
-            elif answer_cmd == 'WRONG_ANSWER':
-                print(f'the answer you provided is wrong.')
-            while answer_cmd == 'UNACCEPTABLE_ANSWER':
-                new_answer = input('Please enter a valid answer (numbers) as options available.\n')
-                answer_cmd, answer_data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT['send_answer_msg'],
-                                       f'{question_list[0]}#{new_answer}')
-                try:
-                    if answer_cmd == 'CORRECT_ANSWER':
-                        print('The answer you provided is correct!')
-                    elif answer_cmd == 'WRONG_ANSWER':
-                        print(f'the answer you provided is wrong.')
-                    elif answer_cmd == 'NO_QUESTIONS':
-                        print('There are no more questions to ask. game over.')
-                except:
-                    error_and_exit(chatlib.ERROR_RETURN)
-        except:
-            error_and_exit(chatlib.ERROR_RETURN)
+
+def print_round_result(data):
+    """
+    :param data: ROUND_RESULT message data, round_number#correct choice#answers#correct answers#username:points...
+    :return: None.
+    """
+    fields = chatlib.decode_fields('ROUND_RESULT', data)
+    print(f'Round {fields[0]} is over, the answer was {fields[1]}. {fields[3]} of {fields[2]} answers were correct.')
+    for place, standing in enumerate(fields[4:], 1):
+        print(f'{place}. {standing.replace(":", " : ")}')
+
+
+def send_room_answer(conn, round_number, choice):
+    """
+    sends the answer to a room question, the server answers ROOM_ANSWER_OK or UNACCEPTABLE_ANSWER.
+    an answer that does not fit the message is sent as an empty choice, which the server does not accept either.
+    :param conn: server socket object.
+    :param round_number: the round of the question.
+    :param choice: the answer the user chose.
+    :return: None.
+    """
+    cmd = chatlib.PROTOCOL_CLIENT['room_answer_msg']
+    data = chatlib.encode_fields(cmd, [round_number, choice]) or chatlib.encode_fields(cmd, [round_number, ''])
+    build_and_send_message(conn, cmd, data)
+
+
+def play_room_round(conn, choose_answer=ask_answer):
+    """
+    starts a round in the room, or waits for the running one, answers its question and prints the results.
+    the room question and results are sent to all the players, they come in between the answers to our requests.
+    :param conn: server socket object.
+    :param choose_answer: function(question_list, retry) that returns the answer, asks the user by default.
+    :return: the ROUND_RESULT message data, or None if the connection failed.
+    """
+    build_and_send_message(conn, chatlib.PROTOCOL_CLIENT['start_round_msg'], '')
+    round_number = 0  # rounds before this one ended before we asked to start
+    while True:
+        cmd, data = recv_message_and_parse(conn)
+        if cmd is None:
+            return None
+        if cmd == 'ROUND_STARTED':
+            round_number = int(data)
+        elif cmd == 'ROOM_QUESTION':
+            fields = chatlib.decode_fields(cmd, data)
+            if fields is None or fields[0] < round_number:
+                continue
+            print(f'Round {fields[0]}, you have {fields[1]:g} seconds.')
+            send_room_answer(conn, fields[0], choose_answer(fields[2:], False))
+        elif cmd == 'UNACCEPTABLE_ANSWER':
+            send_room_answer(conn, fields[0], choose_answer(fields[2:], True))
+        elif cmd == 'ROUND_RESULT':
+            if chatlib.decode_fields(cmd, data)[0] >= round_number:
+                print_round_result(data)
+                return data
+        elif cmd == 'ERROR':
+            print(data)  # a round is running already, or the answer came too late
+
+
+def play_room(conn):
+    """
+    joins a room and plays rounds in it until the user leaves.
+    :param conn: server socket object.
+    :return: None.
+    """
+    if join_room(conn, input('Room name:\n')) is None:
+        return
+    while input('Enter to play a round, q to leave the room\n') != 'q':
+        play_room_round(conn)
+    leave_room(conn)
 
 
 def get_logged_users(conn):
     """
     receives a server socket object and prints out the users_information_dict' list currently connected.
     :param conn: server socket object.
-    :return:
+    :return: the logged users, one per line.
     """
     cmd, data = build_send_recv_parse(conn, chatlib.PROTOCOL_CLIENT['logged_answer_msg'], '')
     print(f'Connected users_information_dict at this time:\n {data}')
+    return data
 
 
 def main():
+    global SERVER_IP
+    global SERVER_PORT
+    global TLS_CONTEXT
+    parser = argparse.ArgumentParser(description='Interactive trivia client.')
+    parser.add_argument('--host', default=SERVER_IP)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--tls', action='store_true', help='connect over TLS')
+    parser.add_argument('--tls-ca', help='PEM certificate to trust, e.g. the self-signed server certificate')
+    args = parser.parse_args()
+    SERVER_IP = args.host
+    SERVER_PORT = args.port
+    if args.tls or args.tls_ca:
+        TLS_CONTEXT = tls.create_client_context(args.tls_ca)
     client_socket = connect()
+    if input('Are you a new user? (y/n)\n') == 'y':
+        register(client_socket)
     login(client_socket)
     user_choice = ''
     while user_choice != 'q':
         user_choice = input('-----------------------------\nplease enter one of the above:\n'
-                            'p        Play a trivia question\ns        Get my score\nh        Get high score\n'
-                            'q        Quit\nl        Get current logged users\n-----------------------------\n')
-        if user_choice not in ['s', 'h', 'q', 'p', 'l']:
+                            'p        Play a trivia question\nc        Play a question of a category\n'
+                            's        Get my score\nh        Get high score\n'
+                            'r        Get my rank\nm        Play in a room\nq        Quit\n'
+                            'l        Get current logged users\n'
+                            '-----------------------------\n')
+        if user_choice not in ['s', 'h', 'r', 'q', 'p', 'c', 'l', 'm']:
             user_choice = input('-----------------------------\nplease enter one of the above:\n'
-                                'p        Play a trivia question\ns        Get my score\nh        Get high score\n'
-                                'q        Quit\nl        Get current logged users\n-----------------------------\n')
+                                'p        Play a trivia question\nc        Play a question of a category\n'
+                                's        Get my score\nh        Get high score\n'
+                                'r        Get my rank\nm        Play in a room\nq        Quit\n'
+                                'l        Get current logged users\n'
+                                '-----------------------------\n')
         if user_choice == 'h':
             get_highscore(client_socket)
         elif user_choice == 's':
             get_score(client_socket)
+        elif user_choice == 'r':
+            get_rank(client_socket)
         elif user_choice == 'p':
             play_question(client_socket)
+        elif user_choice == 'c':
+            play_category(client_socket)
         elif user_choice == 'l':
             get_logged_users(client_socket)
+        elif user_choice == 'm':
+            play_room(client_socket)
     logout(client_socket)
 
 
@@ -0,0 +1,61 @@
+import hashlib  # For the scrypt key derivation function
+import hmac  # For comparing secrets in constant time
+import os
+import secrets  # For the login tokens
+
+# scrypt cost, about 50ms and 16MB per hash. stored hashes keep their own parameters,
+# so raising them later only affects new hashes and the ones upgraded at login.
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+KEY_SIZE = 32
+HASH_PREFIX = 'scrypt'
+TOKEN_SIZE = 24  # random bytes of a login token
+
+
+def hash_password(password):
+    """
+    hashes a password with a random salt. CPU heavy on purpose, run it on the executor.
+    :param password: the password.
+    :return: 'scrypt$n$r$p$salt$key' with the salt and the key in hex.
+    """
+    salt = os.urandom(SALT_SIZE)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=KEY_SIZE,
+                         maxmem=256 * SCRYPT_N * SCRYPT_R)
+    return f'{HASH_PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${key.hex()}'
+
+
+def verify_password(password, stored):
+    """
+    checks a password against a stored hash. passwords stored in plain text by older servers are compared
+    as they are, needs_rehash tells they should be replaced. CPU heavy on purpose, run it on the executor.
+    :param password: the password the client sent.
+    :param stored: the stored hash.
+    :return: True if the password matches.
+    """
+    fields = stored.split('$')
+    if len(fields) != 6 or fields[0] != HASH_PREFIX:
+        return hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        n, r, p = int(fields[1]), int(fields[2]), int(fields[3])
+        salt, key = bytes.fromhex(fields[4]), bytes.fromhex(fields[5])
+    except ValueError:
+        return False
+    return hmac.compare_digest(hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=len(key),
+                                              maxmem=256 * n * r), key)
+
+
+def needs_rehash(stored):
+    """
+    :param stored: the stored hash.
+    :return: True if the password is stored in plain text or with other costs than the current ones.
+    """
+    return not stored.startswith(f'{HASH_PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$')
+
+
+def new_token():
+    """
+    :return: a random login token, safe to send in a protocol field.
+    """
+    return secrets.token_urlsafe(TOKEN_SIZE)
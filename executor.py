@@ -0,0 +1,127 @@
+import logging  # For callbacks that fail
+import queue  # For the bounded queue of jobs waiting for a thread
+import socket  # For waking up the server loop when a job is done
+import threading  # For running blocking work off the server loop
+import time
+from collections import deque  # For handing the finished jobs over to the server loop
+import metrics  # job latency histograms and counters
+
+logger = logging.getLogger('trivia')
+
+
+class Executor:
+    """
+    bounded pool of threads for blocking work: database reads, password hashing, the question API.
+    the server loop submits a job with a callback and goes on serving other clients. once the job is done
+    a byte is written to a socketpair, so the loop wakes up from select() and calls the callback itself,
+    callbacks never run on the pool threads. when the queue is full new jobs are refused, not queued.
+    threads are enough for the jobs we have: sqlite, hashlib and sockets release the GIL while they wait.
+    """
+
+    __slots__ = ('threads', 'max_queue', 'jobs', 'completions', 'wake_reader', 'wake_writer', 'in_flight')
+
+    def __init__(self, threads=4, max_queue=256):
+        """
+        :param threads: threads running jobs.
+        :param max_queue: jobs that may wait for a thread, more are refused.
+        """
+        self.max_queue = max_queue
+        self.jobs = queue.Queue(max_queue)
+        self.completions = deque()  # (name, callback, result, error, submitted, started, finished) of finished jobs
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.in_flight = 0  # jobs submitted whose callback was not called yet
+        self.threads = [threading.Thread(target=self.work, name=f'executor-{number}', daemon=True)
+                        for number in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def __len__(self):
+        return self.in_flight
+
+    def fileno(self):
+        """
+        :return: fileno of the socket that becomes readable when jobs are done, for select().
+        """
+        return self.wake_reader.fileno()
+
+    def submit(self, name, function, args, callback):
+        """
+        runs function(*args) on a pool thread, and callback(result, error) on the server loop once it is done.
+        :param name: name of the job in the metrics.
+        :param function: blocking function to run.
+        :param args: tuple of arguments of the function.
+        :param callback: called from run_completions() with the result, or with None and the exception it raised.
+        :return: True if the job was queued, False if the queue is full.
+        """
+        try:
+            self.jobs.put_nowait((name, function, args, callback, time.perf_counter()))
+        except queue.Full:
+            metrics.add_rejected_job(name)
+            return False
+        self.in_flight += 1
+        return True
+
+    def work(self):
+        """
+        pool thread body, runs jobs until it gets None.
+        :return: None.
+        """
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            name, function, args, callback, submitted = job
+            started = time.perf_counter()
+            try:
+                result, error = function(*args), None
+            except Exception as exception:
+                result, error = None, exception
+            self.completions.append((name, callback, result, error, submitted, started, time.perf_counter()))
+            try:
+                self.wake_writer.send(b'\0')
+            except OSError:
+                pass  # the socket buffer is full of wake ups already, the loop is going to look anyway
+
+    def run_completions(self):
+        """
+        called from the server loop when the wake up socket is readable, calls the callbacks of the finished jobs.
+        a callback that raises is logged, the other callbacks and the server loop go on.
+        :return: amount of jobs finished.
+        """
+        try:
+            while self.wake_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        finished = 0
+        while self.completions:
+            name, callback, result, error, submitted, started, ended = self.completions.popleft()
+            self.in_flight -= 1
+            finished += 1
+            metrics.observe_job(name, started - submitted, ended - started, error is not None)
+            try:
+                callback(result, error)
+            except Exception:
+                logger.exception('Callback of the %s job failed', name)
+        return finished
+
+    def get_stats(self):
+        """
+        :return: dict of the executor gauges.
+        """
+        return {'executor_threads': len(self.threads), 'executor_queue_limit': self.max_queue,
+                'executor_queue_depth': self.jobs.qsize(), 'executor_jobs_in_flight': self.in_flight}
+
+    def close(self):
+        """
+        stops the threads once the jobs queued before are done, and closes the wake up socket.
+        :return: None.
+        """
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.wake_reader.close()
+        self.wake_writer.close()
@@ -0,0 +1,73 @@
+from bisect import bisect_left, insort  # For keeping the scores sorted on every update
+
+
+class Leaderboard:
+    """
+    users sorted by score, kept up to date on every score change instead of sorted on every request.
+    entries are (-score, username) tuples in a sorted list, so the highest score comes first and
+    equal scores are ordered by username.
+    top(n) is O(n), rank() is O(log n), an update is O(log n) compares plus moving the users it passes.
+    """
+
+    __slots__ = ('entries', 'scores')
+
+    def __init__(self, scores=None):
+        """
+        :param scores: optional dict of username -> score to start with.
+        """
+        self.scores = dict(scores or {})
+        self.entries = sorted((-score, username) for username, score in self.scores.items())
+
+    def __len__(self):
+        return len(self.scores)
+
+    def set_score(self, username, score):
+        """
+        sets the user score, adds the user if needed.
+        :param username: the user name.
+        :param score: the new score.
+        :return: None.
+        """
+        old_score = self.scores.get(username)
+        self.scores[username] = score
+        new_entry = (-score, username)
+        if old_score is None:
+            insort(self.entries, new_entry)
+            return
+        # shift only the entries between the old and the new position, a score change is usually a short move.
+        old_index = bisect_left(self.entries, (-old_score, username))
+        new_index = bisect_left(self.entries, new_entry)
+        if new_index <= old_index:
+            self.entries[new_index + 1:old_index + 1] = self.entries[new_index:old_index]
+            self.entries[new_index] = new_entry
+        else:
+            self.entries[old_index:new_index - 1] = self.entries[old_index + 1:new_index]
+            self.entries[new_index - 1] = new_entry
+
+    def add_score(self, username, points):
+        """
+        adds points to the user score.
+        :param username: the user name.
+        :param points: points to add.
+        :return: the new score.
+        """
+        score = self.scores.get(username, 0) + points
+        self.set_score(username, score)
+        return score
+
+    def top(self, amount):
+        """
+        :param amount: amount of users to return.
+        :return: list of (username, score) tuples, highest score first.
+        """
+        return [(username, -negative_score) for negative_score, username in self.entries[:amount]]
+
+    def rank(self, username):
+        """
+        :param username: the user name.
+        :return: 1 + amount of users with a higher score, or None for an unknown user.
+        """
+        score = self.scores.get(username)
+        if score is None:
+            return None
+        return bisect_left(self.entries, (-score,)) + 1
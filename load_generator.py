@@ -0,0 +1,214 @@
+import argparse  # For the load options
+import asyncio  # For running thousands of players in one process
+import json  # For the report
+import random  # For the command mix, the answers and the think time
+import sys
+import time
+from collections import deque  # For matching every response to the request it answers
+import chatlib  # protocol functions
+import client_side_trivia  # the protocol version and question parsing of the interactive client
+import tls  # TLS contexts
+
+DEFAULT_MIX = 'GET_QUESTION=4,SEND_ANSWER=4,MY_SCORE=1,HIGHSCORE=1,MY_RANK=1'
+CONNECT_CONCURRENCY = 200  # connections opened at the same time, keeps us below the listen backlog
+RESPONSE_TIMEOUT = 10  # seconds to wait for a response before the player gives up
+READ_SIZE = 64 * 1024
+# session commands, and room commands whose room messages are not answers to a request of the player
+NOT_IN_MIX = ('LOGIN', 'LOGOUT', 'REGISTER', 'JOIN_ROOM', 'LEAVE_ROOM', 'START_ROUND', 'ROOM_ANSWER')
+
+
+def parse_mix(mix):
+    """
+    parses a command mix like 'GET_QUESTION=4,MY_SCORE=1', the numbers are relative weights.
+    :param mix: the mix string.
+    :return: (list of commands, list of weights).
+    """
+    commands, weights = list(), list()
+    for item in mix.split(','):
+        cmd, _, weight = item.partition('=')
+        if cmd not in chatlib.PROTOCOL_CLIENT.values() or cmd in NOT_IN_MIX:
+            raise ValueError(f'{cmd} can not be part of the mix.')
+        commands.append(cmd)
+        weights.append(float(weight or 1))
+    return commands, weights
+
+
+def percentile(sorted_values, fraction):
+    """
+    :param sorted_values: sorted list of numbers.
+    :param fraction: 0.5 for the median, 0.99 for p99...
+    :return: the nearest rank percentile, 0 for an empty list.
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def request(reader, writer, buffer, cmd, data, version):
+    """
+    sends one message and waits for its response, for the login handshake.
+    :param buffer: receive buffer of the connection.
+    :return: response command and data.
+    """
+    message = bytearray()
+    chatlib.encode_message_into(message, cmd, data.encode(), version)
+    writer.write(message)
+    frame = chatlib.pop_frame(buffer)
+    while frame is None:
+        received = await asyncio.wait_for(reader.read(READ_SIZE), RESPONSE_TIMEOUT)
+        if not received:
+            return chatlib.ERROR_RETURN, chatlib.ERROR_RETURN
+        buffer += received
+        frame = chatlib.pop_frame(buffer)
+    return frame
+
+
+async def connect_player(args, player_number, semaphore):
+    """
+    connects one player and logs it in, registering its user first if asked to.
+    :return: (reader, writer, receive buffer, protocol version) or None if the server did not accept the player.
+    """
+    username = f'{args.username}{player_number}' if args.register else args.username
+    async with semaphore:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(args.host, args.port, ssl=args.ssl_context),
+                                                    RESPONSE_TIMEOUT)
+            buffer = bytearray()
+            if args.register:
+                await request(reader, writer, buffer, 'REGISTER', f'{username}#{args.password}', chatlib.PROTOCOL_TEXT)
+            cmd, data = await request(reader, writer, buffer, 'LOGIN', f'{username}#{args.password}#{args.protocol}',
+                                      chatlib.PROTOCOL_TEXT)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        if cmd != 'LOGIN_OK':
+            writer.close()
+            return None
+        fields = chatlib.decode_fields(cmd, data)
+        return reader, writer, buffer, fields[0] if fields else chatlib.PROTOCOL_TEXT
+
+
+async def run_player(player, args, commands, weights, deadline, results):
+    """
+    keeps up to args.depth requests in flight until the deadline or the request limit,
+    and records the latency of every response.
+    :param results: dict of cmd -> {'latencies': [...], 'errors': int}, shared by all players.
+    :return: None.
+    """
+    reader, writer, buffer, version = player
+    in_flight = deque()  # (cmd, sent at), the server answers in order
+    question_id = None
+    sent = 0
+    try:
+        while True:
+            message = bytearray()
+            while len(in_flight) < args.depth and time.perf_counter() < deadline and \
+                    (not args.requests or sent < args.requests):
+                cmd = random.choices(commands, weights)[0]
+                data = ''
+                if cmd == 'SEND_ANSWER':
+                    if question_id is None:
+                        cmd = 'GET_QUESTION'
+                    else:
+                        data = f'{question_id}#{random.randint(1, 4)}'
+                        question_id = None  # the server takes one answer per question
+                chatlib.encode_message_into(message, cmd, data.encode(), version)
+                in_flight.append((cmd, time.perf_counter()))
+                sent += 1
+            if message:
+                writer.write(message)
+            if not in_flight:
+                return
+            received = await asyncio.wait_for(reader.read(READ_SIZE), RESPONSE_TIMEOUT)
+            if not received:
+                break
+            buffer += received
+            received_at = time.perf_counter()
+            answered = 0
+            for cmd, data in chatlib.iter_frames(buffer):
+                request_cmd, sent_at = in_flight.popleft()
+                result = results[request_cmd]
+                result['latencies'].append(received_at - sent_at)
+                if cmd is None or cmd == 'ERROR':
+                    result['errors'] += 1
+                elif cmd == 'YOUR_QUESTION':
+                    question_id = client_side_trivia.parse_question(data)[0]
+                answered += 1
+            if answered and args.think_time:
+                await asyncio.sleep(random.expovariate(1 / args.think_time))
+    except (OSError, asyncio.TimeoutError, IndexError):
+        pass
+    finally:
+        for request_cmd, sent_at in in_flight:
+            results[request_cmd]['errors'] += 1  # never answered
+        writer.close()
+
+
+async def generate_load(args):
+    """
+    connects all the players, runs them together and builds the report.
+    :return: report dict.
+    """
+    commands, weights = parse_mix(args.mix)
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+    players = await asyncio.gather(*[connect_player(args, i, semaphore) for i in range(args.players)])
+    players = [player for player in players if player is not None]
+    results = {cmd: {'latencies': list(), 'errors': 0} for cmd in commands + ['GET_QUESTION']}
+    start = time.perf_counter()
+    await asyncio.gather(*[run_player(player, args, commands, weights, start + args.duration, results)
+                           for player in players])
+    elapsed = time.perf_counter() - start
+    report = {'players': args.players, 'connected': len(players), 'duration_sec': round(elapsed, 3),
+              'depth': args.depth, 'think_time_sec': args.think_time, 'protocol': args.protocol, 'commands': {}}
+    answered = errors = 0
+    for cmd, result in results.items():
+        latencies = sorted(result['latencies'])
+        if not latencies and not result['errors']:
+            continue
+        answered += len(latencies)
+        errors += result['errors']
+        report['commands'][cmd] = {'requests': len(latencies), 'errors': result['errors'],
+                                   'p50_ms': round(percentile(latencies, 0.5) * 1e3, 3),
+                                   'p95_ms': round(percentile(latencies, 0.95) * 1e3, 3),
+                                   'p99_ms': round(percentile(latencies, 0.99) * 1e3, 3),
+                                   'max_ms': round(latencies[-1] * 1e3 if latencies else 0.0, 3)}
+    report['requests'] = answered
+    report['errors'] = errors
+    report['requests_per_sec'] = round(answered / elapsed if elapsed else 0.0, 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless trivia players, reports throughput and latency as JSON.')
+    parser.add_argument('--host', default=client_side_trivia.SERVER_IP)
+    parser.add_argument('--port', type=int, default=client_side_trivia.SERVER_PORT)
+    parser.add_argument('--players', type=int, default=1000, help='concurrent players')
+    parser.add_argument('--duration', type=float, default=10, help='seconds every player keeps sending requests')
+    parser.add_argument('--requests', type=int, default=0, help='stop every player after this many requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='commands and their weights')
+    parser.add_argument('--think-time', type=float, default=0, help='mean seconds a player waits after a response')
+    parser.add_argument('--depth', type=int, default=1, help='requests every player keeps in flight')
+    parser.add_argument('--protocol', type=int, default=client_side_trivia.PROTOCOL_VERSION,
+                        choices=(chatlib.PROTOCOL_TEXT, chatlib.PROTOCOL_BINARY))
+    parser.add_argument('--username', default='test')
+    parser.add_argument('--password', default='test')
+    parser.add_argument('--register', action='store_true',
+                        help='register a user per player, named username + player number')
+    parser.add_argument('--output', help='file to write the JSON report to, stdout by default')
+    parser.add_argument('--tls', action='store_true', help='connect over TLS, every player makes a full handshake')
+    parser.add_argument('--tls-ca', help='PEM certificate to trust, e.g. the self-signed server certificate')
+    args = parser.parse_args()
+    args.ssl_context = tls.create_client_context(args.tls_ca) if args.tls or args.tls_ca else None
+    try:
+        parse_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+    report = json.dumps(asyncio.run(generate_load(args)), indent=2)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(report + '\n')
+    else:
+        sys.stdout.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
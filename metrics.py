@@ -0,0 +1,179 @@
+import threading  # For serving the metrics over HTTP next to the server loop
+from bisect import bisect_left  # For finding the histogram bucket of a latency
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # For the Prometheus scrape endpoint
+
+# Upper bounds of the latency histogram buckets, in seconds. The last bucket (+Inf) takes everything slower.
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+METRIC_PREFIX = 'trivia_'
+command_counts = dict()  # cmd -> amount of messages handled
+command_latencies = dict()  # cmd -> [bucket counts..., +Inf count], not cumulative until rendered
+command_seconds = dict()  # cmd -> total seconds spent handling it
+job_latencies = dict()  # executor job name -> [bucket counts..., +Inf count] of queue wait plus run time
+job_seconds = dict()  # job name -> total seconds from submit to done
+job_wait_seconds = dict()  # job name -> total seconds jobs waited in the queue for a thread
+job_errors = dict()  # job name -> amount of jobs that raised
+jobs_rejected = dict()  # job name -> amount of jobs refused because the executor queue was full
+counters = {'connections_opened': 0, 'connections_closed': 0, 'bytes_in': 0, 'bytes_out': 0,
+            'idle_timeouts': 0, 'login_timeouts': 0, 'answer_timeouts': 0}
+
+
+def observe_command(cmd, seconds):
+    """
+    counts a handled message and adds the time its handle_*_message function took to the command histogram.
+    :param cmd: the command, None for a message that could not be parsed.
+    :param seconds: time spent handling it.
+    :return: None.
+    """
+    buckets = command_latencies.get(cmd)
+    if buckets is None:
+        buckets = command_latencies[cmd] = [0] * (len(LATENCY_BUCKETS) + 1)
+        command_counts[cmd] = 0
+        command_seconds[cmd] = 0.0
+    buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    command_counts[cmd] += 1
+    command_seconds[cmd] += seconds
+
+
+def observe_job(name, wait_seconds, run_seconds, failed=False):
+    """
+    adds a finished executor job to the job histogram, the latency is the queue wait plus the run time.
+    :param name: name of the job, e.g. load_user.
+    :param wait_seconds: time the job waited for a thread.
+    :param run_seconds: time the job ran.
+    :param failed: True if the job raised.
+    :return: None.
+    """
+    buckets = job_latencies.get(name)
+    if buckets is None:
+        buckets = job_latencies[name] = [0] * (len(LATENCY_BUCKETS) + 1)
+        job_seconds[name] = job_wait_seconds[name] = 0.0
+        job_errors[name] = 0
+    buckets[bisect_left(LATENCY_BUCKETS, wait_seconds + run_seconds)] += 1
+    job_seconds[name] += wait_seconds + run_seconds
+    job_wait_seconds[name] += wait_seconds
+    if failed:
+        job_errors[name] += 1
+
+
+def add_rejected_job(name):
+    """
+    counts a job the executor refused because its queue was full.
+    :param name: name of the job.
+    """
+    jobs_rejected[name] = jobs_rejected.get(name, 0) + 1
+
+
+def render_histogram(lines, metric, label, latencies, seconds):
+    """
+    adds a latency histogram per label value to the Prometheus text lines.
+    :param lines: list of lines to add to.
+    :param metric: name of the histogram, without METRIC_PREFIX.
+    :param label: name of the label, e.g. command.
+    :param latencies: dict of label value -> bucket counts.
+    :param seconds: dict of label value -> total seconds.
+    :return: None.
+    """
+    lines.append(f'# TYPE {METRIC_PREFIX}{metric} histogram')
+    for value, buckets in list(latencies.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+            cumulative += count
+            lines.append(f'{METRIC_PREFIX}{metric}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_PREFIX}{metric}_sum{{{label}="{value}"}} {seconds.get(value, 0.0):.6f}')
+        lines.append(f'{METRIC_PREFIX}{metric}_count{{{label}="{value}"}} {cumulative}')
+
+
+def connection_opened():
+    """
+    counts a client connection the server accepted.
+    """
+    counters['connections_opened'] += 1
+
+
+def connection_closed():
+    """
+    counts a client connection that was closed.
+    """
+    counters['connections_closed'] += 1
+
+
+def add_timeout(reason):
+    """
+    counts a session the server closed, or a question it stopped waiting for, because the client ran out of time.
+    :param reason: 'idle', 'login' or 'answer'.
+    """
+    counters[reason + '_timeouts'] += 1
+
+
+def add_bytes_in(amount):
+    """
+    :param amount: bytes received from a client.
+    """
+    counters['bytes_in'] += amount
+
+
+def add_bytes_out(amount):
+    """
+    :param amount: bytes sent to a client.
+    """
+    counters['bytes_out'] += amount
+
+
+def render_prometheus(gauges=None, name=''):
+    """
+    renders the metrics in the Prometheus text exposition format.
+    may be called from another thread, the dicts are copied before they are read.
+    :param gauges: optional dict of name -> value of other current values to include, e.g. the send queues.
+    :param name: only render the metrics whose name (without METRIC_PREFIX) starts with this.
+    :return: the metrics text.
+    """
+    lines = [f'# TYPE {METRIC_PREFIX}commands_total counter']
+    lines += [f'{METRIC_PREFIX}commands_total{{command="{cmd}"}} {count}'
+              for cmd, count in list(command_counts.items())]
+    render_histogram(lines, 'command_seconds', 'command', command_latencies, command_seconds)
+    render_histogram(lines, 'job_seconds', 'job', job_latencies, job_seconds)
+    lines.append(f'# TYPE {METRIC_PREFIX}job_wait_seconds_total counter')
+    lines += [f'{METRIC_PREFIX}job_wait_seconds_total{{job="{job}"}} {seconds:.6f}'
+              for job, seconds in list(job_wait_seconds.items())]
+    for metric, values in (('job_errors', job_errors), ('jobs_rejected', jobs_rejected)):
+        lines.append(f'# TYPE {METRIC_PREFIX}{metric}_total counter')
+        lines += [f'{METRIC_PREFIX}{metric}_total{{job="{job}"}} {value}' for job, value in list(values.items())]
+    for counter, value in list(counters.items()):
+        lines.append(f'# TYPE {METRIC_PREFIX}{counter}_total counter')
+        lines.append(f'{METRIC_PREFIX}{counter}_total {value}')
+    lines.append(f'# TYPE {METRIC_PREFIX}connections gauge')
+    lines.append(f'{METRIC_PREFIX}connections {counters["connections_opened"] - counters["connections_closed"]}')
+    for gauge, value in (gauges or {}).items():
+        lines.append(f'# TYPE {METRIC_PREFIX}{gauge} gauge')
+        lines.append(f'{METRIC_PREFIX}{gauge} {value}')
+    if name:
+        lines = [line for line in lines if line.startswith((METRIC_PREFIX + name, f'# TYPE {METRIC_PREFIX}{name}'))]
+    return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(get_gauges=None, host='127.0.0.1', port=0):
+    """
+    starts a Prometheus scrape endpoint (GET /metrics) in a background thread.
+    :param get_gauges: optional function returning the gauges dict for render_prometheus.
+    :param host: ip to listen on.
+    :param port: port to listen on, 0 picks a free one.
+    :return: the http server.
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus(get_gauges() if get_gauges else None).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,458 @@
+import argparse  # For converting question files to bank files
+import bisect  # For finding question keys in a bank file
+import hashlib  # For the generation of a bank and the question keys
+import html  # For decoding the HTML entities in questions from the API
+import json  # For the question stats file
+import mmap  # For sharing the pages of a bank file between the worker processes
+import os
+import struct  # For the header and the integer arrays of a bank file
+import sys
+from array import array  # For the integer arrays of a bank file on big-endian machines
+import chatlib
+import alias_table  # weighted difficulty picks
+import question_source  # question files and the question cache
+
+# a bank file is the question bank, ready to be served: a header, the answers amount and the correct choice of every
+# question (2 bytes each), its tag (category * DIFFICULTY_AMOUNT + difficulty, 2 bytes each), a table of offsets,
+# the sorted question keys, the index, the category names, then the YOUR_QUESTION message of every question in the
+# text protocol and in the binary protocol, back to back. offsets[2 * i] is where the text message of the question
+# with index i starts, offsets[2 * i + 1] its binary message, and offsets[2 * size] the end of the file. the keys
+# (question_key as an 8 byte integer) find a question that is already in the file without reading the messages.
+# the index holds the question indexes sorted by tag and sorted by difficulty, and where every tag and every
+# difficulty starts in them, so the questions of a category, a difficulty or both are a slice. a bank file is
+# mapped, not read: loading it costs the same for any amount of questions, and workers share its pages.
+BANK_MAGIC = b'TQB4'
+BANK_FILE_SUFFIX = '.tqb'
+HEADER = struct.Struct('<4sIQI')  # magic, amount of questions, generation, amount of categories
+SECTION_ALIGNMENT = 8
+TYPE_SIZES = {'H': 2, 'I': 4, 'Q': 8}  # little-endian integer arrays of a bank file
+MAX_ANSWERS = 255
+ACCEPTABLE_CHOICES = [frozenset(str(choice) for choice in range(1, amount + 1)) for amount in range(MAX_ANSWERS + 1)]
+CHOICES = [str(choice) for choice in range(MAX_ANSWERS + 1)]
+DIFFICULTIES = ('easy', 'medium', 'hard')  # difficulty ids are positions here, easiest first
+DIFFICULTY_AMOUNT = len(DIFFICULTIES)
+DIFFICULTY_IDS = {difficulty: difficulty_id for difficulty_id, difficulty in enumerate(DIFFICULTIES)}
+DEFAULT_DIFFICULTY = 'easy'  # questions without a difficulty, older servers only fetched easy questions
+DEFAULT_CATEGORY = 'Uncategorized'
+MAX_TAGS = 2 ** 16  # tags are kept in 2 bytes
+NO_QUESTIONS = (None, 0, 0)  # index slice of a category that only has questions added after the file
+
+
+def decode_question(question):
+    """
+    decodes the HTML entities of a question, questions from the API have them.
+    :param question: question dict (question, answers, correct, and category and difficulty if known).
+    :return: the decoded question dict, or None if it can't be kept in a bank.
+    """
+    answers = [html.unescape(answer) for answer in question['answers']]
+    if not 0 < int(question['correct']) <= len(answers) <= MAX_ANSWERS:
+        return None
+    category = ' '.join(html.unescape(question.get('category') or DEFAULT_CATEGORY).split())
+    difficulty = DIFFICULTY_IDS.get(str(question.get('difficulty')).lower(), DIFFICULTY_IDS[DEFAULT_DIFFICULTY])
+    return {'question': html.unescape(question['question']), 'answers': answers, 'correct': int(question['correct']),
+            'category': category, 'difficulty': difficulty}
+
+
+def question_key(question):
+    """
+    :param question: text of a question, HTML entities decoded.
+    :return: key of the question in the answer log and in the question stats, the same in every bank.
+    """
+    return hashlib.blake2b(question.encode(), digest_size=8).hexdigest()
+
+
+def get_key_number(key):
+    """
+    :param key: question_key of a question.
+    :return: the key as the integer kept in the keys of a bank file.
+    """
+    return int(key, 16)
+
+
+def read_array(buffer, typecode, start, amount):
+    """
+    :param buffer: memoryview of the bank file.
+    :param typecode: 'H', 'I' or 'Q'.
+    :param start: where the array starts in the file.
+    :param amount: amount of integers in the array.
+    :return: the integers, a view of the file on little-endian machines, a swapped copy on others.
+    """
+    view = buffer[start:start + TYPE_SIZES[typecode] * amount]
+    if sys.byteorder == 'little':
+        return view.cast(typecode)
+    values = array(typecode, view)
+    values.byteswap()
+    return values
+
+
+class QuestionBank:
+    """
+    the questions the server asks, by index (question id - 1): their YOUR_QUESTION messages in both protocol
+    versions, the choices that answer them, and their category and difficulty. a bank is built once and never
+    changes, except for questions added at the end by the API refills, so question orders over it stay valid.
+    a reload builds a new bank and the server swaps it in at once, clients that were asked a question of the old
+    bank answer it there.
+    the questions of a category and/or a difficulty are a selection, a question order walks a selection by position
+    and pick maps a position to the question index in O(1).
+    """
+
+    __slots__ = ('generation', 'buffer', 'size', 'choices', 'tags', 'offsets', 'keys', 'by_tag', 'by_difficulty',
+                 'tag_starts', 'difficulty_starts', 'file_categories', 'categories', 'category_ids',
+                 'added_payloads', 'added_binary_payloads', 'added_answers', 'added_tags', 'added_selections',
+                 'added_keys', 'difficulty_tables', 'difficulties')
+
+    def __init__(self, buffer):
+        """
+        :param buffer: the bank file, bytes or a mmap of it.
+        """
+        magic, size, generation, categories = HEADER.unpack_from(buffer)
+        if magic != BANK_MAGIC:
+            raise ValueError('not a question bank file, or one of an older server. convert the questions again.')
+        self.generation = generation  # digest of the questions, the same file has the same one in every process
+        self.buffer = memoryview(buffer)
+        self.size = size  # questions in the file
+        self.choices = self.buffer[HEADER.size:HEADER.size + 2 * size]
+        tags_start, offsets_start, keys_start, index_start, names_start = get_sections(size, categories)
+        self.tags = read_array(self.buffer, 'H', tags_start, size)
+        self.offsets = read_array(self.buffer, 'Q', offsets_start, 2 * size + 1)
+        self.keys = read_array(self.buffer, 'Q', keys_start, size)  # sorted key numbers of the questions
+        self.by_tag = read_array(self.buffer, 'I', index_start, size)
+        self.by_difficulty = read_array(self.buffer, 'I', index_start + 4 * size, size)
+        self.tag_starts = read_array(self.buffer, 'I', index_start + 8 * size, categories * DIFFICULTY_AMOUNT + 1)
+        self.difficulty_starts = read_array(self.buffer, 'I', names_start - 4 * (DIFFICULTY_AMOUNT + 1),
+                                            DIFFICULTY_AMOUNT + 1)
+        self.file_categories = categories  # categories of the questions in the file, the index covers them
+        self.categories = bytes(self.buffer[names_start:self.offsets[0]]).decode().split('\n') if categories else []
+        self.category_ids = {category: category_id for category_id, category in enumerate(self.categories)}
+        self.added_payloads = list()  # text messages of the questions added after the file, by index - size
+        self.added_binary_payloads = list()
+        self.added_answers = list()  # (answers amount, correct choice) of the questions added after the file
+        self.added_tags = list()
+        self.added_selections = dict()  # (category, difficulty) -> indexes of the questions added after the file
+        self.added_keys = set()  # key numbers of the questions added after the file
+        self.difficulty_tables = dict()  # (category, weights) -> AliasTable, see get_difficulty_table
+        self.difficulties = None  # question key -> difficulty id of the stats the bank was loaded with, see load_bank
+
+    def __len__(self):
+        return self.size + len(self.added_answers)
+
+    def get_payload(self, index, version=chatlib.PROTOCOL_TEXT):
+        """
+        :param index: index of the question.
+        :param version: protocol version of the client.
+        :return: YOUR_QUESTION message of the question, encoded and ready to be forwarded to the client.
+        """
+        if index >= self.size:
+            if version == chatlib.PROTOCOL_BINARY:
+                return self.added_binary_payloads[index - self.size]
+            return self.added_payloads[index - self.size]
+        position = 2 * index + (version == chatlib.PROTOCOL_BINARY)
+        return self.buffer[self.offsets[position]:self.offsets[position + 1]]
+
+    def get_answers(self, index):
+        """
+        :param index: index of the question.
+        :return: (acceptable choices, correct choice) of the question, for checking answers in O(1).
+        """
+        if index >= self.size:
+            amount, correct = self.added_answers[index - self.size]
+        else:
+            amount, correct = self.choices[2 * index], self.choices[2 * index + 1]
+        return ACCEPTABLE_CHOICES[amount], CHOICES[correct]
+
+    def get_tags(self, index):
+        """
+        :param index: index of the question.
+        :return: (category id, difficulty id) of the question.
+        """
+        return divmod(self.tags[index] if index < self.size else self.added_tags[index - self.size],
+                      DIFFICULTY_AMOUNT)
+
+    def get_question(self, index):
+        """
+        :param index: index of the question.
+        :return: (question, list of answers), read back from its message.
+        """
+        cmd, data = chatlib.parse_frame(bytes(self.get_payload(index)))
+        fields = chatlib.decode_fields(cmd, data.decode())
+        return fields[1], fields[2:]
+
+    def get_file_selection(self, category, difficulty):
+        """
+        :param category: category id, or None for every category.
+        :param difficulty: difficulty id, or None for every difficulty.
+        :return: (index array, start, end), the questions of the file in the selection are index[start:end].
+        """
+        if category is None:
+            return self.by_difficulty, self.difficulty_starts[difficulty], self.difficulty_starts[difficulty + 1]
+        if category >= self.file_categories:
+            return NO_QUESTIONS
+        tag = category * DIFFICULTY_AMOUNT
+        if difficulty is None:
+            return self.by_tag, self.tag_starts[tag], self.tag_starts[tag + DIFFICULTY_AMOUNT]
+        return self.by_tag, self.tag_starts[tag + difficulty], self.tag_starts[tag + difficulty + 1]
+
+    def count(self, category=None, difficulty=None):
+        """
+        :param category: category id, or None for every category.
+        :param difficulty: difficulty id, or None for every difficulty.
+        :return: amount of questions in the selection.
+        """
+        if category is None and difficulty is None:
+            return len(self)
+        index, start, end = self.get_file_selection(category, difficulty)
+        return end - start + len(self.added_selections.get((category, difficulty), ()))
+
+    def pick(self, position, category=None, difficulty=None):
+        """
+        :param position: position in the selection, below count(category, difficulty).
+        :param category: category id, or None for every category.
+        :param difficulty: difficulty id, or None for every difficulty.
+        :return: index of the question at the position.
+        """
+        if category is None and difficulty is None:
+            return position
+        index, start, end = self.get_file_selection(category, difficulty)
+        if position < end - start:
+            return index[start + position]
+        return self.added_selections[(category, difficulty)][position - end + start]
+
+    def get_difficulty_table(self, category, weights):
+        """
+        :param category: category id, or None for every category.
+        :param weights: tuple of the weight of every difficulty.
+        :return: AliasTable that picks a difficulty by the weights among the ones the category has questions of,
+        or None if it has none. built once per bank, category and weights.
+        """
+        key = (category, weights)
+        table = self.difficulty_tables.get(key)
+        if table is None and key not in self.difficulty_tables:
+            weights = [weight if self.count(category, difficulty) else 0 for difficulty, weight in enumerate(weights)]
+            table = self.difficulty_tables[key] = alias_table.AliasTable(weights) if any(weights) else None
+        return table
+
+    def has_question(self, key_number):
+        """
+        :param key_number: get_key_number of the question key.
+        :return: True if the bank has the question, a binary search in the keys of the file.
+        """
+        if key_number in self.added_keys:
+            return True
+        position = bisect.bisect_left(self.keys, key_number)
+        return position < self.size and self.keys[position] == key_number
+
+    def add(self, question_list, difficulties=None):
+        """
+        adds questions at the end of the bank, skipping questions it already has.
+        HTML entities are decoded once here and the messages of every question are built ahead of time.
+        :param question_list: list of question dicts (question, answers, correct, and category and difficulty).
+        :param difficulties: question key -> difficulty id rated from the answers (see load_question_stats),
+        it replaces the difficulty the question came with.
+        :return: amount of questions added.
+        """
+        added = 0
+        for question in question_list:
+            question = decode_question(question)
+            if question is None:
+                continue
+            key = question_key(question['question'])
+            key_number = get_key_number(key)
+            if self.has_question(key_number):
+                continue
+            category = self.category_ids.get(question['category'])
+            if category is None:
+                if (len(self.categories) + 1) * DIFFICULTY_AMOUNT >= MAX_TAGS:
+                    continue
+                category = self.category_ids[question['category']] = len(self.categories)
+                self.categories.append(question['category'])
+            question_data = chatlib.join_data([len(self) + 1, question['question']] + question['answers'])
+            payload = chatlib.build_frame('YOUR_QUESTION', question_data)
+            if payload is None:
+                continue  # too long for the protocol
+            difficulty = question['difficulty']
+            if difficulties:
+                difficulty = difficulties.get(key, difficulty)
+            for selection in ((category, difficulty), (category, None), (None, difficulty)):
+                self.added_selections.setdefault(selection, []).append(len(self))
+            self.added_keys.add(key_number)
+            self.added_payloads.append(payload)
+            self.added_binary_payloads.append(chatlib.build_binary_message('YOUR_QUESTION', question_data))
+            self.added_answers.append((len(question['answers']), question['correct']))
+            self.added_tags.append(category * DIFFICULTY_AMOUNT + difficulty)
+            added += 1
+        if added:
+            self.difficulty_tables.clear()
+        return added
+
+
+def get_sections(size, categories):
+    """
+    :param size: amount of questions in the bank file.
+    :param categories: amount of categories in the bank file.
+    :return: where the tags, the offsets table, the keys, the index and the category names start.
+    the integer arrays after the tags are aligned to SECTION_ALIGNMENT.
+    """
+    tags_start = HEADER.size + 2 * size
+    offsets_start = -(-(tags_start + 2 * size) // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+    keys_start = offsets_start + 8 * (2 * size + 1)
+    index_start = keys_start + 8 * size
+    names_start = index_start + 4 * (2 * size + categories * DIFFICULTY_AMOUNT + 1 + DIFFICULTY_AMOUNT + 1)
+    return tags_start, offsets_start, keys_start, index_start, names_start
+
+
+def get_starts(keys, amount):
+    """
+    :param keys: sorted keys, from 0 up to amount - 1.
+    :param amount: amount of keys.
+    :return: where every key starts in keys, then len(keys).
+    """
+    starts = [0] * (amount + 1)
+    for key in keys:
+        starts[key + 1] += 1
+    for key in range(amount):
+        starts[key + 1] += starts[key]
+    return starts
+
+
+def pack_bank(answers, tags, payloads, binary_payloads, keys, categories):
+    """
+    :param answers: (answers amount, correct choice) of every question.
+    :param tags: tag of every question, category * DIFFICULTY_AMOUNT + difficulty.
+    :param payloads: text message of every question.
+    :param binary_payloads: binary message of every question.
+    :param keys: key number of every question, in any order.
+    :param categories: category names, by category id.
+    :return: the bank file.
+    """
+    size = len(answers)
+    by_tag = sorted(range(size), key=tags.__getitem__)
+    by_difficulty = sorted(range(size), key=lambda index: (tags[index] % DIFFICULTY_AMOUNT, tags[index]))
+    tag_starts = get_starts([tags[index] for index in by_tag], len(categories) * DIFFICULTY_AMOUNT)
+    difficulty_starts = get_starts([tags[index] % DIFFICULTY_AMOUNT for index in by_difficulty], DIFFICULTY_AMOUNT)
+    names = '\n'.join(categories).encode()
+    tags_start, offsets_start, keys_start, index_start, names_start = get_sections(size, len(categories))
+    data_start = names_start + len(names)
+    offsets, data = list(), bytearray()
+    for payload, binary_payload in zip(payloads, binary_payloads):
+        offsets.append(data_start + len(data))
+        data += payload
+        offsets.append(data_start + len(data))
+        data += binary_payload
+    offsets.append(data_start + len(data))
+    packed_tags = struct.pack(f'<{size}H', *tags)
+    digest = hashlib.blake2b(data, digest_size=8)
+    digest.update(packed_tags)
+    digest.update(names)
+    bank_file = bytearray(HEADER.pack(BANK_MAGIC, size, int.from_bytes(digest.digest(), 'little'), len(categories)))
+    for amount, correct in answers:
+        bank_file += bytes((amount, correct))
+    bank_file += packed_tags
+    bank_file += bytes(offsets_start - len(bank_file))
+    bank_file += struct.pack(f'<{len(offsets)}Q', *offsets)
+    bank_file += struct.pack(f'<{size}Q', *sorted(keys))
+    index = by_tag + by_difficulty + tag_starts + difficulty_starts
+    bank_file += struct.pack(f'<{len(index)}I', *index)
+    bank_file += names
+    bank_file += data
+    return bank_file
+
+
+def encode_bank(question_list, difficulties=None):
+    """
+    :param question_list: list of question dicts (question, answers, correct, and category and difficulty).
+    :param difficulties: question key -> difficulty id rated from the answers, or None.
+    :return: bank file of the questions, without duplicates.
+    """
+    bank = QuestionBank(pack_bank([], [], [], [], [], []))
+    bank.add(question_list, difficulties)
+    return pack_bank(bank.added_answers, bank.added_tags, bank.added_payloads, bank.added_binary_payloads,
+                     bank.added_keys, bank.categories)
+
+
+def build_bank(question_list, difficulties=None):
+    """
+    :param question_list: list of question dicts (question, answers, correct, and category and difficulty).
+    :param difficulties: question key -> difficulty id rated from the answers, or None.
+    :return: QuestionBank of the questions.
+    """
+    return QuestionBank(encode_bank(question_list, difficulties))
+
+
+def write_bank_file(path, question_list, difficulties=None):
+    """
+    writes a bank file. it is written next to the path and renamed over it, so a server that reloads meanwhile
+    gets the old file or the new one, and servers that mapped the old file keep using it.
+    :param path: path of the bank file.
+    :param question_list: list of question dicts (question, answers, correct, and category and difficulty).
+    :param difficulties: question key -> difficulty id rated from the answers, or None.
+    :return: amount of questions written.
+    """
+    bank_file = encode_bank(question_list, difficulties)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as output_file:
+        output_file.write(bank_file)
+    os.replace(temporary_path, path)
+    return HEADER.unpack_from(bank_file)[1]
+
+
+def open_bank_file(path):
+    """
+    maps a bank file, read only. the pages are read when questions are asked, and shared by every process
+    that maps the same file.
+    :param path: path of the bank file.
+    :return: QuestionBank of the file.
+    """
+    with open(path, 'rb') as bank_file:
+        return QuestionBank(mmap.mmap(bank_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def load_question_stats(path):
+    """
+    reads the difficulties rated from the answers, in a stats file written by answer_stats.py.
+    :param path: path of the stats file.
+    :return: question key -> difficulty id, of the questions that were answered enough to be rated.
+    """
+    with open(path, encoding='utf-8') as stats_file:
+        question_stats = json.load(stats_file)['questions']
+    return {key: DIFFICULTY_IDS[stats['difficulty']] for key, stats in question_stats.items()
+            if stats.get('difficulty') in DIFFICULTY_IDS}
+
+
+def load_bank(questions_file, cache_file, stats_file=None):
+    """
+    builds the question bank from a bank file or a JSON/CSV question file, then the question cache.
+    blocking, a reload runs it on the executor.
+    :param questions_file: path of a bank file (BANK_FILE_SUFFIX) or of a JSON/CSV question file, or None.
+    :param cache_file: path of the cache of questions fetched from the API, or None.
+    :param stats_file: path of a question stats file, the difficulties rated from the answers replace the ones
+    the questions came with. a bank file keeps the difficulties it was written with, convert it with the stats.
+    :return: QuestionBank, its difficulties are the ones of the stats file, for the questions added later.
+    """
+    difficulties = load_question_stats(stats_file) if stats_file else None
+    if questions_file and questions_file.endswith(BANK_FILE_SUFFIX):
+        bank = open_bank_file(questions_file)
+    else:
+        bank = build_bank(question_source.load_questions_file(questions_file) if questions_file else [], difficulties)
+    cached_questions = question_source.load_question_cache(cache_file) if cache_file else None
+    if cached_questions:
+        bank.add(cached_questions, difficulties)
+    bank.difficulties = difficulties
+    return bank
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts a JSON/CSV question file to a question bank file.')
+    parser.add_argument('questions_file', help='JSON or CSV question file')
+    parser.add_argument('bank_file', help=f'bank file to write, its name has to end with {BANK_FILE_SUFFIX}')
+    parser.add_argument('--stats', help='question stats file of answer_stats.py, its difficulties replace the ones '
+                                        'of the questions')
+    args = parser.parse_args()
+    if not args.bank_file.endswith(BANK_FILE_SUFFIX):
+        parser.error(f'the bank file name has to end with {BANK_FILE_SUFFIX}')
+    amount = write_bank_file(args.bank_file, question_source.load_questions_file(args.questions_file),
+                             load_question_stats(args.stats) if args.stats else None)
+    print(f'{amount} questions written to {args.bank_file}')
+
+
+if __name__ == '__main__':
+    main()
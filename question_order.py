@@ -0,0 +1,74 @@
+import math
+import random  # For a different question order for every user
+
+# A question order walks the question bank indexes in a random order without repeating any of them,
+# in O(1) memory: index = first + (step * position + offset) % size, with step coprime to size.
+# When all size questions were asked, a new order starts over the questions added to the bank since.
+# Orders are stored with the generation of the bank they walk, (generation, first, size, step, offset, position),
+# an order over another bank starts over.
+EMPTY_QUESTION_ORDER = (0, 0, 1, 0, 0)  # (first, size, step, offset, position), no question asked yet
+
+
+def new_question_order(first, size):
+    """
+    creates an order over the bank indexes first..first + size - 1.
+    :param first: first bank index of the order.
+    :param size: amount of questions in the order.
+    :return: question order tuple.
+    """
+    step = 1
+    if size > 2:
+        step = random.randrange(1, size)
+        while math.gcd(step, size) != 1:
+            step = random.randrange(1, size)
+    return first, size, step, random.randrange(size) if size else 0, 0
+
+
+def next_question_index(order, bank_size):
+    """
+    gets the next question the order did not give yet.
+    :param order: question order tuple of the user.
+    :param bank_size: amount of questions in the bank.
+    :return: (bank index or None if every question was asked, the updated order).
+    """
+    first, size, step, offset, position = order
+    if position >= size:
+        if first + size >= bank_size:
+            return None, order
+        first, size, step, offset, position = new_question_order(first + size, bank_size - first - size)
+    return first + (step * position + offset) % size, (first, size, step, offset, position + 1)
+
+
+def get_asked_amount(order):
+    """
+    :param order: question order tuple of the user.
+    :return: amount of questions the order gave so far.
+    """
+    first, size, step, offset, position = order
+    return first + position
+
+
+def get_bank_order(stored_order, generation, bank_size):
+    """
+    :param stored_order: the stored order, with the generation of its bank. orders stored before banks
+    had generations have none, they are kept while they fit the bank.
+    :param generation: generation of the bank the server asks from.
+    :param bank_size: amount of questions in the bank.
+    :return: the question order tuple, or EMPTY_QUESTION_ORDER if it walks another bank.
+    """
+    if len(stored_order) == 6:
+        if stored_order[0] != generation:
+            return EMPTY_QUESTION_ORDER
+        stored_order = stored_order[1:]
+    if stored_order[0] + stored_order[1] > bank_size:
+        return EMPTY_QUESTION_ORDER
+    return stored_order
+
+
+def get_stored_order(order, generation):
+    """
+    :param order: question order tuple.
+    :param generation: generation of the bank the order walks.
+    :return: the order to store.
+    """
+    return (generation,) + order
@@ -0,0 +1,173 @@
+import argparse  # For running the local question API
+import csv  # For question bank files in CSV format
+import json  # For question bank files, the cache and the API responses
+import os
+import random  # For shuffling the answers of a question, and the questions of the local API
+import threading  # For serving the local question API in the background
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # For the local stand-in of the question API
+from urllib.parse import urlparse, parse_qs
+import requests  # For pulling random questions from the internet
+
+QUESTIONS_API_URL = 'https://opentdb.com/api.php'
+FETCH_TIMEOUT = 10  # seconds to wait for the question API
+REFILL_INTERVAL = 5  # the question API allows one request every 5 seconds
+
+
+def convert_api_question(api_question):
+    """
+    converts a question in the API format to the format the server keeps, with the answers shuffled.
+    the shuffle is seeded by the question, so a question file loads the same way every time and the bank built from
+    it keeps its generation across restarts, reloads and workers.
+    :param api_question: dict with question, correct_answer and incorrect_answers, and category and difficulty.
+    :return: dict with question, answers, correct (1 based position of the correct answer), category and difficulty.
+    """
+    correct_answer = api_question['correct_answer']
+    answers = list(api_question['incorrect_answers']) + [correct_answer]
+    random.Random(api_question['question']).shuffle(answers)
+    return {'question': api_question['question'], 'answers': answers, 'correct': answers.index(correct_answer) + 1,
+            'category': api_question.get('category'), 'difficulty': api_question.get('difficulty')}
+
+
+def convert_to_api_question(question):
+    """
+    converts a question the server keeps back to the API format.
+    :param question: dict with question, answers and correct, and category and difficulty.
+    :return: dict with question, correct_answer, incorrect_answers, category and difficulty.
+    """
+    correct_index = question['correct'] - 1
+    return {'question': question['question'], 'correct_answer': question['answers'][correct_index],
+            'incorrect_answers': [answer for i, answer in enumerate(question['answers']) if i != correct_index],
+            'category': question.get('category'), 'difficulty': question.get('difficulty')}
+
+
+def load_questions_file(path):
+    """
+    loads a local question bank. JSON files hold an API response ({"results": [...]}) or a list of questions,
+    CSV files have question, correct_answer and incorrect_answer_* columns, and optional category and difficulty.
+    :param path: path of the question bank file.
+    :return: list of questions.
+    """
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as bank_file:
+            api_questions = [{'question': row['question'], 'correct_answer': row['correct_answer'],
+                              'incorrect_answers': [value for key, value in row.items()
+                                                    if key.startswith('incorrect_answer') and value],
+                              'category': row.get('category'), 'difficulty': row.get('difficulty')}
+                             for row in csv.DictReader(bank_file)]
+    else:
+        with open(path, encoding='utf-8') as bank_file:
+            loaded = json.load(bank_file)
+        api_questions = loaded['results'] if isinstance(loaded, dict) else loaded
+    return [question if 'answers' in question else convert_api_question(question) for question in api_questions]
+
+
+def load_question_cache(path):
+    """
+    loads the questions fetched from the API in earlier runs.
+    :param path: path of the cache file, one JSON question per line.
+    :return: list of questions, empty if there is no cache yet.
+    """
+    if not os.path.exists(path):
+        return []
+    question_list = list()
+    with open(path, encoding='utf-8') as cache_file:
+        for line in cache_file:
+            try:
+                question_list.append(json.loads(line))
+            except ValueError:
+                pass  # a line cut short by a crash while writing
+    return question_list
+
+
+def append_question_cache(path, question_list):
+    """
+    appends fetched questions to the cache file.
+    :param path: path of the cache file.
+    :param question_list: list of questions.
+    :return: None.
+    """
+    with open(path, 'a', encoding='utf-8') as cache_file:
+        cache_file.writelines(json.dumps(question) + '\n' for question in question_list)
+
+
+def fetch_questions(amount, url=QUESTIONS_API_URL, difficulty=None):
+    """
+    fetches questions from the question API. blocking, only to be called off the server loop.
+    :param amount: amount of questions to fetch.
+    :param url: url of the question API.
+    :param difficulty: difficulty of the questions, None for questions of every difficulty.
+    :return: list of questions.
+    """
+    params = {'amount': amount} if difficulty is None else {'amount': amount, 'difficulty': difficulty}
+    res = requests.get(url, params=params, timeout=FETCH_TIMEOUT)
+    loaded = json.loads(res.text)
+    return [convert_api_question(question) for question in loaded['results']]
+
+
+def fetch_question_batch(amount, cache_path, url):
+    """
+    executor job, fetches a batch of questions and saves it to the cache. blocks on the network.
+    :param amount: amount of questions to fetch.
+    :param cache_path: path of the cache file fetched questions are saved to, or None.
+    :param url: url of the question API.
+    :return: list of questions, empty if the API could not be reached.
+    """
+    try:
+        question_list = fetch_questions(amount, url)
+    except (requests.RequestException, ValueError, KeyError):
+        return []
+    if question_list and cache_path:
+        append_question_cache(cache_path, question_list)
+    return question_list
+
+
+def serve_question_api(question_list, host='127.0.0.1', port=0):
+    """
+    starts a local stand-in of the question API in a background thread, to be used instead of the internet one.
+    :param question_list: questions to answer with, in the server format.
+    :param host: ip to listen on.
+    :param port: port to listen on, 0 picks a free one.
+    :return: the http server, its url is f'http://{host}:{server.server_port}/api.php'.
+    """
+    api_questions = [convert_to_api_question(question) for question in question_list]
+
+    class QuestionAPIHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            amount = int(query.get('amount', ['10'])[0])
+            difficulty = query.get('difficulty', [None])[0]
+            matching = [question for question in api_questions
+                        if difficulty is None or question['difficulty'] in (difficulty, None)]
+            body = json.dumps({'response_code': 0,
+                               'results': random.sample(matching, min(amount, len(matching)))}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), QuestionAPIHandler)
+    threading.Thread(target=server.serve_forever, name='question-api', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in of the trivia question API.')
+    parser.add_argument('questions_file', help='JSON or CSV question bank to serve')
+    parser.add_argument('--port', type=int, default=8631)
+    args = parser.parse_args()
+    server = serve_question_api(load_questions_file(args.questions_file), port=args.port)
+    print(f'Serving questions on http://127.0.0.1:{server.server_port}/api.php')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import time  # For refilling the buckets
+from collections import OrderedDict  # For dropping the buckets that were not used for the longest time
+
+
+class TokenBuckets:
+    """
+    a token bucket per key, e.g. per client ip or per username. every attempt takes a token,
+    tokens come back at rate per second up to burst. refilling is computed when a bucket is used,
+    nothing runs in the background. only max_keys buckets are kept, the least recently used one is dropped,
+    a key whose bucket was dropped starts with a full bucket again.
+    """
+
+    __slots__ = ('rate', 'burst', 'max_keys', 'buckets')
+
+    def __init__(self, rate, burst, max_keys=100000):
+        """
+        :param rate: tokens per second.
+        :param burst: most tokens a bucket holds, attempts that may be made at once.
+        :param max_keys: most buckets kept.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # key -> [tokens, monotonic time of the last update]
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def take(self, key, now=None):
+        """
+        takes a token from the bucket of the key.
+        :param key: the key, e.g. client ip.
+        :param now: time.monotonic() value, now if None.
+        :return: True if there was a token, False if the attempt should be refused.
+        """
+        if now is None:
+            now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            self.buckets.move_to_end(key)
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
@@ -0,0 +1,37 @@
+import heapq  # For the top of the standings without sorting every player
+import question_order  # order of the questions the room is asked, without repeats
+
+
+class Room:
+    """
+    a match of several players: every round the same question is sent to all the members,
+    the answers are collected until the round deadline and the results are sent to all of them.
+    """
+
+    __slots__ = ('name', 'members', 'points', 'round_number', 'question_index', 'asked_at', 'answers',
+                 'question_order', 'question_bank', 'timer')
+
+    def __init__(self, name):
+        """
+        :param name: name of the room, players join it by name.
+        """
+        self.name = name
+        self.members = dict()  # client socket fileno -> Session
+        self.points = dict()  # username -> points won in the room
+        self.round_number = 0
+        self.question_index = None  # question of the running round, None between rounds
+        self.asked_at = 0.0
+        self.answers = dict()  # client socket fileno -> (choice, seconds it took) in the running round
+        self.question_order = question_order.EMPTY_QUESTION_ORDER
+        self.question_bank = None  # QuestionBank the question order walks and the running round is from
+        self.timer = None  # timer_wheel Timer of the round deadline
+
+    def __len__(self):
+        return len(self.members)
+
+    def get_standings(self, amount):
+        """
+        :param amount: amount of players to return.
+        :return: list of (username, points) of the players with the most points in the room, most points first.
+        """
+        return heapq.nsmallest(amount, self.points.items(), key=lambda item: (-item[1], item[0]))
@@ -1,33 +1,429 @@
+import errno  # For running out of file descriptors
+import os  # For forking worker processes
+import signal  # For stopping the worker processes
 import socket
+import ssl  # For the TLS handshakes and the TLS sockets of the clients
+import argparse  # For the server options
+import logging  # For the server log, leveled so it can be turned down or off
+import logging.handlers  # For writing the log from a background thread
+import queue  # For the records waiting for the background log writer
+import time  # For timing the handlers
+import metrics  # counters and latency histograms, for the STATS command and the scrape endpoint
 import chatlib  # protocol functions
-import random  # For random questions asked
+import shared_state  # game state shared by worker processes
+import question_source  # question bank files, cache and background refill
+import question_bank  # the questions the server asks, swapped as a whole by a reload
+import question_order  # order in which every user gets the questions, without repeats
+import leaderboard  # users sorted by score, updated on every score change
+import timer_wheel  # session timeouts
+import executor  # blocking work off the server loop
+import credentials  # password hashing and login tokens
+import rate_limit  # login attempt limits
+import user_store  # users, scores and answers on disk, written in the background
+import answer_log  # every answer, with its choice, correctness and time, for answer_stats.py
+import tls  # TLS contexts
+from session import Session  # everything kept for a client connection
+from room import Room  # multiplayer matches
+from collections import OrderedDict  # For the cache of recently active users
+import bisect  # For the difficulty level of a score
 import select  # For enabling multiple connections of clients to server
-import requests  # For pulling random questions from the internet
-import json  # For handling the JSON requests received.
 
-# to be added: 1. handle 2 answers wrong answers problem. 2. adding already used questions to list. 3. provide no_answers response.
-
-users_information_dict = dict()
-questions = dict()
-peer_name_tuple = tuple()
-logged_users_dict = dict()
+users_information_dict = OrderedDict()  # cache of recently active users, least recently used first
+questions = question_bank.build_bank([])  # QuestionBank the questions are asked from, a reload swaps it for a new one
+sessions = dict()  # client socket fileno -> Session
+rooms = dict()  # room name -> Room
+logged_users = dict()  # username -> amount of sessions logged in as the user
+logged_answer_payloads = dict()  # protocol version -> LOGGED_ANSWER message, cleared on every login and logout
 ERROR_MSG = 'Error! '
 SERVER_PORT = 5631
 SERVER_IP = '127.0.0.1'
-messages_to_send = list()
-MSG_MAX_LENGTH = 1024
-QUESTIONS_AMOUNT = 2
+send_queue_stats = {'queued_bytes': 0, 'sent_bytes': 0, 'dropped_messages': 0, 'slow_clients_disconnected': 0}
+slow_clients = set()  # clients that went over the high-water mark and are to be disconnected
+TLS_CONTEXT = None  # server ssl.SSLContext, None serves plain TCP
+tls_handshakes = dict()  # client socket -> True if its TLS handshake waits to write, False if it waits to read
+tls_stats = {'tls_handshakes': 0, 'tls_resumed_handshakes': 0, 'tls_handshake_failures': 0}
+SEND_QUEUE_HIGH_WATER = 256 * 1024  # max bytes queued for a single client
+SLOW_CLIENT_POLICY = 'disconnect'  # what to do with a client over the high-water mark: 'disconnect' or 'drop'
+MSG_MAX_LENGTH = chatlib.MAX_MSG_LENGTH
+QUESTIONS_AMOUNT = 50  # questions fetched from the question API in every refill
+QUESTIONS_FILE = None  # local question bank file (JSON/CSV, or a question_bank file) loaded at startup
+QUESTIONS_CACHE_FILE = 'questions_cache.jsonl'  # questions fetched from the API are kept here for the next runs
+QUESTIONS_API_URL = question_source.QUESTIONS_API_URL
+QUESTION_STATS_FILE = None  # difficulties rated from the answers by answer_stats.py, they replace the question ones
+ANSWER_LOG_DIR = 'answer_log'  # directory of the answer log segments, None to not log answers
+QUESTION_POOL_WATERMARK = 20  # refill in the background once a user has less unanswered questions than this
+ADAPTIVE_DIFFICULTY = True  # GET_QUESTION without a difficulty picks one by the user score, see DIFFICULTY_LEVELS
+# (least score, weights of the easy, medium and hard questions), users get harder questions as their score rises
+DIFFICULTY_LEVELS = ((0, (6, 3, 1)), (50, (3, 5, 2)), (150, (1, 4, 5)), (400, (1, 2, 7)))
+DIFFICULTY_LEVEL_SCORES = [score for score, weights in DIFFICULTY_LEVELS]
+# difficulties tried when the user was asked every question of the picked one, nearest first
+DIFFICULTY_FALLBACKS = [sorted(range(question_bank.DIFFICULTY_AMOUNT), key=lambda other: abs(other - difficulty))
+                        for difficulty in range(question_bank.DIFFICULTY_AMOUNT)]
+SELECT_TIMEOUT = 1  # seconds the server loop waits for a client while no timer is waiting
+ACCEPT_PAUSE = 0.1  # seconds the server stops accepting clients once it ran out of file descriptors
+accepting = True  # False while accepting is paused, see accept_client
+HIGHSCORE_DEFAULT_AMOUNT = 3  # users in the HIGHSCORE table when the client does not ask for an amount
+HIGHSCORE_MAX_AMOUNT = 100  # most users a client may ask for in the HIGHSCORE table
+score_board = leaderboard.Leaderboard()  # scores of all users, kept in order by add_user_score
+USER_DATABASE_FILE = 'trivia_users.db'
+USER_CACHE_SIZE = 10000  # most users kept in memory, the others are read from the user database when needed
+LOG_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR,
+              'off': logging.CRITICAL + 1}
+logger = logging.getLogger('trivia')
+log_listener = None  # background writer of the log when asynchronous logging is on
+METRICS_PORT = None  # port of the Prometheus scrape endpoint, off when None
+IDLE_TIMEOUT = 300  # seconds a client may send nothing before it is disconnected, 0 to never disconnect idle clients
+LOGIN_TIMEOUT = 30  # seconds a new client has to log in, 0 for no limit
+ANSWER_TIMEOUT = 30  # seconds a client has to answer the question it got, 0 for no limit
+CORRECT_ANSWER_POINTS = 5
+SPEED_BONUS_POINTS = 5  # most extra points for a correct answer, for answering right away
+SPEED_BONUS_TIME = 10  # seconds, the bonus goes down to nothing over this time
+ROOM_ANSWER_TIMEOUT = 15  # seconds the members of a room have to answer the round question
+ROOM_MAX_MEMBERS = 10000
+ROOM_STANDINGS_AMOUNT = 10  # players in the standings sent after every round
+TIMER_TICK = 0.1  # seconds, resolution of the session timeouts
+timers = timer_wheel.TimerWheel(TIMER_TICK)
+EXECUTOR_THREADS = 4  # threads for blocking work (user database reads, the question API), 0 runs it on the loop
+EXECUTOR_QUEUE_SIZE = 256  # jobs that may wait for a thread, clients get an ERROR for more
+jobs = None  # Executor of the process, started with the server loop
+LOGIN_RATE_PER_IP = 5  # login and register attempts per second from a client ip, 0 for no limit
+LOGIN_BURST_PER_IP = 30  # attempts a client ip may make at once
+LOGIN_RATE_PER_USER = 0.5  # login attempts per second for a username, 0 for no limit
+LOGIN_BURST_PER_USER = 10
+login_ip_buckets = rate_limit.TokenBuckets(LOGIN_RATE_PER_IP, LOGIN_BURST_PER_IP)
+login_user_buckets = rate_limit.TokenBuckets(LOGIN_RATE_PER_USER, LOGIN_BURST_PER_USER)
+LOGIN_TOKEN_TTL = 600  # seconds a login token lets a client log in again without the password, 0 for no tokens
+LOGIN_TOKEN_CACHE_SIZE = 100000  # login tokens kept, the least recently used one is dropped
+login_tokens = OrderedDict()  # login token -> (username, monotonic time it expires at)
+question_refill_enabled = False  # only single process servers refill the bank, question ids must match in workers
+question_refill_running = False  # a refill runs, or the question API interval after it did not pass yet
+question_refill_requested = False  # asked for while question_refill_running
+shared_state_enabled = False  # True in worker processes, game state is then kept in shared_state
+question_reload_requested = False  # set by the reload signal, the server loop reloads the question bank
+question_reload_waiters = list()  # Sessions of the admins whose RELOAD_QUESTIONS waits for the next reload
+ADMIN_USERS = frozenset()  # users that may reload the question bank with RELOAD_QUESTIONS
+worker_pids = list()  # worker processes, in the parent of the workers
+SCORE_SYNC_INTERVAL = 1  # seconds between two reads of the score changes of the other workers
+
+
+def get_user(user):
+    """
+    gets a user from the cache of active users, or from the user database if it is not cached.
+    :param user: username.
+    :return: dict with password, score and question_orders, or None if there is no such user.
+    """
+    user_information = get_cached_user(user)
+    if user_information is None:
+        user_information = add_loaded_user(user, user_store.load_user(user))
+    return user_information
+
+
+def get_cached_user(user):
+    """
+    :param user: username.
+    :return: the user dict if the user is in the cache of active users, None otherwise. never reads the disk.
+    """
+    user_information = users_information_dict.get(user)
+    if user_information is not None:
+        users_information_dict.move_to_end(user)
+    return user_information
+
+
+def add_loaded_user(user, user_information):
+    """
+    caches a user read from the user database, possibly by an executor job. if the user was cached
+    while the job ran, the cached dict is newer and is kept.
+    :param user: username.
+    :param user_information: user dict read from the database, or None if there is no such user.
+    :return: the cached user dict, or None.
+    """
+    if user_information is None:
+        return None
+    cached = get_cached_user(user)
+    if cached is not None:
+        return cached
+    cache_user(user, user_information)
+    return user_information
+
+
+def cache_user(user, user_information):
+    """
+    adds a user to the cache of active users, dropping the least recently used one when the cache is full.
+    changes are saved to the user database as they happen, so dropped users lose nothing.
+    :param user: username.
+    :param user_information: dict with password, score and question_orders.
+    :return: None.
+    """
+    users_information_dict[user] = user_information
+    if len(users_information_dict) > USER_CACHE_SIZE:
+        users_information_dict.popitem(last=False)
+
+
+def register_user(user, password):
+    """
+    executor job of handle_register_message, hashes the password and creates a new user with no score. the user
+    database decides whether the name is free, the server loop never waits for it.
+    :param user: username.
+    :param password: the user password.
+    :return: the password hash if the user was created, None if the username is taken.
+    """
+    password_hash = credentials.hash_password(password)
+    if shared_state_enabled:
+        created = shared_state.add_user(user, password_hash)
+    else:
+        created = user_store.register_user(user, password_hash)
+    return password_hash if created else None
+
+
+def set_user_password(user, password_hash):
+    """
+    replaces the stored password hash of a user, e.g. a plain text password of an older server after a login.
+    :param user: username.
+    :param password_hash: hash from credentials.hash_password.
+    :return: None.
+    """
+    user_information = get_user(user)
+    user_information['password'] = password_hash
+    if shared_state_enabled:
+        shared_state.set_password(user, password_hash)
+    else:
+        user_store.save_user(user, user_information)
 
 
-def add_answered_question_to_user(user, question_id):
+def add_answered_question_to_user(user, question_id, bank, choice, correct, seconds):
     """
-    gets username and question id and adds it to the users dictionary (to avoid repetitive answers).
+    gets username and question id and adds it to the user answer history in the user database,
+    and the answer to the answer log.
     :param user: username.
     :param question_id: question's id.
+    :param bank: QuestionBank the question is from.
+    :param choice: the answer number the user chose.
+    :param correct: True if the answer is correct.
+    :param seconds: time the user took to answer.
     :return: None.
     """
-    global users_information_dict
-    users_information_dict[user]['questions_asked'].append(question_id)
+    user_store.save_answer(user, question_id)
+    answer_log.log_answer(user, bank, question_id - 1, choice, correct, seconds)
+
+
+def get_question_order(user, selection=None):
+    """
+    :param user: username.
+    :param selection: (category id, difficulty id) the order walks, None for the whole bank.
+    :return: the user question order tuple (see question_order).
+    """
+    return get_user(user)['question_orders'].get(selection, question_order.EMPTY_QUESTION_ORDER)
+
+
+def set_question_order(user, order, selection=None):
+    """
+    :param user: username.
+    :param order: the user question order tuple.
+    :param selection: (category id, difficulty id) the order walks, None for the whole bank.
+    :return: None.
+    """
+    user_information = get_user(user)
+    user_information['question_orders'][selection] = order
+    user_store.save_user(user, user_information)
+
+
+def clear_question_orders(user):
+    """
+    drops every question order of the user, e.g. orders over an older bank.
+    :param user: username.
+    :return: None.
+    """
+    get_user(user)['question_orders'].clear()
+
+
+def get_user_score(user):
+    """
+    :param user: username.
+    :return: the user score.
+    """
+    if shared_state_enabled:
+        return score_board.scores.get(user, 0)
+    return get_user(user)['score']
+
+
+def add_user_score(user, points):
+    """
+    adds points to the user score.
+    :param user: username.
+    :param points: points to add.
+    :return: None.
+    """
+    if shared_state_enabled:
+        score_board.add_score(user, points)
+        shared_state.add_score(user, points)
+    else:
+        user_information = get_user(user)
+        user_information['score'] += points
+        score_board.set_score(user, user_information['score'])
+        user_store.save_user(user, user_information)
+
+
+def get_top_scores(amount):
+    """
+    :param amount: amount of users to return.
+    :return: list of (username, score) tuples, highest score first.
+    """
+    return score_board.top(amount)
+
+
+def get_user_rank(user):
+    """
+    :param user: username.
+    :return: (rank of the user, amount of ranked users). rank is 1 + the amount of users with a higher score.
+    """
+    return score_board.rank(user), len(score_board)
+
+
+def load_leaderboard():
+    """
+    builds the score board from the user database, has to be called whenever the database is loaded.
+    :return: None.
+    """
+    global score_board
+    score_board = leaderboard.Leaderboard(dict(user_store.iter_scores()))
+
+
+def get_session_name(peername):
+    """
+    :param peername: address of the client socket.
+    :return: name of the client session that is unique across all worker processes.
+    """
+    return f'{os.getpid()}:{peername[0]}:{peername[1]}'
+
+
+def open_session(conn, address):
+    """
+    starts keeping track of a new client connection.
+    :param conn: client socket.
+    :param address: address of the client.
+    :return: the new Session.
+    """
+    session = Session(conn, address, get_session_name(address))
+    stale_session = sessions.get(session.fileno)
+    if stale_session is not None:  # the asyncio server closed the socket, its task did not close the session yet
+        close_session(stale_session)
+    sessions[session.fileno] = session
+    if LOGIN_TIMEOUT:
+        session.login_timer = timers.schedule(LOGIN_TIMEOUT, expire_session, session, 'login')
+    if IDLE_TIMEOUT:
+        session.idle_timer = timers.schedule(IDLE_TIMEOUT, check_idle_session, session)
+    metrics.connection_opened()
+    return session
+
+
+def get_session(conn):
+    """
+    :param conn: client socket.
+    :return: the Session of the client socket, raises KeyError if the socket has none (e.g. it was closed).
+    """
+    return sessions[conn.fileno()]
+
+
+def close_session(session):
+    """
+    releases everything kept for a client connection that is going away, and logs its user out.
+    :param session: Session of the client.
+    :return: None.
+    """
+    if sessions.get(session.fileno) is not session:
+        return  # closed already, the socket number may be used by a newer client by now
+    del sessions[session.fileno]
+    timers.cancel(session.login_timer)
+    timers.cancel(session.idle_timer)
+    timers.cancel(session.question_timer)
+    leave_room(session)
+    remove_logged_user(session)
+    send_queue_stats['queued_bytes'] -= session.send_queue_bytes
+    session.send_queue.clear()
+    slow_clients.discard(session.conn)
+    tls_handshakes.pop(session.conn, None)
+    metrics.connection_closed()
+
+
+def check_idle_session(session):
+    """
+    idle timer callback. the timer is not moved on every message, it checks when the client was last active
+    and waits again for the rest of IDLE_TIMEOUT if the client was active since it was set.
+    :param session: Session of the client.
+    :return: None.
+    """
+    idle = time.monotonic() - session.last_active
+    if idle >= IDLE_TIMEOUT:
+        session.idle_timer = None
+        expire_session(session, 'idle')
+    else:
+        session.idle_timer = timers.schedule(IDLE_TIMEOUT - idle, check_idle_session, session)
+
+
+def expire_session(session, reason):
+    """
+    timer callback, tells the client it ran out of time and disconnects it.
+    :param session: Session of the client.
+    :param reason: 'idle' or 'login'.
+    :return: None.
+    """
+    if session.fileno not in sessions:
+        return
+    metrics.add_timeout(reason)
+    logger.info('[SERVER] %s timeout of client %s', reason, session.address)
+    try:
+        build_and_send_message(session.conn, 'ERROR', f'{ERROR_MSG}{reason} timeout.')
+        flush_send_queue(session.conn)
+    except OSError:
+        pass
+    disconnect_client(session.conn)
+
+
+def set_logged_user(session, user):
+    """
+    marks the user as logged in from the client session, instead of the user logged in from it before.
+    :param session: Session of the client.
+    :param user: username.
+    :return: None.
+    """
+    remove_logged_user(session)
+    timers.cancel(session.login_timer)
+    session.login_timer = None
+    session.username = user
+    logged_users[user] = logged_users.get(user, 0) + 1
+    logged_answer_payloads.clear()
+    if shared_state_enabled:
+        shared_state.add_logged_user(session.name, user)
+
+
+def remove_logged_user(session):
+    """
+    logs out the user of the client session, if somebody is logged in from it.
+    :param session: Session of the client.
+    :return: None.
+    """
+    user = session.username
+    if user is None:
+        return
+    session.username = None
+    if logged_users[user] == 1:
+        del logged_users[user]
+        if shared_state_enabled:
+            shared_state.release_question_orders(user)
+    else:
+        logged_users[user] -= 1
+    logged_answer_payloads.clear()
+    if shared_state_enabled:
+        shared_state.remove_logged_user(session.name)
+
+
+def get_logged_users():
+    """
+    :return: list of the logged users names.
+    """
+    if shared_state_enabled:
+        return list(set(shared_state.get_logged_users()).union(logged_users))
+    return list(logged_users)
 
 
 def build_and_send_message(conn, cmd, data):
@@ -37,95 +433,370 @@ def build_and_send_message(conn, cmd, data):
     :param data: the message to send.
     :return: None.
     """
+    version = get_session(conn).protocol_version
+    data_to_send = chatlib.build_frame(cmd, data, version)
+    if data_to_send is None:
+        data_to_send = chatlib.build_frame('ERROR', ERROR_MSG, version)
+    logger.debug('[SERVER] %s %s', cmd, data)
+    queue_data(conn, data_to_send)
+
+
+def queue_data(conn, data):
+    """
+    adds encoded data to the client send queue, it is written once the socket is writable.
+    a client that lets more than SEND_QUEUE_HIGH_WATER bytes pile up is handled by SLOW_CLIENT_POLICY.
+    :param conn: client socket.
+    :param data: bytes to send.
+    :return: True if the data was queued.
+    """
+    session = get_session(conn)
+    if session.send_waiter is not None:
+        session.send_waiter.set()  # the asyncio server writes it, or disconnects a slow client, right away
+    if session.send_queue_bytes + len(data) > SEND_QUEUE_HIGH_WATER:
+        send_queue_stats['dropped_messages'] += 1
+        if SLOW_CLIENT_POLICY == 'disconnect':
+            slow_clients.add(conn)
+        return False
+    session.send_queue.append(data)
+    session.send_queue_bytes += len(data)
+    send_queue_stats['queued_bytes'] += len(data)
+    return True
+
+
+def flush_send_queue(conn):
+    """
+    writes as much of the client send queue as the socket accepts without blocking.
+    a partially sent message stays at the head of the queue.
+    :param conn: client socket.
+    :return: True if the whole queue was sent.
+    """
+    session = get_session(conn)
+    queue = session.send_queue
+    while queue:
+        data = queue[0]
+        try:
+            sent = conn.send(data)
+        except (BlockingIOError, InterruptedError, ssl.SSLWantWriteError, ssl.SSLWantReadError):
+            return False
+        session.send_queue_bytes -= sent
+        send_queue_stats['queued_bytes'] -= sent
+        send_queue_stats['sent_bytes'] += sent
+        metrics.add_bytes_out(sent)
+        if sent < len(data):
+            queue[0] = memoryview(data)[sent:]
+            return False
+        queue.popleft()
+    return True
+
+
+def get_send_queue_stats():
+    """
+    :return: dict of the send queue counters, and the number of clients with data waiting.
+    """
+    stats = dict(send_queue_stats)
+    stats['clients_waiting'] = sum(1 for session in list(sessions.values()) if session.send_queue)
+    return stats
+
+
+def get_gauges():
+    """
+    :return: dict of the current values of the server, for the metrics: send queues, questions and the executor.
+    """
+    gauges = get_send_queue_stats()
+    gauges['questions'] = len(questions)
+    gauges.update(answer_log.get_stats())
+    if TLS_CONTEXT is not None:
+        gauges.update(tls_stats)
+    if jobs is not None:
+        gauges.update(jobs.get_stats())
+    return gauges
+
+
+def start_executor():
+    """
+    starts the thread pool for blocking work of this process, if it is not running yet.
+    with EXECUTOR_THREADS 0 blocking work runs on the server loop.
+    :return: None.
+    """
+    global jobs
+    if jobs is None and EXECUTOR_THREADS:
+        jobs = executor.Executor(EXECUTOR_THREADS, EXECUTOR_QUEUE_SIZE)
+
+
+def submit_session_job(session, name, function, args, callback, *callback_args):
+    """
+    runs a blocking function on the executor for a client. the messages the client sends meanwhile are held,
+    and handled in order once callback(conn, result, *callback_args) was called on the server loop.
+    :param session: Session of the client.
+    :param name: name of the job in the metrics.
+    :param function: blocking function to run.
+    :param args: tuple of arguments of the function.
+    :param callback: function called with the client socket, the result and callback_args.
+    :return: True if the job runs, False if the executor is saturated and the client got an ERROR.
+    """
+    if jobs is None:
+        callback(session.conn, function(*args), *callback_args)
+        return True
+    session.job_pending = True
+    if not jobs.submit(name, function, args,
+                       lambda result, error: finish_session_job(session, callback, callback_args, result, error)):
+        session.job_pending = False
+        build_and_send_message(session.conn, 'ERROR', f'{ERROR_MSG}server busy, try again.')
+        return False
+    return True
+
+
+def finish_session_job(session, callback, callback_args, result, error):
+    """
+    executor callback of submit_session_job, resumes the client: calls the callback with the result,
+    then handles the messages held while the job ran.
+    :return: None.
+    """
+    if sessions.get(session.fileno) is not session:
+        return  # the client left while the job ran
+    session.job_pending = False
+    conn = session.conn
     try:
-        data_to_send = chatlib.build_message(cmd, data).encode()
-        conn.send(data_to_send)
-        print('[SERVER]', data_to_send.decode())  # Debug print
-        messages_to_send.append((conn.getpeername(), data_to_send))
+        if error is not None:
+            logger.error('%s job failed: %r', ERROR_MSG, error)
+            build_and_send_message(conn, 'ERROR', ERROR_MSG)
+        else:
+            callback(conn, result, *callback_args)
+        held_messages = session.held_messages
+        while held_messages and not session.job_pending:
+            cmd, data = held_messages.popleft()
+            handle_client_message(conn, cmd, data)
+        flush_send_queue(conn)
     except:
-        messages_to_send.append((conn.getpeername(), ERROR_MSG))
+        disconnect_client(conn)
 
 
-def recv_message_and_parse(conn):
+def recv_messages(conn):
     """
-    :param conn: client socket from which we receive & parse the message.
-    :return: cmd - protocol command received from client, data - message information from client.
+    receives whatever the client has sent and returns every complete message in it,
+    a partial message is kept in the client buffer until the rest of it arrives.
+    :param conn: client socket which is ready to read.
+    :return: list of (cmd, data) tuples. [(None, None)] if the client closed the connection.
     """
     try:
-        received_msg = conn.recv(1024).decode()
-        cmd, data = chatlib.parse_message(received_msg)
-        print('[CLIENT]', cmd, data)  # debug print
-        return cmd, data
-    except:
-        return None, None
+        received = conn.recv(MSG_MAX_LENGTH)
+    except (ssl.SSLWantReadError, ssl.SSLWantWriteError):  # only part of a TLS record, or no data in it
+        return []
+    if not received:
+        return [(None, None)]
+    if TLS_CONTEXT is not None:
+        # the rest of a TLS record is decrypted already, select() would not tell us about it.
+        while conn.pending():
+            received += conn.recv(conn.pending())
+    metrics.add_bytes_in(len(received))
+    session = get_session(conn)
+    session.last_active = time.monotonic()
+    session.recv_buffer += received
+    messages = list(chatlib.iter_frames(session.recv_buffer))
+    if logger.isEnabledFor(logging.DEBUG):
+        for cmd, data in messages:
+            logger.debug('[CLIENT] %s %s', cmd, data)
+    return messages
 
 
 def load_questions():
     """
-    Loads questions bank from file questions API.
+    Loads questions bank from the local questions file and the questions cache. never goes to the network,
+    questions from the API are only fetched by the background refill.
     Recieves: None.
-    Returns: questions dictionary
+    Returns: the QuestionBank
+    """
+    global questions
+    questions = question_bank.load_bank(*get_question_bank_args())
+    return questions
+
+
+def get_question_bank_args():
+    """
+    :return: arguments of question_bank.load_bank, the same when the server starts and on every reload.
+    """
+    return QUESTIONS_FILE, QUESTIONS_CACHE_FILE, QUESTION_STATS_FILE
+
+
+def add_questions(question_list):
+    """
+    adds questions to the end of the bank, skipping questions it already has. the difficulties rated from the
+    answers in the stats the bank was loaded with replace the ones the questions came with.
+    :param question_list: list of question dicts (question, answers, correct).
+    :return: amount of questions added.
+    """
+    return questions.add(question_list, questions.difficulties)
+
+
+def request_question_reload(signum=None, frame=None):
+    """
+    SIGHUP handler. a signal handler may run in the middle of the server loop, so it only asks the loop
+    to reload the question bank on its next turn.
+    :return: None.
+    """
+    global question_reload_requested
+    question_reload_requested = True
+
+
+def reload_questions():
+    """
+    builds the question bank again from the question files on the executor, and swaps it in once it is built.
+    clients keep being asked from the old bank meanwhile. the admins that asked for it are answered once it is done.
+    :return: None.
+    """
+    global question_reload_requested
+    global question_reload_waiters
+    question_reload_requested = False
+    waiters, question_reload_waiters = question_reload_waiters, list()
+    args = get_question_bank_args()
+    if jobs is None:
+        try:
+            bank, error = question_bank.load_bank(*args), None
+        except (OSError, ValueError, KeyError) as exception:
+            bank, error = None, exception
+        finish_question_reload(waiters, bank, error)
+    elif not jobs.submit('question_reload', question_bank.load_bank, args,
+                         lambda bank, error: finish_question_reload(waiters, bank, error)):
+        finish_question_reload(waiters, None, RuntimeError('the executor is busy'))
+
+
+def finish_question_reload(waiters, bank, error):
+    """
+    executor callback of a reload, swaps the new bank in and answers the admins that asked for the reload.
+    :param waiters: Sessions of the admins, their other messages are held until they are answered.
+    :param bank: the new QuestionBank.
+    :param error: exception the reload raised, or None.
+    :return: None.
+    """
+    if not swap_question_bank(bank, error):
+        bank = None
+    for session in waiters:
+        finish_session_job(session, send_question_reload_result, (), bank, None)
+
+
+def swap_question_bank(bank, error=None):
+    """
+    executor callback of a reload, the new bank replaces the old one at once. clients that were asked a question
+    of the old bank answer it there, question orders over the old bank start over on the new one.
+    :param bank: the new QuestionBank.
+    :param error: exception the reload raised, or None.
+    :return: True if the bank was swapped.
+    """
+    global questions
+    if error is not None:
+        logger.error('%s question reload failed: %r', ERROR_MSG, error)
+        return False
+    questions = bank
+    logger.info('[SERVER] question bank reloaded, %d questions, generation %016x.', len(bank), bank.generation)
+    return True
+
+
+def forward_reload_signal(signum, frame):
+    """
+    SIGHUP handler of the parent of the workers, every worker reloads its question bank.
+    :return: None.
+    """
+    for pid in worker_pids:
+        try:
+            os.kill(pid, signal.SIGHUP)
+        except ProcessLookupError:
+            pass
+
+
+def start_answer_log():
+    """
+    starts the answer log writer of this process, worker processes write their own segments.
+    :return: None.
+    """
+    if ANSWER_LOG_DIR:
+        answer_log.open_answer_log(ANSWER_LOG_DIR)
+
+
+def start_question_refill():
+    """
+    lets the server refill the question bank from the question API, and asks for a first batch if the bank is small.
+    :return: None.
     """
-    res = requests.get(f'https://opentdb.com/api.php?amount={QUESTIONS_AMOUNT}&difficulty=easy')
-    json_res = res.text
-    loaded = json.loads(json_res)
-    question_dict = {}
-    question_num = 1
-    for question in loaded['results']:
-        correct_answer = question['correct_answer']
-        incorrect_answers = question['incorrect_answers']
-        incorrect_answers.append(correct_answer)
-        random.shuffle(incorrect_answers)
-        correct_answer_updated_position = incorrect_answers.index(correct_answer)
-        question_dict[question_num] = {'question': question['question'], 'answers': incorrect_answers,
-                                       'correct': correct_answer_updated_position + 1}
-        question_num += 1
-    return question_dict
+    global question_refill_enabled
+    question_refill_enabled = True
+    if len(questions) < QUESTION_POOL_WATERMARK:
+        request_question_refill()
 
 
-def fix_url_encoded_questions(string_question):
+def request_question_refill():
+    """
+    fetches a batch of questions with an executor job, never blocks.
+    the question API allows a request every REFILL_INTERVAL seconds, a refill asked for sooner waits for it.
+    :return: None.
+    """
+    global question_refill_running
+    global question_refill_requested
+    if not question_refill_enabled:
+        return
+    if question_refill_running:
+        question_refill_requested = True
+        return
+    question_refill_running = True
+    question_refill_requested = False
+    args = (QUESTIONS_AMOUNT, QUESTIONS_CACHE_FILE, QUESTIONS_API_URL)
+    if jobs is None:
+        add_fetched_questions(question_source.fetch_question_batch(*args), None)
+    elif not jobs.submit('question_refill', question_source.fetch_question_batch, args, add_fetched_questions):
+        question_refill_running = False
+
 
+def add_fetched_questions(question_list, error):
     """
-    takes the string input and replaces url encoded letters to normal format.
-    :param string_question: the question string that we want to fix
-    :return: fixed question string
+    executor callback of the question refill, adds the fetched questions to the bank.
+    :param question_list: list of fetched questions.
+    :param error: exception the refill raised, or None.
+    :return: None.
+    """
+    if error is not None:
+        logger.error('%s question refill failed: %r', ERROR_MSG, error)
+    elif question_list:
+        logger.info('[SERVER] %d new questions.', add_questions(question_list))
+    timers.schedule(question_source.REFILL_INTERVAL, end_question_refill_interval)
 
+
+def end_question_refill_interval():
+    """
+    timer callback, the question API can be asked again. starts the refill that was asked for meanwhile.
+    :return: None.
     """
-    to_switch_dict = {'&#039;': "'",
-                      '&quot;': '"',
-                      '&amp;': '&'}
-    for i in to_switch_dict.keys():
-        print(to_switch_dict[i])
-        string_question = string_question.replace(i, to_switch_dict[i])
-    return string_question
+    global question_refill_running
+    question_refill_running = False
+    if question_refill_requested:
+        request_question_refill()
 
 
 def load_user_database():
     """
-    Loads the user database.
-    :return: user dictionary.
+    Opens the user database file, users are read from it into the cache when they are first needed.
+    :return: empty user cache dictionary.
     """
-    quiz_users = {
-        'test'	:	{'password': 'test', 'score': 0, 'questions_asked': []},
-        'yossi'		:	{'password': '123', 'score': 0, 'questions_asked': []},
-        'master'	:	{'password': 'master', 'score': 0, 'questions_asked': []}
-    }
-    return quiz_users
+    user_store.close_user_store()
+    user_store.open_user_store(USER_DATABASE_FILE)
+    return OrderedDict()
 
 
-def setup_socket():
+def setup_socket(reuse_port=False):
     """
     creates new listening socket and returns it.
+    :param reuse_port: let several worker processes listen on the same port, the kernel balances clients between them.
     :return: the socket object.
     """
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         sock.bind((SERVER_IP, SERVER_PORT))
         sock.listen()
-        print('Server is listening...')
+        logger.info('Server is listening...')
         return sock
     except OSError:
-        print(f'{ERROR_MSG} adress already in use.')
+        logger.error('%s adress already in use.', ERROR_MSG)
 
 
 def send_error(conn, error_msg):
@@ -135,38 +806,41 @@ def send_error(conn, error_msg):
     :param error_msg: error message to be passed through client socket.
     :return:
     """
-    conn.send(error_msg.encode())
+    build_and_send_message(conn, 'ERROR', error_msg)
 
 
-def handle_getscore_message(conn, username):
+def handle_getscore_message(conn):
     """
-    receives the client socket and username of that socket and returns a YOUR_SCORE message.
+    receives the client socket and returns a YOUR_SCORE message with the score of the user logged in on it.
     :param conn: client socket object.
-    :param username: the username of the client socket.
     :return: None.
     """
-    global users_information_dict
-    user_score_to_send = users_information_dict[username]['score']
-    print(user_score_to_send)
+    user_score_to_send = get_user_score(get_session(conn).username)
     build_and_send_message(conn, 'YOUR_SCORE', f'{user_score_to_send}')
 
 
-def handle_highscore_message(conn):
+def handle_highscore_message(conn, amount=HIGHSCORE_DEFAULT_AMOUNT):
     """
     recieves client socket to which the highscore of current time is sent with the build_and_send_message function.
     :param conn: client socket object.
+    :param amount: amount of users to send.
     :return: None.
     """
-    global users_information_dict
-    user_list = list()
-    for name, data in users_information_dict.items():
-        tmp = {
-            'name': name,
-            'score': data['score']
-        }
-        user_list.append(tmp)
-    sorted_users = sorted(user_list, key=lambda k: k['score'], reverse=True)
-    build_and_send_message(conn, 'ALL_SCORE', f"{sorted_users[0]['name']} : {sorted_users[0]['score']}\n{sorted_users[1]['name']} : {sorted_users[1]['score']}\n{sorted_users[2]['name']} : {sorted_users[2]['score']}")
+    if not 0 < amount <= HIGHSCORE_MAX_AMOUNT:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}highscore amount must be 1-{HIGHSCORE_MAX_AMOUNT}.')
+        return
+    top_users = get_top_scores(amount)
+    build_and_send_message(conn, 'ALL_SCORE', '\n'.join(f'{name} : {score}' for name, score in top_users))
+
+
+def handle_rank_message(conn):
+    """
+    sends the user his place in the highscore table and the amount of users in it.
+    :param conn: client socket object.
+    :return: None.
+    """
+    rank, ranked_amount = get_user_rank(get_session(conn).username)
+    build_and_send_message(conn, 'YOUR_RANK', chatlib.join_data([rank, ranked_amount]))
 
 
 def handle_logged_message(conn):
@@ -175,14 +849,17 @@ def handle_logged_message(conn):
     :param conn: client socket object.
     :return:None.
     """
-    global logged_users_dict
-    try:
-        msg_to_send = str()
-        for i in logged_users_dict:
-            msg_to_send += f'{logged_users_dict[i]}\n'
-        build_and_send_message(conn, 'LOGGED_ANSWER', msg_to_send)
-    except:
-        send_error(conn, ERROR_MSG)
+    if shared_state_enabled:  # other workers log users in and out too, ask every time
+        build_and_send_message(conn, 'LOGGED_ANSWER', ''.join(f'{username}\n' for username in get_logged_users()))
+        return
+    version = get_session(conn).protocol_version
+    payload = logged_answer_payloads.get(version)
+    if payload is None:
+        payload = chatlib.build_frame('LOGGED_ANSWER', ''.join(f'{username}\n' for username in logged_users), version)
+        if payload is None:  # too long for the protocol
+            payload = chatlib.build_frame('ERROR', ERROR_MSG, version)
+        logged_answer_payloads[version] = payload
+    queue_data(conn, payload)
 
 
 def handle_logout_message(conn):
@@ -191,180 +868,1172 @@ def handle_logout_message(conn):
     :param conn:
     :return:None.
     """
-    global logged_users_dict
-    logged_users_dict.pop(conn.getpeername())
-    print(f' logged user list: {logged_users_dict}')
+    session = get_session(conn)
+    leave_room(session)
+    remove_logged_user(session)
+    logger.debug(' logged user list: %s', logged_users)
 
 
-def handle_login_message(conn, data):
+def handle_logout_command(conn):
     """
-    Gets socket and message data of login message. Checks user and pass exists and match.
-    If not - sends error and finished. If all ok, sends OK message and adds user and address to logged_users_dict.
+    LOGOUT sent by the client, its login token can not be used any more.
     :param conn: client socket object.
-    :param data: client socket message.
     :return: None.
     """
-    global users_information_dict  # This is needed to access the same users_information_dict dictionary from all functions
-    global logged_users_dict	 # To be used later
-    login_cred = chatlib.split_data(data, 1)
-    if login_cred[0] in users_information_dict:
-        if login_cred[1] == users_information_dict[login_cred[0]]['password']:
-            build_and_send_message(conn, 'LOGIN_OK', '')
-            logged_users_dict[conn.getpeername()] = login_cred[0]
-            print(f' logged user list: {logged_users_dict}')
-        else:
-            build_and_send_message(conn, 'ERROR', 'Wrong password.')
-    else:
-        build_and_send_message(conn, 'ERROR', 'User does not exist.')
+    session = get_session(conn)
+    if session.login_token is not None:
+        login_tokens.pop(session.login_token, None)
+        session.login_token = None
+    handle_logout_message(conn)
 
 
-def handle_client_message(conn, cmd, data):
+def handle_login_message(conn, username, password, version=None):
     """
-    Gets message code and data and calls the right function to handle command.
+    Gets socket and message data of login message. Checks user and pass exists and match.
+    If not - sends error and finished. If all ok, sends OK message and logs the user in on the client session.
+    A client that supports the binary protocol adds its version as a third field, username#password#2,
+    the OK message holds the version both sides use from then on and a login token, version#token.
+    Old clients get an empty OK message.
+    The password hash is checked by an executor job, it takes tens of milliseconds on purpose.
     :param conn: client socket object.
-    :param cmd: client socket command
-    :param data: client message.
-    :return: None
+    :param username: the user to log in.
+    :param password: password of the user.
+    :param version: protocol version the client supports, None for old clients.
+    :return: None.
     """
-    global logged_users_dict
-    if cmd == 'LOGIN':
-        handle_login_message(conn, data)
-    elif cmd == 'LOGOUT' or cmd is None:
-        handle_logout_message(conn)
-    elif cmd == 'MY_SCORE':
-        handle_getscore_message(conn, logged_users_dict[conn.getpeername()])
-    elif cmd == 'HIGHSCORE':
-        handle_highscore_message(conn)
-    elif cmd == 'LOGGED':
-        handle_logged_message(conn)
-    elif cmd == 'GET_QUESTION':
-        handle_question_message(conn)
-    elif cmd == 'SEND_ANSWER':
-        handle_answer_message(conn, logged_users_dict[conn.getpeername()], data)
-    else:
-        build_and_send_message(conn, 'ERROR', 'Error! command does not exist.')
+    session = get_session(conn)
+    if not allow_login_attempt(session, username):
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}too many login attempts, try again later.')
+        return
+    submit_session_job(session, 'login', verify_login, (username, password, get_cached_user(username)),
+                       finish_login, username, version)
 
 
-def create_random_question():
+def verify_login(username, password, user_information):
     """
-    :return: random question string to be forwarded to the client
+    executor job of handle_login_message, reads the user if it is not cached and checks the password.
+    runs on an executor thread, so it only reads the user database and never changes the server state.
+    :param username: the user to log in.
+    :param password: password the client sent.
+    :param user_information: the cached user dict, or None to read it from the user database.
+    :return: (user dict or None, True if the password matches, new hash if the stored password should be replaced).
     """
-    global questions
-    answers_string = str()
-    random_question_tuple = random.choice(list(questions.items()))
-    for i in random_question_tuple[1]['answers']:
-        answers_string = answers_string + "#" + i
-    final_string = str(random_question_tuple[0]) + "#" + random_question_tuple[1]['question'] + answers_string
-    final_string = fix_url_encoded_questions(final_string)
-    return final_string
+    if user_information is None:
+        user_information = user_store.load_user(username)
+        if user_information is None:
+            return None, False, None
+    stored = user_information['password']
+    if not credentials.verify_password(password, stored):
+        return user_information, False, None
+    return user_information, True, credentials.hash_password(password) if credentials.needs_rehash(stored) else None
 
 
-def handle_question_message(conn):
+def finish_login(conn, result, username, version):
     """
-    sends the user a random question. made with the create_random_question function.
-    :param conn: client socket.
+    executor callback of handle_login_message.
+    :param conn: client socket object.
+    :param result: the result of verify_login.
+    :param username: the user to log in.
+    :param version: protocol version the client supports, None for old clients.
     :return: None.
     """
-    global questions
-    global users_information_dict
-    global logged_users_dict
-    if len(users_information_dict[logged_users_dict[conn.getpeername()]]['questions_asked']) == QUESTIONS_AMOUNT:
-        build_and_send_message(conn, 'NO_QUESTIONS', '')
+    user_information, password_matches, new_password_hash = result
+    if add_loaded_user(username, user_information) is None:
+        build_and_send_message(conn, 'ERROR', 'User does not exist.')
+    elif not password_matches:
+        build_and_send_message(conn, 'ERROR', 'Wrong password.')
     else:
-        question_for_client = create_random_question()
-        build_and_send_message(conn, 'YOUR_QUESTION', question_for_client)
+        if new_password_hash is not None:
+            set_user_password(username, new_password_hash)
+        log_in(conn, username, version, issue_login_token(username) if version is not None else None)
 
 
-def handle_answer_message(conn, username, data):
+def handle_resume_message(conn, username, token, version=None):
     """
-    :param conn: client socket.
-    :param username: client username.
-    :param data: client answer.
+    logs a client in again with the login token of an earlier login, username#token[#version].
+    the token is checked in O(1) in login_tokens, no password hash is computed.
+    :param conn: client socket object.
+    :param username: the user to log in.
+    :param token: login token from the LOGIN_OK message of an earlier login.
+    :param version: protocol version the client supports.
+    :return: None.
+    """
+    if not check_login_token(username, token):
+        build_and_send_message(conn, 'ERROR', 'Login expired, log in with the password.')
+        return
+    log_in(conn, username, version, token)
 
-    the function checks if the client answer is correct. if so, add points to the username.
-    either way sends a message whether answer is correct or not.
-    :return:
-    none
+
+def log_in(conn, username, version, token):
     """
-    global users_information_dict
-    global questions
-    acceptable_answer = ['1', '2', '3', '4']
-    question_id, choice = chatlib.split_data(data, 1)
-    while choice not in acceptable_answer:
-        build_and_send_message(conn, 'UNACCEPTABLE_ANSWER', '')
-        new_cmd, new_data = recv_message_and_parse(conn)
-        question_id, choice = chatlib.split_data(new_data, 1)
-        if int(choice) == int(questions[int(question_id)]['correct']):
-            build_and_send_message(conn, 'CORRECT_ANSWER', '')
-            users_information_dict[username]['score'] += 5
-            add_answered_question_to_user(username, question_id)
-            return
+    sends LOGIN_OK and logs the user in on the client session.
+    :param conn: client socket object.
+    :param username: the user.
+    :param version: protocol version the client supports, None for old clients.
+    :param token: login token to send to the client, None for old clients.
+    :return: None.
+    """
+    protocol_version = chatlib.PROTOCOL_BINARY if version == chatlib.PROTOCOL_BINARY else chatlib.PROTOCOL_TEXT
+    login_ok_data = '' if version is None else chatlib.join_data([protocol_version, token or ''])
+    build_and_send_message(conn, 'LOGIN_OK', login_ok_data)
+    session = get_session(conn)
+    session.protocol_version = protocol_version
+    session.login_token = token
+    set_logged_user(session, username)
+    logger.debug(' logged user list: %s', logged_users)
+
+
+def allow_login_attempt(session, username=None):
+    """
+    takes a token from the login attempt buckets of the client ip and of the user.
+    :param session: Session of the client.
+    :param username: the user the client tries to log in as, None for a register attempt.
+    :return: True if the attempt may be made.
+    """
+    if login_ip_buckets is not None and not login_ip_buckets.take(session.address[0]):
+        return False
+    if username is not None and login_user_buckets is not None and not login_user_buckets.take(username):
+        return False
+    return True
+
+
+def issue_login_token(username):
+    """
+    creates a login token that lets the user log in again for LOGIN_TOKEN_TTL seconds without the password.
+    :param username: the user that logged in with the password.
+    :return: the token, or None if tokens are turned off.
+    """
+    if not LOGIN_TOKEN_TTL:
+        return None
+    token = credentials.new_token()
+    login_tokens[token] = (username, time.monotonic() + LOGIN_TOKEN_TTL)
+    if len(login_tokens) > LOGIN_TOKEN_CACHE_SIZE:
+        login_tokens.popitem(last=False)
+    return token
+
+
+def check_login_token(username, token):
+    """
+    :param username: the user the client tries to log in as.
+    :param token: login token the client sent.
+    :return: True if the token was issued to the user and did not expire.
+    """
+    entry = login_tokens.get(token)
+    if entry is None:
+        return False
+    if entry[1] < time.monotonic():
+        del login_tokens[token]
+        return False
+    login_tokens.move_to_end(token)
+    return entry[0] == username
+
+
+def handle_register_message(conn, username, password):
+    """
+    Gets socket and the fields of a register message, creates the user if the username is free.
+    The password is hashed and the user created by an executor job.
+    :param conn: client socket object.
+    :param username: the user to create.
+    :param password: password of the user.
+    :return: None.
+    """
+    session = get_session(conn)
+    if not username or not password:
+        build_and_send_message(conn, 'ERROR', 'Username and password can not be empty.')
+    elif not allow_login_attempt(session):
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}too many login attempts, try again later.')
+    elif get_cached_user(username) is not None:  # the job finds the users that are not cached
+        build_and_send_message(conn, 'ERROR', 'User already exists.')
+    else:
+        submit_session_job(session, 'register', register_user, (username, password), finish_register, username)
+
+
+def finish_register(conn, password_hash, username):
+    """
+    executor callback of handle_register_message.
+    :param conn: client socket object.
+    :param password_hash: the result of register_user.
+    :param username: the user to create.
+    :return: None.
+    """
+    if password_hash is None:
+        build_and_send_message(conn, 'ERROR', 'User already exists.')
+        return
+    if not shared_state_enabled:
+        cache_user(username, {'password': password_hash, 'score': 0, 'question_orders': dict()})
+    score_board.set_score(username, 0)
+    build_and_send_message(conn, 'REGISTER_OK', '')
+
+
+def handle_stats_message(conn, name=''):
+    """
+    sends the server metrics in the Prometheus text format.
+    the whole text may be too long for the text protocol, data can pick the metrics to send by name.
+    :param conn: client socket object.
+    :param name: optional metric name prefix, e.g. command_seconds.
+    :return: None.
+    """
+    build_and_send_message(conn, 'STATS_ANSWER', metrics.render_prometheus(get_gauges(), name))
+
+
+def handle_reload_questions_message(conn):
+    """
+    rebuilds the question bank from the question files and swaps it in, admins only. the client gets
+    QUESTIONS_RELOADED generation#questions once the new bank is asked from, its messages meanwhile are held.
+    in a worker the parent is asked to reload every worker, and the reload of this worker answers the client.
+    :param conn: client socket object.
+    :return: None.
+    """
+    session = get_session(conn)
+    if session.username not in ADMIN_USERS:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}only admins can reload the questions.')
+        return
+    session.job_pending = True
+    question_reload_waiters.append(session)
+    if shared_state_enabled:
+        os.kill(os.getppid(), signal.SIGHUP)
+    else:
+        reload_questions()
+
+
+def send_question_reload_result(conn, bank):
+    """
+    tells an admin that the question bank was reloaded.
+    :param conn: client socket object.
+    :param bank: the new QuestionBank, None if the reload failed.
+    :return: None.
+    """
+    if bank is None:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}the question reload failed.')
+    else:
+        build_and_send_message(conn, 'QUESTIONS_RELOADED', chatlib.join_data([bank.generation, len(bank)]))
+
+
+def handle_client_messages(conn, messages):
+    """
+    handles the messages a client sent, in order. while an executor job of the client runs,
+    its messages are held and handled once the job is done, so every client is answered in order.
+    :param conn: client socket object.
+    :param messages: iterable of (cmd, data).
+    :return: None.
+    """
+    session = get_session(conn)
+    for cmd, data in messages:
+        if session.job_pending:
+            session.held_messages.append((cmd, data))
         else:
-            build_and_send_message(conn, 'WRONG_ANSWER', '')
-            add_answered_question_to_user(username, question_id)
+            handle_client_message(conn, cmd, data)
+
+
+def handle_client_message(conn, cmd, data):
+    """
+    Gets message code and data and calls the right function to handle command.
+    The time every handler takes goes into the command latency histogram.
+    :param conn: client socket object.
+    :param cmd: client socket command
+    :param data: client message.
+    :return: None
+    """
+    started = time.perf_counter()
+    try:
+        dispatch_client_message(conn, cmd, data)
+    finally:
+        metrics.observe_command(cmd, time.perf_counter() - started)
+
+
+def dispatch_client_message(conn, cmd, data):
+    """
+    looks the command up in COMMAND_HANDLERS and calls its handle_*_message function with the message fields,
+    after checking the client is logged in if the command needs it and the data matches the command schema.
+    :param conn: client socket object.
+    :param cmd: client socket command
+    :param data: client message.
+    :return: None
+    """
+    if cmd is None:
+        handle_logout_message(conn)
+        return
+    handler = COMMAND_HANDLERS.get(cmd)
+    if handler is None:
+        build_and_send_message(conn, 'ERROR', 'Error! command does not exist.')
+        return
+    if chatlib.COMMANDS[cmd].login_required and get_session(conn).username is None:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}log in first.')
+        return
+    fields = chatlib.decode_fields(cmd, data)
+    if fields is None:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}bad {cmd} message.')
+        return
+    handler(conn, *fields)
+
+
+def get_difficulty_weights(score):
+    """
+    :param score: the user score.
+    :return: weights of the difficulties of the questions the user gets, see DIFFICULTY_LEVELS.
+    """
+    return DIFFICULTY_LEVELS[max(bisect.bisect_right(DIFFICULTY_LEVEL_SCORES, score) - 1, 0)][1]
+
+
+def next_question_index(username, category=None, difficulty=None):
+    """
+    picks the next question the user was not asked yet. without a difficulty, and with adaptive difficulty on,
+    the difficulty is picked by the user score in O(1) with an alias table, the nearest other difficulties are
+    tried once the user was asked every question of it.
+    :param username: the user to ask.
+    :param category: category id of the question, None for any.
+    :param difficulty: difficulty id of the question, None for any.
+    :return: index of the question in the bank, or None if the user was asked every question that matches.
+    """
+    if difficulty is not None or not ADAPTIVE_DIFFICULTY:
+        return next_selected_index(username, category, difficulty)
+    table = questions.get_difficulty_table(category, get_difficulty_weights(get_user_score(username)))
+    if table is None:
+        return None
+    for difficulty in DIFFICULTY_FALLBACKS[table.pick()]:
+        question_index = next_selected_index(username, category, difficulty)
+        if question_index is not None:
+            return question_index
+    return None
+
+
+def take_question_position(username, selection, selection_size):
+    """
+    advances the user question order of a selection by one question, workers use shared_state instead.
+    :param username: the user name.
+    :param selection: (category id, difficulty id) the order walks, None for the whole bank.
+    :param selection_size: amount of questions in the selection.
+    :return: (position in the selection, or None if the user was asked every question of it, the question order).
+    """
+    stored_order = get_question_order(username, selection)
+    order = question_order.get_bank_order(stored_order, questions.generation, selection_size)
+    if order is question_order.EMPTY_QUESTION_ORDER and stored_order is not order:
+        clear_question_orders(username)  # the bank changed, the orders of the other selections walk the old one
+    position, order = question_order.next_question_index(order, selection_size)
+    if position is not None:
+        set_question_order(username, question_order.get_stored_order(order, questions.generation), selection)
+    return position, order
+
+
+def next_selected_index(username, category, difficulty):
+    """
+    picks the next question of a selection the user was not asked yet, in O(1) with the user question order of the
+    selection. any category and difficulty uses the order over the whole bank.
+    :param username: the user to ask.
+    :param category: category id, None for any.
+    :param difficulty: difficulty id, None for any.
+    :return: index of the question in the bank, or None if the user was asked every question of the selection.
+    """
+    selection_size = questions.count(category, difficulty)
+    # keyed by the selection asked for even when it holds the whole bank, a refill may add questions outside of it
+    selection = None if category is None and difficulty is None else (category, difficulty)
+    if shared_state_enabled:
+        position, order = shared_state.take_question_position(username, selection, questions.generation,
+                                                              selection_size)
+    else:
+        position, order = take_question_position(username, selection, selection_size)
+    if position is None:
+        return None
+    if category is None and selection_size - question_order.get_asked_amount(order) < QUESTION_POOL_WATERMARK:
+        request_question_refill()  # refills bring questions of every difficulty, but of random categories
+    return questions.pick(position, category, difficulty)
+
+
+def get_question_payload(question_index, version=chatlib.PROTOCOL_TEXT):
+    """
+    :param question_index: index of the question in the bank.
+    :param version: protocol version of the user connection.
+    :return: YOUR_QUESTION message of the question, encoded and ready to be forwarded to the client.
+    """
+    return questions.get_payload(question_index, version)
+
+
+def create_random_question(username, version=chatlib.PROTOCOL_TEXT):
+    """
+    :param username: the user to ask.
+    :param version: protocol version of the user connection.
+    :return: YOUR_QUESTION message of the next question of the user, encoded and ready to be forwarded to the client,
+    or None if the user was asked every question in the bank.
+    """
+    question_index = next_question_index(username)
+    if question_index is None:
+        return None
+    return get_question_payload(question_index, version)
+
+
+def handle_question_message(conn, category='', difficulty=''):
+    """
+    sends the user a random question he was not asked yet, and waits ANSWER_TIMEOUT seconds for its answer.
+    a question the user did not answer yet is replaced by the new one.
+    :param conn: client socket.
+    :param category: category of the question, any if empty. GET_CATEGORIES lists them.
+    :param difficulty: difficulty of the question (easy, medium or hard), picked by the user score if empty.
+    :return: None.
+    """
+    session = get_session(conn)
+    category_id = difficulty_id = None
+    if category:
+        category_id = questions.category_ids.get(category)
+        if category_id is None:
+            build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}no such category.')
             return
-    if int(choice) == int(questions[int(question_id)]['correct']):
-        build_and_send_message(conn, 'CORRECT_ANSWER', '')
-        users_information_dict[username]['score'] += 5
-        add_answered_question_to_user(username, question_id)
+    if difficulty:
+        difficulty_id = question_bank.DIFFICULTY_IDS.get(difficulty)
+        if difficulty_id is None:
+            build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}difficulty is one of '
+                                                  f'{", ".join(question_bank.DIFFICULTIES)}.')
+            return
+    question_index = next_question_index(session.username, category_id, difficulty_id)
+    if question_index is None:
+        request_question_refill()
+        build_and_send_message(conn, 'NO_QUESTIONS', '')
+        return
+    timers.cancel(session.question_timer)
+    session.question_id = question_index + 1
+    session.question_bank = questions
+    session.question_asked_at = time.monotonic()
+    session.question_timer = timers.schedule(ANSWER_TIMEOUT, expire_question, session) if ANSWER_TIMEOUT else None
+    queue_data(conn, get_question_payload(question_index, session.protocol_version))
+
+
+def handle_categories_message(conn):
+    """
+    sends the categories of the questions in the bank.
+    :param conn: client socket.
+    :return: None.
+    """
+    build_and_send_message(conn, 'CATEGORIES', chatlib.join_data(questions.categories))
+
+
+def expire_question(session):
+    """
+    answer deadline timer callback, the question can no longer be answered.
+    :param session: Session of the client.
+    :return: None.
+    """
+    session.question_id = None
+    session.question_timer = None
+    metrics.add_timeout('answer')
+
+
+def get_speed_bonus(seconds):
+    """
+    :param seconds: time the user took to answer.
+    :return: extra points for a correct answer, SPEED_BONUS_POINTS right away down to 0 after SPEED_BONUS_TIME.
+    """
+    if seconds >= SPEED_BONUS_TIME:
+        return 0
+    return round(SPEED_BONUS_POINTS * (1 - seconds / SPEED_BONUS_TIME))
+
+
+def handle_answer_message(conn, question_id, choice):
+    """
+    checks the answer against the question the client was asked, in O(1).
+    an answer that is not one of the question choices gets UNACCEPTABLE_ANSWER and the question stays open,
+    the client sends another SEND_ANSWER. the server never waits for it.
+    a correct answer is worth CORRECT_ANSWER_POINTS plus a bonus for answering fast, the points are sent back.
+    :param conn: client socket.
+    :param question_id: the question the client answers.
+    :param choice: the answer the client chose.
+    :return: None.
+    """
+    session = get_session(conn)
+    if session.question_id is None:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}no question to answer.')
+        return
+    seconds = time.monotonic() - session.question_asked_at
+    if ANSWER_TIMEOUT and seconds > ANSWER_TIMEOUT:  # the timer may fire a little late
+        timers.cancel(session.question_timer)
+        expire_question(session)
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}answer timeout.')
+        return
+    if question_id != session.question_id:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}not the question you were asked.')
+        return
+    acceptable_choices, correct_choice = session.question_bank.get_answers(question_id - 1)
+    if choice not in acceptable_choices:
+        build_and_send_message(conn, 'UNACCEPTABLE_ANSWER', '')
+        return
+    timers.cancel(session.question_timer)
+    session.question_id = session.question_timer = None
+    if choice == correct_choice:
+        points = CORRECT_ANSWER_POINTS + get_speed_bonus(seconds)
+        build_and_send_message(conn, 'CORRECT_ANSWER', str(points))
+        add_user_score(session.username, points)
     else:
         build_and_send_message(conn, 'WRONG_ANSWER', '')
-        add_answered_question_to_user(username, question_id)
+    add_answered_question_to_user(session.username, question_id, session.question_bank, choice,
+                                  choice == correct_choice, seconds)
+
+
+def broadcast(members, cmd, data):
+    """
+    sends the same message to many clients. the message is encoded once per protocol version,
+    and the same bytes are put in the send queue of every member.
+    :param members: iterable of the Session of every client to send to.
+    :param cmd: the command to send according to the trivia protocol.
+    :param data: the message to send.
+    :return: None.
+    """
+    payloads = dict()  # protocol version -> encoded message
+    for session in list(members):
+        payload = payloads.get(session.protocol_version)
+        if payload is None:
+            payload = payloads[session.protocol_version] = chatlib.build_frame(cmd, data, session.protocol_version)
+            if payload is None:
+                logger.error('%s %s message too long to broadcast.', ERROR_MSG, cmd)
+                return
+        if queue_data(session.conn, payload):
+            try:
+                flush_send_queue(session.conn)
+            except OSError:
+                pass  # the server loop finds out and disconnects it
 
 
-def print_client_sockets(socket_dict):
+def handle_join_room_message(conn, room_name):
+    """
+    adds the client to the room, the room is created if it does not exist. leaves the room the client was in.
+    :param conn: client socket.
+    :param room_name: name of the room.
+    :return: None.
+    """
+    session = get_session(conn)
+    if not room_name:
+        build_and_send_message(conn, 'ERROR', 'Room name can not be empty.')
+        return
+    room = rooms.get(room_name)
+    if room is None or room is not session.room:
+        if room is not None and len(room) >= ROOM_MAX_MEMBERS:
+            build_and_send_message(conn, 'ERROR', 'Room is full.')
+            return
+        leave_room(session)
+        if room is None:
+            room = rooms[room_name] = Room(room_name)
+        room.members[session.fileno] = session
+        room.points.setdefault(session.username, 0)
+        session.room = room
+    build_and_send_message(conn, 'ROOM_JOINED', chatlib.join_data([room.name, len(room)]))
+
+
+def leave_room(session):
+    """
+    removes the client from its room, if it is in one. the last member to leave closes the room.
+    :param session: Session of the client.
+    :return: None.
+    """
+    room = session.room
+    if room is None:
+        return
+    session.room = None
+    del room.members[session.fileno]
+    room.answers.pop(session.fileno, None)
+    if not room.members:
+        timers.cancel(room.timer)
+        del rooms[room.name]
+    elif room.question_index is not None and len(room.answers) == len(room.members):
+        timers.cancel(room.timer)
+        finish_round(room)
+
+
+def handle_leave_room_message(conn):
+    """
+    :param conn: client socket.
+    :return: None.
+    """
+    session = get_session(conn)
+    if session.room is None:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}not in a room.')
+        return
+    leave_room(session)
+    build_and_send_message(conn, 'ROOM_LEFT', '')
+
+
+def handle_start_round_message(conn):
+    """
+    starts a round in the room of the client: the same question is sent to every member,
+    they have ROOM_ANSWER_TIMEOUT seconds to answer it.
+    :param conn: client socket.
+    :return: None.
+    """
+    session = get_session(conn)
+    room = session.room
+    if room is None:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}join a room first.')
+        return
+    if room.question_index is not None:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}a round is running.')
+        return
+    if room.question_bank is not questions:  # the bank was reloaded, start over on the new one
+        room.question_bank = questions
+        room.question_order = question_order.EMPTY_QUESTION_ORDER
+    question_index, order = question_order.next_question_index(room.question_order, len(questions))
+    if question_index is None:  # the room was asked every question, start over
+        question_index, order = question_order.next_question_index(question_order.EMPTY_QUESTION_ORDER,
+                                                                    len(questions))
+        if question_index is None:
+            build_and_send_message(conn, 'NO_QUESTIONS', '')
+            return
+    room.question_order = order
+    room.question_index = question_index
+    room.round_number += 1
+    room.asked_at = time.monotonic()
+    room.timer = timers.schedule(ROOM_ANSWER_TIMEOUT, finish_round, room)
+    build_and_send_message(conn, 'ROUND_STARTED', str(room.round_number))
+    question, answers = questions.get_question(question_index)
+    broadcast(room.members.values(), 'ROOM_QUESTION', chatlib.join_data(
+        [room.round_number, f'{ROOM_ANSWER_TIMEOUT:g}', question_index + 1, question] + answers))
+
+
+def handle_room_answer_message(conn, round_number, choice):
+    """
+    takes the answer of a room member to the running round, the round ends once every member answered.
+    :param conn: client socket.
+    :param round_number: the round the client answers.
+    :param choice: the answer the client chose.
+    :return: None.
+    """
+    session = get_session(conn)
+    room = session.room
+    if room is None or room.question_index is None or round_number != room.round_number:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}no round to answer.')
+        return
+    if session.fileno in room.answers:
+        build_and_send_message(conn, 'ERROR', f'{ERROR_MSG}already answered.')
+        return
+    if choice not in room.question_bank.get_answers(room.question_index)[0]:
+        build_and_send_message(conn, 'UNACCEPTABLE_ANSWER', '')
+        return
+    room.answers[session.fileno] = (session.username, choice, time.monotonic() - room.asked_at)
+    build_and_send_message(conn, 'ROOM_ANSWER_OK', '')
+    if len(room.answers) == len(room.members):
+        timers.cancel(room.timer)
+        finish_round(room)
+
+
+def finish_round(room):
+    """
+    ends the running round of the room, when every member answered or by the round deadline timer.
+    correct answers get their points, and the results and the room standings are sent to every member:
+    round_number#correct choice#answers#correct answers#username:points#...
+    :param room: the Room.
+    :return: None.
+    """
+    room.timer = None
+    correct_choice = room.question_bank.get_answers(room.question_index)[1]
+    question_id = room.question_index + 1
+    correct_amount = 0
+    for username, choice, seconds in room.answers.values():
+        if choice == correct_choice:
+            points = CORRECT_ANSWER_POINTS + get_speed_bonus(seconds)
+            room.points[username] = room.points.get(username, 0) + points
+            add_user_score(username, points)
+            correct_amount += 1
+        add_answered_question_to_user(username, question_id, room.question_bank, choice, choice == correct_choice,
+                                      seconds)
+    standings = [f'{username}:{points}' for username, points in room.get_standings(ROOM_STANDINGS_AMOUNT)]
+    answers_amount = len(room.answers)
+    room.question_index = None
+    room.answers = dict()
+    broadcast(room.members.values(), 'ROUND_RESULT',
+              chatlib.join_data([room.round_number, correct_choice, answers_amount, correct_amount] + standings))
+
+
+# client command -> handle_*_message function, called with the client socket and the fields of the message.
+COMMAND_HANDLERS = {
+    'LOGIN': handle_login_message,
+    'RESUME': handle_resume_message,
+    'REGISTER': handle_register_message,
+    'LOGOUT': handle_logout_command,
+    'MY_SCORE': handle_getscore_message,
+    'HIGHSCORE': handle_highscore_message,
+    'MY_RANK': handle_rank_message,
+    'LOGGED': handle_logged_message,
+    'GET_QUESTION': handle_question_message,
+    'GET_CATEGORIES': handle_categories_message,
+    'SEND_ANSWER': handle_answer_message,
+    'STATS': handle_stats_message,
+    'RELOAD_QUESTIONS': handle_reload_questions_message,
+    'JOIN_ROOM': handle_join_room_message,
+    'LEAVE_ROOM': handle_leave_room_message,
+    'START_ROUND': handle_start_round_message,
+    'ROOM_ANSWER': handle_room_answer_message,
+}
+
+
+def print_client_sockets(client_sessions):
     """
     prints out the client connected to the server based on IP and port.
-    :param socket_dict: the dictionary of client connected to the server.
+    :param client_sessions: the dictionary of client sessions connected to the server.
     """
-    global logged_users_dict
-    print('CONNECTED CLIENT SOCKETS:')
-    for ip, port in socket_dict.keys():
-        print(f'IP: {ip}, PORT: {port}')
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug('CONNECTED CLIENT SOCKETS:')
+    for session in client_sessions.values():
+        logger.debug('IP: %s, PORT: %s', session.address[0], session.address[1])
 
 
-def main():
+def accept_client(server_socket):
+    """
+    accepts a new client, and starts its TLS handshake if the server uses TLS.
+    :param server_socket: the listening socket, which is ready to read.
+    :return: None.
+    """
+    global accepting
+    try:
+        (client_socket, client_address) = server_socket.accept()
+    except OSError as error:  # e.g. out of file descriptors, or the client gave up before we got to it
+        logger.warning('%s could not accept a client: %r', ERROR_MSG, error)
+        if error.errno in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM):
+            accepting = False  # the pending client stays in the backlog, don't spin on it
+            timers.schedule(ACCEPT_PAUSE, resume_accepting)
+        return
+    client_socket.setblocking(False)
+    # like asyncio does: a response or a TLS handshake flight written after another one must not wait
+    # for the delayed ACK of the client.
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if TLS_CONTEXT is not None:
+        client_socket = TLS_CONTEXT.wrap_socket(client_socket, server_side=True, do_handshake_on_connect=False)
+        tls_handshakes[client_socket] = False  # the client speaks first
+    logger.debug('[SERVER] New client has joined the server: %s', client_address)
+    open_session(client_socket, client_address)
+    print_client_sockets(sessions)
 
-    global users_information_dict
-    global questions
-    global peer_name_tuple
-    global messages_to_send
-    users_information_dict = load_user_database()
-    questions = load_questions()
-    client_sockets = list()
-    print('Welcome to Trivia Server!')
-    server_socket = setup_socket()
-    print('[SERVER] Listening for new clients...')
+
+def resume_accepting():
+    """
+    timer callback, accepts clients again after ACCEPT_PAUSE.
+    :return: None.
+    """
+    global accepting
+    accepting = True
+
+
+def continue_tls_handshake(conn):
+    """
+    runs the TLS handshake of a client as far as it goes without blocking, the server loop calls it again
+    when the socket is ready for the next step. the login timeout covers clients that never finish it.
+    :param conn: client socket.
+    :return: None.
+    """
+    try:
+        conn.do_handshake()
+    except ssl.SSLWantReadError:
+        tls_handshakes[conn] = False
+        return
+    except ssl.SSLWantWriteError:
+        tls_handshakes[conn] = True
+        return
+    except OSError as error:  # ssl.SSLError too, e.g. a client that does not trust the certificate
+        tls_stats['tls_handshake_failures'] += 1
+        logger.debug('[SERVER] TLS handshake failed: %r', error)
+        disconnect_client(conn)
+        return
+    del tls_handshakes[conn]
+    tls_stats['tls_handshakes'] += 1
+    if conn.session_reused:
+        tls_stats['tls_resumed_handshakes'] += 1
+    serve_client(conn)  # the first request may have come with the end of the handshake
+
+
+def serve_client(conn):
+    """
+    handles whatever a client sent, and disconnects it if it closed the connection or sent something we can't parse.
+    :param conn: client socket which is ready to read.
+    :return: None.
+    """
+    try:
+        logger.debug('New data from client')
+        messages = recv_messages(conn)
+        handle_client_messages(conn, messages)
+        if messages and messages[-1][0] is None:  # closed, or sent something we can't parse
+            disconnect_client(conn)
+        else:
+            # most responses fit in the socket buffer right away, the rest waits for select.
+            flush_send_queue(conn)
+    except:
+        disconnect_client(conn)
+
+
+def disconnect_client(conn):
+    """
+    removes a client from the server loop and releases everything kept for it, in O(1).
+    :param conn: client socket.
+    :return: None.
+    """
+    session = sessions.get(conn.fileno())
+    if session is not None:
+        close_session(session)
+    conn.close()
+    logger.debug('[SERVER] Client socket closed.')
+
+
+def serve_select(server_socket):
+    """
+    runs the select() based server loop on an already listening socket until the socket fails.
+    client sockets are non-blocking, responses are queued and written when the socket can take them.
+    :param server_socket: the listening socket object.
+    :return: None.
+    """
+    start_executor()
+    wake_sockets = [jobs] if jobs is not None else []  # readable when executor jobs are done
+    logger.info('[SERVER] Listening for new clients...')
     while True:
         try:
-            ready_to_read, ready_to_write, in_error = select.select([server_socket] + client_sockets, client_sockets, [])
+            timers.advance()
+            if question_reload_requested:
+                reload_questions()
+            for slow_client in list(slow_clients):
+                send_queue_stats['slow_clients_disconnected'] += 1
+                disconnect_client(slow_client)
+            client_sockets = [session.conn for session in sessions.values()]
+            waiting_to_write = [session.conn for session in sessions.values() if session.send_queue]
+            waiting_to_write += [conn for conn, wants_write in tls_handshakes.items() if wants_write]
+            # wake up every tick while timers wait, so timeouts and room rounds end on time.
+            listening = [server_socket] if accepting else []
+            ready_to_read, ready_to_write, in_error = select.select(listening + wake_sockets + client_sockets,
+                                                                      waiting_to_write, [],
+                                                                      TIMER_TICK if len(timers) else SELECT_TIMEOUT)
+            for current_socket in ready_to_write:
+                if current_socket in tls_handshakes:
+                    continue_tls_handshake(current_socket)
+                    continue
+                try:
+                    flush_send_queue(current_socket)
+                except OSError:
+                    disconnect_client(current_socket)
             for current_socket in ready_to_read:
                 if current_socket is server_socket:
-                    (client_socket, client_address) = server_socket.accept()
-                    print(f'[SERVER] New client has joined the server: {client_address}')
-                    client_sockets.append(client_socket)
-                    print_client_sockets(logged_users_dict)
+                    accept_client(server_socket)
+                elif current_socket is jobs:
+                    jobs.run_completions()
+                elif current_socket.fileno() == -1:  # closed while writing above
+                    continue
+                elif current_socket in tls_handshakes:
+                    continue_tls_handshake(current_socket)
                 else:
-                    try:
-                        print('New data from client')
-                        cmd, data = recv_message_and_parse(current_socket)
-                        peer_name_tuple = current_socket.getpeername()
-                        handle_client_message(current_socket, cmd, data)
-                        for message in messages_to_send:
-                            current_socket, data = message
-                            if current_socket in ready_to_write:
-                                current_socket.send(data.encode())
-                                messages_to_send.remove(message)
-                            else:
-                                pass
-                    except:
-                        client_sockets.remove(current_socket)
-                        print('[SERVER] Client socket closed.')
-                        break
+                    serve_client(current_socket)
         except TypeError:
-            print(f'{ERROR_MSG} socket already open.')
+            logger.error('%s socket already open.', ERROR_MSG)
             break
 
 
+def setup_logging(level='info', asynchronous=False):
+    """
+    sends the server log to stderr. with level 'off' nothing is logged and the log calls cost almost nothing.
+    asynchronous logging only puts the records on a queue, a background thread formats and writes them.
+    :param level: one of LOG_LEVELS.
+    :param asynchronous: write the log from a background thread.
+    :return: None.
+    """
+    global log_listener
+    stop_logging()
+    logger.handlers.clear()
+    logger.setLevel(LOG_LEVELS[level])
+    logger.propagate = False
+    if level == 'off':
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    if asynchronous:
+        log_queue = queue.SimpleQueue()
+        log_listener = logging.handlers.QueueListener(log_queue, handler)
+        log_listener.start()
+        handler = logging.handlers.QueueHandler(log_queue)
+    logger.addHandler(handler)
+
+
+def stop_logging():
+    """
+    writes the records still queued for the background log writer and stops it.
+    :return: None.
+    """
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+
+def add_data_arguments(parser):
+    """
+    adds the question bank, user database and answer log options to a server argument parser.
+    :param parser: argparse parser.
+    :return: None.
+    """
+    parser.add_argument('--questions-file', default=QUESTIONS_FILE,
+                        help='local question bank (JSON/CSV, or a .tqb bank file)')
+    parser.add_argument('--questions-cache', default=QUESTIONS_CACHE_FILE, help='cache file of fetched questions')
+    parser.add_argument('--questions-url', default=QUESTIONS_API_URL, help='question API used to refill the bank')
+    parser.add_argument('--question-stats', default=QUESTION_STATS_FILE,
+                        help='stats file of answer_stats.py, difficulties rated from the answers')
+    parser.add_argument('--answer-log', default=ANSWER_LOG_DIR, help='directory of the answer log, "" to turn it off')
+    parser.add_argument('--fixed-difficulty', action='store_true',
+                        help='ask questions of every difficulty alike, not harder ones as the user score rises')
+    parser.add_argument('--users-db', default=USER_DATABASE_FILE, help='SQLite file of users, scores and answers')
+
+
+def add_timeout_arguments(parser):
+    """
+    adds the session timeout options of the servers.
+    :param parser: argparse parser.
+    :return: None.
+    """
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help='seconds without messages before a client is disconnected, 0 for never')
+    parser.add_argument('--login-timeout', type=float, default=LOGIN_TIMEOUT,
+                        help='seconds a new client has to log in, 0 for no limit')
+    parser.add_argument('--answer-timeout', type=float, default=ANSWER_TIMEOUT,
+                        help='seconds a client has to answer a question, 0 for no limit')
+    parser.add_argument('--room-answer-timeout', type=float, default=ROOM_ANSWER_TIMEOUT,
+                        help='seconds the players of a room have to answer the round question')
+
+
+def add_executor_arguments(parser):
+    """
+    adds the executor options to a server argument parser.
+    :param parser: argparse parser.
+    :return: None.
+    """
+    parser.add_argument('--executor-threads', type=int, default=EXECUTOR_THREADS,
+                        help='threads for blocking work, 0 runs it on the server loop')
+    parser.add_argument('--executor-queue', type=int, default=EXECUTOR_QUEUE_SIZE,
+                        help='jobs that may wait for a thread, clients get an ERROR for more')
+
+
+def add_login_arguments(parser):
+    """
+    adds the login limit, login token and admin options to a server argument parser.
+    :param parser: argparse parser.
+    :return: None.
+    """
+    parser.add_argument('--admins', default='', help='comma separated users that may reload the question bank')
+    parser.add_argument('--login-rate-ip', type=float, default=LOGIN_RATE_PER_IP,
+                        help='login and register attempts per second from a client ip, 0 for no limit')
+    parser.add_argument('--login-rate-user', type=float, default=LOGIN_RATE_PER_USER,
+                        help='login attempts per second for a username, 0 for no limit')
+    parser.add_argument('--login-token-ttl', type=float, default=LOGIN_TOKEN_TTL,
+                        help='seconds a login token lets a client log in again without the password, 0 for no tokens')
+
+
+def add_tls_arguments(parser):
+    """
+    adds the TLS options to a server argument parser.
+    :param parser: argparse parser.
+    :return: None.
+    """
+    parser.add_argument('--tls-cert', help='PEM certificate chain, serves TLS instead of plain TCP')
+    parser.add_argument('--tls-key', help='PEM private key, if it is not in the certificate file')
+
+
+def set_tls(cert_file, key_file=None):
+    """
+    :param cert_file: PEM certificate chain of the server, None to serve plain TCP.
+    :param key_file: PEM private key, None if it is in cert_file.
+    :return: None.
+    """
+    global TLS_CONTEXT
+    TLS_CONTEXT = tls.create_server_context(cert_file, key_file) if cert_file else None
+
+
+def set_login_limits(rate_per_ip, rate_per_user, token_ttl=LOGIN_TOKEN_TTL):
+    """
+    :param rate_per_ip: login and register attempts per second from a client ip, 0 for no limit.
+    :param rate_per_user: login attempts per second for a username, 0 for no limit.
+    :param token_ttl: seconds a login token can be used, 0 for no tokens.
+    :return: None.
+    """
+    global login_ip_buckets
+    global login_user_buckets
+    global LOGIN_TOKEN_TTL
+    login_ip_buckets = rate_limit.TokenBuckets(rate_per_ip, LOGIN_BURST_PER_IP) if rate_per_ip else None
+    login_user_buckets = rate_limit.TokenBuckets(rate_per_user, LOGIN_BURST_PER_USER) if rate_per_user else None
+    LOGIN_TOKEN_TTL = token_ttl
+
+
+def set_admin_users(names):
+    """
+    :param names: comma separated usernames of the admins.
+    :return: None.
+    """
+    global ADMIN_USERS
+    ADMIN_USERS = frozenset(name for name in names.split(',') if name)
+
+
+def set_data_files(args):
+    """
+    :param args: parsed options of add_data_arguments.
+    :return: None.
+    """
+    global QUESTIONS_FILE
+    global QUESTIONS_CACHE_FILE
+    global QUESTIONS_API_URL
+    global QUESTION_STATS_FILE
+    global ANSWER_LOG_DIR
+    global ADAPTIVE_DIFFICULTY
+    global USER_DATABASE_FILE
+    QUESTIONS_FILE = args.questions_file
+    QUESTIONS_CACHE_FILE = args.questions_cache
+    QUESTIONS_API_URL = args.questions_url
+    QUESTION_STATS_FILE = args.question_stats
+    ANSWER_LOG_DIR = args.answer_log
+    ADAPTIVE_DIFFICULTY = not args.fixed_difficulty
+    USER_DATABASE_FILE = args.users_db
+
+
+def set_timeouts(args):
+    """
+    :param args: parsed options of add_timeout_arguments.
+    :return: None.
+    """
+    global IDLE_TIMEOUT
+    global LOGIN_TIMEOUT
+    global ANSWER_TIMEOUT
+    global ROOM_ANSWER_TIMEOUT
+    IDLE_TIMEOUT = args.idle_timeout
+    LOGIN_TIMEOUT = args.login_timeout
+    ANSWER_TIMEOUT = args.answer_timeout
+    ROOM_ANSWER_TIMEOUT = args.room_answer_timeout
+
+
+def start_metrics_endpoint():
+    """
+    starts the Prometheus scrape endpoint on METRICS_PORT, if it is set.
+    :return: None.
+    """
+    if METRICS_PORT is not None:
+        metrics.serve_metrics(get_gauges, SERVER_IP, METRICS_PORT)
+        logger.info('Metrics on http://%s:%d/metrics', SERVER_IP, METRICS_PORT)
+
+
+def stop_server(signum, frame):
+    """
+    SIGTERM handler, writes the queued user changes before the process exits.
+    exits right away, the client handling in serve_select would swallow a SystemExit.
+    :return: None.
+    """
+    user_store.close_user_store()
+    answer_log.close_answer_log()
+    stop_logging()
+    os._exit(0)
+
+
+def sync_worker_scores():
+    """
+    timer callback of the workers, applies the score changes of the other workers to the score board of this one.
+    :return: None.
+    """
+    shared_state.read_score_changes(score_board)
+    timers.schedule(SCORE_SYNC_INTERVAL, sync_worker_scores)
+
+
+def run_worker():
+    """
+    worker process body, serves clients on its own SO_REUSEPORT listener with the game state in shared_state.
+    :return: None.
+    """
+    global shared_state_enabled
+    global users_information_dict
+    signal.signal(signal.SIGTERM, stop_server)
+    signal.signal(signal.SIGHUP, request_question_reload)
+    users_information_dict = load_user_database()
+    shared_state.connect_shared_state(USER_DATABASE_FILE)
+    shared_state_enabled = True
+    timers.schedule(SCORE_SYNC_INTERVAL, sync_worker_scores)
+    start_answer_log()
+    try:
+        serve_select(setup_socket(reuse_port=True))
+    finally:
+        for user in list(shared_state.order_leases):
+            shared_state.release_question_orders(user)
+        user_store.close_user_store()
+        answer_log.close_answer_log()
+
+
+def run_workers(workers_amount):
+    """
+    forks worker processes that all listen on the server port, and waits for them.
+    users and questions must already be loaded, the workers inherit them. question ids must be the same
+    in every worker, so workers serve the loaded bank and don't refill it.
+    :param workers_amount: amount of worker processes.
+    :return: None.
+    """
+    user_store.close_user_store()  # workers open their own connections, a forked sqlite connection can't be used
+    shared_state.init_shared_state(USER_DATABASE_FILE)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)  # until the workers set their handler
+    for _ in range(workers_amount):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker()
+            finally:
+                os._exit(0)
+        worker_pids.append(pid)
+    signal.signal(signal.SIGTERM, lambda signum, frame: exit())  # stop the workers too when we are terminated
+    signal.signal(signal.SIGHUP, forward_reload_signal)
+    logger.info('[SERVER] Started %d workers.', workers_amount)
+    try:
+        for pid in worker_pids:
+            os.waitpid(pid, 0)
+    finally:
+        for pid in worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+def main():
+
+    global users_information_dict
+    global questions
+    global METRICS_PORT
+    global EXECUTOR_THREADS
+    global EXECUTOR_QUEUE_SIZE
+    parser = argparse.ArgumentParser(description='Trivia server.')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes sharing the port (SO_REUSEPORT)')
+    parser.add_argument('--log-level', default='info', choices=LOG_LEVELS.keys())
+    parser.add_argument('--log-async', action='store_true', help='write the log from a background thread')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on this port (single process only)')
+    add_data_arguments(parser)
+    add_timeout_arguments(parser)
+    add_executor_arguments(parser)
+    add_login_arguments(parser)
+    add_tls_arguments(parser)
+    args = parser.parse_args()
+    setup_logging(args.log_level, args.log_async)
+    set_data_files(args)
+    set_timeouts(args)
+    set_tls(args.tls_cert, args.tls_key)  # before forking, so the workers share the session ticket key
+    set_login_limits(args.login_rate_ip, args.login_rate_user, args.login_token_ttl)
+    set_admin_users(args.admins)
+    EXECUTOR_THREADS = args.executor_threads
+    EXECUTOR_QUEUE_SIZE = args.executor_queue
+    METRICS_PORT = args.metrics_port
+    users_information_dict = load_user_database()
+    load_leaderboard()
+    questions = load_questions()
+    logger.info('Welcome to Trivia Server! %d questions loaded.', len(questions))
+    if args.workers > 1:
+        if METRICS_PORT is not None:
+            logger.warning('The metrics endpoint is served by single process servers only, use STATS per worker.')
+        try:
+            run_workers(args.workers)
+        finally:
+            stop_logging()
+    else:
+        start_executor()
+        start_question_refill()
+        start_metrics_endpoint()
+        start_answer_log()
+        server_socket = setup_socket()
+        signal.signal(signal.SIGTERM, stop_server)
+        signal.signal(signal.SIGHUP, request_question_reload)
+        try:
+            serve_select(server_socket)
+        finally:
+            user_store.close_user_store()
+            answer_log.close_answer_log()
+            stop_logging()
+
+
 if __name__ == '__main__':
     main()
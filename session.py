@@ -0,0 +1,44 @@
+import time  # For the session timestamps
+from collections import deque  # For the outgoing message queue
+import chatlib  # protocol versions
+
+
+class Session:
+    """
+    everything the server keeps for one client connection: who is logged in on it, the protocol version,
+    the receive buffer and the send queue. the server finds it by the socket fileno in O(1),
+    and everything is released at once when the client goes away.
+    """
+
+    __slots__ = ('conn', 'fileno', 'address', 'name', 'username', 'protocol_version', 'recv_buffer',
+                 'send_queue', 'send_queue_bytes', 'connected_at', 'last_active', 'login_timer', 'idle_timer',
+                 'question_id', 'question_bank', 'question_asked_at', 'question_timer', 'room', 'job_pending',
+                 'held_messages', 'login_token', 'send_waiter')
+
+    def __init__(self, conn, address, name):
+        """
+        :param conn: client socket.
+        :param address: address of the client, kept so the server never has to ask the socket for it.
+        :param name: name of the session that is unique across all worker processes.
+        """
+        self.conn = conn
+        self.fileno = conn.fileno()
+        self.address = address
+        self.name = name
+        self.username = None  # None until the client logs in
+        self.protocol_version = chatlib.PROTOCOL_TEXT
+        self.recv_buffer = bytearray()  # received bytes that are not a complete message yet
+        self.send_queue = deque()  # encoded messages waiting for the socket to be writable
+        self.send_queue_bytes = 0
+        self.connected_at = self.last_active = time.monotonic()
+        self.login_timer = None  # timer_wheel Timer of the login deadline, until the client logs in
+        self.idle_timer = None  # timer_wheel Timer that checks the session for idleness
+        self.question_id = None  # the question the client was asked and did not answer yet
+        self.question_bank = None  # QuestionBank the question is from, it is answered there after a reload
+        self.question_asked_at = 0.0
+        self.question_timer = None  # timer_wheel Timer of the answer deadline
+        self.room = None  # Room the client plays in, if any
+        self.job_pending = False  # True while an executor job of the client runs, e.g. loading the user at login
+        self.held_messages = deque()  # (cmd, data) that arrived while the job ran, handled once it is done
+        self.login_token = None  # login token the client got or logged in with, LOGOUT revokes it
+        self.send_waiter = None  # asyncio.Event of the asyncio server, set when data is queued for the client
@@ -0,0 +1,258 @@
+import os
+import sqlite3  # For a state store all worker processes can use at once
+import time
+import user_store  # the shared state lives in the user database
+import question_order
+
+BUSY_TIMEOUT_MS = 5000  # how long a worker waits for another worker's write to finish
+ORDER_LEASE = 8  # positions of a question order a worker reserves at once, see take_question_position
+SCORE_CHANGES_KEPT = 60  # seconds the score changes stay in the database for the other workers to read
+connection = None  # sqlite connection of the current process
+last_score_change = 0  # seq of the last score change read_score_changes went through
+order_leases = dict()  # username -> selection -> (question order with its generation, end of the reserved positions)
+
+
+def init_shared_state(path):
+    """
+    prepares the user database for the workers, should be called once by the parent before forking them.
+    scores and question orders are the users table of user_store, workers update them in place. every worker keeps
+    a score board, the score changes table tells it the changes of the other workers. the workers inherit the score
+    board of the parent, so the table starts empty.
+    :param path: path of the user database file.
+    :return: None.
+    """
+    db = sqlite3.connect(path)
+    db.executescript('''
+        DROP TABLE IF EXISTS logged_users;
+        CREATE TABLE logged_users (session TEXT PRIMARY KEY, username TEXT NOT NULL);
+        DROP TABLE IF EXISTS score_changes;
+        CREATE TABLE score_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, worker INTEGER NOT NULL,
+                                    username TEXT NOT NULL, points INTEGER NOT NULL, changed_at REAL NOT NULL);
+    ''')
+    db.commit()
+    db.close()
+
+
+def connect_shared_state(path):
+    """
+    opens the shared state for the current process, every worker needs its own connection after the fork.
+    :param path: path of the database file.
+    :return: None.
+    """
+    global connection
+    connection = sqlite3.connect(path, isolation_level=None, timeout=BUSY_TIMEOUT_MS / 1000)
+    connection.execute('PRAGMA synchronous=NORMAL')
+
+
+def add_score(username, points):
+    """
+    adds points to the user score with the next group commit, the score board of the worker has them already.
+    :param username: the user name.
+    :param points: points to add.
+    :return: None.
+    """
+    user_store.queue_write(write_score_change, os.getpid(), username, points)
+
+
+def write_score_change(db, worker, username, points):
+    """
+    group commit write of add_score, adds the points and tells the other workers.
+    :param db: sqlite connection of the user_store writer, in a transaction.
+    :param worker: pid of the worker the points were scored on.
+    :param username: the user name.
+    :param points: points to add.
+    :return: None.
+    """
+    db.execute('UPDATE users SET score = score + ? WHERE username = ?', (points, username))
+    db.execute('INSERT INTO score_changes (worker, username, points, changed_at) VALUES (?, ?, ?, ?)',
+               (worker, username, points, time.time()))
+
+
+def read_score_changes(score_board):
+    """
+    applies the score changes of the other workers since the last call to the score board of this worker,
+    and queues the removal of the changes every worker had time to read.
+    :param score_board: leaderboard.Leaderboard of the worker.
+    :return: amount of changes applied.
+    """
+    global last_score_change
+    worker = os.getpid()
+    applied = 0
+    for seq, changed_by, username, points in connection.execute(
+            'SELECT seq, worker, username, points FROM score_changes WHERE seq > ? ORDER BY seq',
+            (last_score_change,)):
+        if changed_by != worker:
+            score_board.add_score(username, points)
+            applied += 1
+        last_score_change = seq
+    user_store.queue_write(remove_score_changes, time.time() - SCORE_CHANGES_KEPT)
+    return applied
+
+
+def remove_score_changes(db, changed_before):
+    """
+    group commit write of read_score_changes.
+    :param db: sqlite connection of the user_store writer, in a transaction.
+    :param changed_before: time.time() of the newest change to remove.
+    :return: None.
+    """
+    db.execute('DELETE FROM score_changes WHERE changed_at < ?', (changed_before,))
+
+
+def add_user(username, password):
+    """
+    creates a new user right away, so every worker sees it, and puts it on the score boards of the other workers.
+    may be called from executor threads.
+    :param username: the user name.
+    :param password: the user password.
+    :return: True if the user was created, False if the username is taken.
+    """
+    db = user_store.get_read_connection()  # the connection of the calling thread
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        created = db.execute('INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)',
+                             (username, password)).rowcount == 1
+        if created:
+            db.execute('INSERT INTO score_changes (worker, username, points, changed_at) VALUES (?, ?, 0, ?)',
+                       (os.getpid(), username, time.time()))
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    return created
+
+
+def set_password(username, password):
+    """
+    :param username: the user name.
+    :param password: the new password hash.
+    :return: None.
+    """
+    connection.execute('UPDATE users SET password = ? WHERE username = ?', (password, username))
+
+
+def add_logged_user(session, username):
+    """
+    marks a user as logged in from a worker session, with the next group commit.
+    :param session: unique name of the session (worker and client address).
+    :param username: the user name.
+    :return: None.
+    """
+    user_store.queue_write(write_logged_user, session, username)
+
+
+def remove_logged_user(session):
+    """
+    :param session: unique name of the session (worker and client address).
+    :return: None.
+    """
+    user_store.queue_write(write_logged_user, session, None)
+
+
+def write_logged_user(db, session, username):
+    """
+    group commit write of add_logged_user and remove_logged_user.
+    :param db: sqlite connection of the user_store writer, in a transaction.
+    :param session: unique name of the session.
+    :param username: the user name, None if the session logged out.
+    :return: None.
+    """
+    if username is None:
+        db.execute('DELETE FROM logged_users WHERE session = ?', (session,))
+    else:
+        db.execute('INSERT OR REPLACE INTO logged_users VALUES (?, ?)', (session, username))
+
+
+def get_logged_users():
+    """
+    :return: list of the user names logged in on any worker, as of the last group commit of every worker.
+    """
+    return [row[0] for row in connection.execute('SELECT DISTINCT username FROM logged_users')]
+
+
+def get_question_orders(username):
+    """
+    :param username: the user name.
+    :return: dict of selection -> question order tuple of the user, see user_store.encode_question_orders.
+    """
+    row = connection.execute('SELECT question_order FROM users WHERE username = ?', (username,)).fetchone()
+    return user_store.decode_question_orders(row[0] if row else None)
+
+
+def take_question_position(username, selection, generation, size):
+    """
+    advances the user question order of a selection by one question, atomically across the workers: two
+    connections of the same user on two workers never get the same question. a worker reserves ORDER_LEASE positions
+    of the order in one transaction and hands them out without touching the database, another worker serving the
+    user meanwhile reserves the positions after them.
+    :param username: the user name.
+    :param selection: (category id, difficulty id) the order walks, None for the whole bank.
+    :param generation: generation of the bank the server asks from.
+    :param size: amount of questions in the selection.
+    :return: (position in the selection, or None if the user was asked every question of it, the question order).
+    """
+    leases = order_leases.setdefault(username, dict())
+    lease = leases.get(selection)
+    if lease is not None:
+        stored_order, lease_end = lease
+        if stored_order[0] == generation and stored_order[-1] < lease_end:
+            position, order = question_order.next_question_index(stored_order[1:], size)
+            leases[selection] = (question_order.get_stored_order(order, generation), lease_end)
+            return position, order
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        orders = get_question_orders(username)
+        stored_order = orders.get(selection, question_order.EMPTY_QUESTION_ORDER)
+        order = question_order.get_bank_order(stored_order, generation, size)
+        changed = order is question_order.EMPTY_QUESTION_ORDER and stored_order is not order
+        if changed:
+            orders.clear()  # the bank changed, the orders of the other selections walk the old one
+        position, order = question_order.next_question_index(order, size)
+        if position is not None:
+            lease_end = min(order[-1] - 1 + ORDER_LEASE, order[1])
+            orders[selection] = question_order.get_stored_order(order[:-1] + (lease_end,), generation)
+            changed = True
+        if changed:
+            connection.execute('UPDATE users SET question_order = ? WHERE username = ?',
+                               (user_store.encode_question_orders(orders), username))
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    if position is not None:
+        leases[selection] = (question_order.get_stored_order(order, generation), lease_end)
+    return position, order
+
+
+def release_question_orders(username):
+    """
+    gives back the reserved positions the worker did not hand out, once the user logged out of it. the write waits
+    for the next group commit, an order another worker reserved positions of since is kept as it is.
+    :param username: the user name.
+    :return: None.
+    """
+    leases = order_leases.pop(username, None)
+    if leases:
+        user_store.queue_write(write_released_orders, username,
+                               {selection: (stored_order[:-1] + (lease_end,), stored_order)
+                                for selection, (stored_order, lease_end) in leases.items()})
+
+
+def write_released_orders(db, username, released):
+    """
+    group commit write of release_question_orders.
+    :param db: sqlite connection of the user_store writer, in a transaction.
+    :param username: the user name.
+    :param released: selection -> (the order as it was reserved, the order with the positions handed out).
+    :return: None.
+    """
+    row = db.execute('SELECT question_order FROM users WHERE username = ?', (username,)).fetchone()
+    orders = user_store.decode_question_orders(row[0] if row else None)
+    changed = False
+    for selection, (reserved_order, stored_order) in released.items():
+        if orders.get(selection) == reserved_order:
+            orders[selection] = stored_order
+            changed = True
+    if changed:
+        db.execute('UPDATE users SET question_order = ? WHERE username = ?',
+                   (user_store.encode_question_orders(orders), username))
@@ -0,0 +1,119 @@
+import time  # For the clock the wheel turns with
+from math import ceil
+
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS  # slots in every level of the wheel
+SLOT_MASK = SLOTS - 1
+
+
+class Timer:
+    """
+    a callback waiting in a TimerWheel, returned by schedule() so it can be cancelled.
+    """
+
+    __slots__ = ('expires', 'callback', 'args', 'slot')
+
+    def __init__(self, expires, callback, args):
+        self.expires = expires  # tick the timer fires at
+        self.callback = callback
+        self.args = args
+        self.slot = None  # set of the slot the timer waits in, None once it fired or was cancelled
+
+
+class TimerWheel:
+    """
+    hierarchical timer wheel: level 0 has a slot for each of the next SLOTS ticks, every level above it
+    has a slot for SLOTS times longer than a slot of the level below.
+    timers far away wait in a high level, and move down a level each time its slot comes up.
+    schedule and cancel are O(1). a tick costs O(1) plus the timers that fire or move down on it,
+    no matter how many timers are waiting.
+    """
+
+    __slots__ = ('tick', 'levels', 'wheels', 'start', 'current', 'timers_amount')
+
+    def __init__(self, tick=0.1, levels=4):
+        """
+        :param tick: seconds per tick, timers fire at most a tick late (plus however late advance is called).
+        :param levels: levels of the wheel, timers can be up to tick * SLOTS ** levels seconds away.
+        """
+        self.tick = tick
+        self.levels = levels
+        self.wheels = [[set() for _ in range(SLOTS)] for _ in range(levels)]
+        self.start = time.monotonic()
+        self.current = 0  # last tick that was processed
+        self.timers_amount = 0
+
+    def __len__(self):
+        return self.timers_amount
+
+    def schedule(self, delay, callback, *args):
+        """
+        calls callback(*args) from advance() once delay seconds passed.
+        :param delay: seconds from now.
+        :param callback: function to call.
+        :return: the Timer, for cancel().
+        """
+        expires = ceil((time.monotonic() - self.start + delay) / self.tick)
+        timer = Timer(max(expires, self.current + 1), callback, args)
+        self.add(timer)
+        self.timers_amount += 1
+        return timer
+
+    def cancel(self, timer):
+        """
+        :param timer: Timer returned by schedule(), may have fired or been cancelled already.
+        :return: None.
+        """
+        if timer is not None and timer.slot is not None:
+            timer.slot.discard(timer)
+            timer.slot = None
+            self.timers_amount -= 1
+
+    def add(self, timer):
+        """
+        puts a timer in the slot of the lowest level that reaches its tick.
+        :param timer: Timer that is not in any slot.
+        :return: None.
+        """
+        delta = timer.expires - self.current
+        expires = timer.expires
+        level = 0
+        while delta >= SLOTS ** (level + 1):
+            level += 1
+            if level == self.levels:  # too far away, wait in the last slot that can be reached and check again there
+                level -= 1
+                expires = self.current + SLOTS ** self.levels - 1
+                break
+        timer.slot = self.wheels[level][(expires >> (SLOT_BITS * level)) & SLOT_MASK]
+        timer.slot.add(timer)
+
+    def advance(self, now=None):
+        """
+        processes every tick up to now, calling the callbacks of the timers that expired.
+        callbacks may schedule and cancel timers.
+        :param now: time.monotonic() value, now if None.
+        :return: amount of timers that fired.
+        """
+        if now is None:
+            now = time.monotonic()
+        target = int((now - self.start) / self.tick)
+        fired = 0
+        while self.current < target:
+            self.current += 1
+            # the timers of the higher level slots that come up now move down to the levels below.
+            level = 1
+            while level < self.levels and not self.current & ((1 << (SLOT_BITS * level)) - 1):
+                index = (self.current >> (SLOT_BITS * level)) & SLOT_MASK
+                moving = self.wheels[level][index]
+                self.wheels[level][index] = set()
+                for timer in moving:
+                    self.add(timer)
+                level += 1
+            expired = self.wheels[0][self.current & SLOT_MASK]
+            while expired:
+                timer = expired.pop()
+                timer.slot = None
+                self.timers_amount -= 1
+                fired += 1
+                timer.callback(*timer.args)
+        return fired
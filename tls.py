@@ -0,0 +1,67 @@
+import ssl  # For the TLS contexts and sockets
+
+SESSION_TICKETS = 2  # session tickets the server gives a client after a full handshake, one per reconnect
+client_sessions = dict()  # (client context, server host, port) -> TLS session of the last connection
+
+
+def create_server_context(cert_file, key_file=None):
+    """
+    creates the TLS context of the server. the session tickets it issues are encrypted with a key of the context,
+    so worker processes forked after it was created resume the sessions of each other.
+    :param cert_file: PEM file of the server certificate chain.
+    :param key_file: PEM file of the private key, None if it is in cert_file.
+    :return: the ssl.SSLContext.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(cert_file, key_file)
+    context.num_tickets = SESSION_TICKETS
+    return context
+
+
+def create_client_context(ca_file=None, verify=True):
+    """
+    creates the TLS context of a client.
+    :param ca_file: PEM file of the certificates to trust, e.g. a self-signed server certificate. None for the
+    system certificates.
+    :param verify: False to accept any server certificate, for tests only.
+    :return: the ssl.SSLContext.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif ca_file is not None:
+        context.load_verify_locations(ca_file)
+    else:
+        context.load_default_certs()
+    return context
+
+
+def wrap_client_socket(context, sock, server_hostname):
+    """
+    starts TLS on a connected client socket, resuming the session of the last connection to the same server
+    if there is one: a resumed handshake skips the certificate and the key exchange signature.
+    :param context: client ssl.SSLContext.
+    :param sock: connected socket, the handshake follows its timeout.
+    :param server_hostname: host name or ip of the server, checked against the server certificate.
+    :return: the ssl.SSLSocket.
+    """
+    session = client_sessions.get((context, server_hostname, sock.getpeername()[1]))
+    return context.wrap_socket(sock, server_hostname=server_hostname, session=session)
+
+
+def save_session(sock):
+    """
+    keeps the TLS session of a connection for the next connection to the same server. with TLS 1.3 the server
+    sends the session tickets after the handshake, call it once a response was read. a resumed connection keeps
+    the session it resumed, its ticket is good until the server lets it expire, and copying a session is not free.
+    :param sock: ssl.SSLSocket of wrap_client_socket.
+    :return: None.
+    """
+    if sock.session_reused:
+        return
+    session = sock.session
+    if session is not None:
+        client_sessions[(sock.context, sock.server_hostname, sock.getpeername()[1])] = session
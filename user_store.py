@@ -0,0 +1,237 @@
+import sqlite3  # For keeping users, scores and answers on disk
+import threading  # For writing to disk off the server loop
+import time
+import question_order
+import credentials  # password hashes of the default users
+
+FLUSH_INTERVAL = 1  # seconds between two group commits of the queued writes
+BUSY_TIMEOUT = 5  # seconds to wait for a write of another process to finish
+DEFAULT_USERS = {'test': 'test', 'yossi': '123', 'master': 'master'}  # users of a new database
+connection = None  # read connection of the server loop
+connection_thread = None  # ident of the thread that opened the store, the server loop
+database_path = None
+thread_connections = threading.local()  # read connections of executor threads, a connection is used by one thread
+pending_users = dict()  # username -> (password, score, question orders dict) waiting for the next group commit
+pending_answers = list()  # (username, question_id, answered_at) waiting for the next group commit
+pending_writes = list()  # (function, args) of the shared state of worker processes, run in order in the commit
+flushing_users = dict()  # users being written right now, still newer than what a read would find on disk
+pending_lock = threading.Lock()
+stop_writer = threading.Event()
+writer_thread = None
+
+
+def encode_question_orders(orders):
+    """
+    :param orders: dict of selection -> question order tuple. the selection is (category id, difficulty id) with None
+    for any, the order over the whole bank is under None.
+    :return: the orders as a database text field, the order over the whole bank first, then category.difficulty:order
+    of every selection, separated by ';'.
+    """
+    fields = [','.join(map(str, orders.get(None, question_order.EMPTY_QUESTION_ORDER)))]
+    for selection, order in orders.items():
+        if selection is not None:
+            category, difficulty = ('' if value is None else value for value in selection)
+            fields.append(f'{category}.{difficulty}:{",".join(map(str, order))}')
+    return ';'.join(fields)
+
+
+def decode_question_orders(text):
+    """
+    :param text: question order database text field, or None. older servers kept a single order there.
+    :return: dict of selection -> question order tuple, see encode_question_orders.
+    """
+    orders = dict()
+    if not text:
+        return orders
+    whole_bank, *selections = text.split(';')
+    orders[None] = tuple(map(int, whole_bank.split(',')))
+    for field in selections:
+        selection, order = field.split(':')
+        category, difficulty = (int(value) if value else None for value in selection.split('.'))
+        orders[(category, difficulty)] = tuple(map(int, order.split(',')))
+    return orders
+
+
+def open_user_store(path):
+    """
+    opens the user database (creating it with DEFAULT_USERS if needed) and starts the background writer.
+    :param path: path of the database file.
+    :return: None.
+    """
+    global connection
+    global connection_thread
+    global database_path
+    global writer_thread
+    connection = sqlite3.connect(path, isolation_level=None, timeout=BUSY_TIMEOUT)
+    connection_thread = threading.get_ident()
+    database_path = path
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT NOT NULL,
+                                          score INTEGER NOT NULL DEFAULT 0, question_order TEXT);
+        CREATE INDEX IF NOT EXISTS users_by_score ON users (score DESC);
+        CREATE TABLE IF NOT EXISTS answers (username TEXT NOT NULL, question_id INTEGER NOT NULL,
+                                            answered_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS answers_by_user ON answers (username);
+    ''')
+    connection.execute('BEGIN')
+    if connection.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0:
+        connection.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                               [(username, credentials.hash_password(password))
+                                for username, password in DEFAULT_USERS.items()])
+    connection.execute('COMMIT')
+    stop_writer.clear()
+    writer_thread = threading.Thread(target=writer_loop, args=(path,), name='user-store-writer', daemon=True)
+    writer_thread.start()
+
+
+def close_user_store():
+    """
+    writes everything still queued and closes the database.
+    :return: None.
+    """
+    global connection
+    global writer_thread
+    if writer_thread is not None:
+        stop_writer.set()
+        writer_thread.join()
+        writer_thread = None
+    if connection is not None:
+        connection.close()
+        connection = None
+
+
+def get_read_connection():
+    """
+    :return: the read connection of the calling thread, other threads than the server loop get their own.
+    """
+    if threading.get_ident() == connection_thread:
+        return connection
+    path, thread_connection = getattr(thread_connections, 'connection', (None, None))
+    if path != database_path:  # first use in this thread, or the store was opened again since
+        if thread_connection is not None:
+            thread_connection.close()
+        thread_connection = sqlite3.connect(database_path, isolation_level=None, timeout=BUSY_TIMEOUT)
+        thread_connections.connection = (database_path, thread_connection)
+    return thread_connection
+
+
+def load_user(username):
+    """
+    reads a user, including changes that were not written to disk yet. may be called from executor threads.
+    :param username: the user name.
+    :return: dict with password, score and question_orders, or None if there is no such user.
+    """
+    with pending_lock:
+        pending = pending_users.get(username) or flushing_users.get(username)
+    if pending is None:
+        pending = get_read_connection().execute('SELECT password, score, question_order FROM users WHERE username = ?',
+                                     (username,)).fetchone()
+        if pending is None:
+            return None
+    password, score, orders = pending
+    if isinstance(orders, dict):
+        return {'password': password, 'score': score, 'question_orders': dict(orders)}
+    return {'password': password, 'score': score, 'question_orders': decode_question_orders(orders)}
+
+
+def iter_scores():
+    """
+    :return: iterator of (username, score) of every user in the database.
+    """
+    return connection.execute('SELECT username, score FROM users')
+
+
+def save_user(username, user):
+    """
+    queues the user for the next group commit, never waits for the disk. the question orders are encoded
+    by the writer, once per commit.
+    :param username: the user name.
+    :param user: dict with password, score and question_orders.
+    :return: None.
+    """
+    with pending_lock:
+        pending_users[username] = (user['password'], user['score'], dict(user['question_orders']))
+
+
+def register_user(username, password):
+    """
+    adds a new user with no score right away, not with the group commit, so of two registrations of the same name
+    only one gets it. may be called from executor threads.
+    :param username: the user name.
+    :param password: the user password.
+    :return: True if the user was created, False if the user name is taken.
+    """
+    return get_read_connection().execute('INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)',
+                                         (username, password)).rowcount == 1
+
+
+def save_answer(username, question_id):
+    """
+    queues an answered question for the next group commit, never waits for the disk.
+    :param username: the user name.
+    :param question_id: id of the answered question.
+    :return: None.
+    """
+    with pending_lock:
+        pending_answers.append((username, question_id, time.time()))
+
+
+def queue_write(function, *args):
+    """
+    queues a write of the shared state of the workers (see shared_state) for the next group commit,
+    never waits for the disk.
+    :param function: called with the writer connection and args, inside the transaction of the commit.
+    :return: None.
+    """
+    with pending_lock:
+        pending_writes.append((function, args))
+
+
+def flush_pending(db):
+    """
+    writes every queued change in a single transaction.
+    :param db: sqlite connection of the writer.
+    :return: None.
+    """
+    global pending_users
+    global pending_answers
+    global pending_writes
+    global flushing_users
+    with pending_lock:
+        users, answers, writes = pending_users, pending_answers, pending_writes
+        pending_users, pending_answers, pending_writes = dict(), list(), list()
+        flushing_users = users
+    if users or answers or writes:
+        try:
+            with db:
+                db.execute('BEGIN IMMEDIATE')  # the writes of the shared state read what they update
+                db.executemany('INSERT INTO users VALUES (?, ?, ?, ?) ON CONFLICT (username) DO UPDATE SET '
+                               'password = excluded.password, score = excluded.score, '
+                               'question_order = excluded.question_order',
+                               [(username, password, score, encode_question_orders(orders))
+                                for username, (password, score, orders) in users.items()])
+                db.executemany('INSERT INTO answers VALUES (?, ?, ?)', answers)
+                for function, args in writes:
+                    function(db, *args)
+        except sqlite3.Error:
+            with pending_lock:  # try again in the next group commit, without overwriting newer changes
+                for username, user in users.items():
+                    pending_users.setdefault(username, user)
+                pending_answers[:0] = answers
+                pending_writes[:0] = writes
+    with pending_lock:
+        flushing_users = dict()
+
+
+def writer_loop(path):
+    """
+    background writer body, group commits the queued changes every FLUSH_INTERVAL seconds.
+    :param path: path of the database file.
+    :return: None.
+    """
+    db = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    while not stop_writer.wait(FLUSH_INTERVAL):
+        flush_pending(db)
+    flush_pending(db)
+    db.close()